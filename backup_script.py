@@ -7,20 +7,37 @@ DumpItAll - Универсальная система автоматическо
 """
 
 import os
+import io
+import base64
+import hashlib
+import hmac
 import json
 import time
+import queue
+import shutil
+import signal
+import socket
+import tarfile
+import tempfile
+import threading
 import subprocess
+import zlib
+import xml.etree.ElementTree as ET
 import schedule
 import psutil
 import docker
 import sqlite3
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
 from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient.http import MediaIoBaseUpload, MediaIoBaseDownload
 from google.oauth2.service_account import Credentials
+from google.auth.transport.requests import AuthorizedSession
 import logging
 import glob
+import re
 from pathlib import Path
+from urllib.parse import quote
 
 # Настройка логирования
 logging.basicConfig(
@@ -532,6 +549,4279 @@ if (typeof db !== 'undefined') {{
         print("=" * 60)
 
 
+class HashingTee:
+    """Контрольные суммы записываемого потока (MD5, SHA-256, xxHash64), считаемые в отдельном потоке"""
+
+    ALGORITHMS = ('md5', 'sha256', 'xxh64')
+
+    def __init__(self, queue_size=64):
+        self.hashers = {}
+        for name in self.ALGORITHMS:
+            if name == 'xxh64':
+                try:
+                    import xxhash
+                    self.hashers[name] = xxhash.xxh64()
+                except ImportError:
+                    logging.debug("Модуль xxhash не установлен, xxHash64 не считается")
+            else:
+                self.hashers[name] = hashlib.new(name)
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.thread = None
+        self.digests = None
+
+    def update(self, data):
+        if not data:
+            return
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='hashing-tee', daemon=True)
+            self.thread.start()
+        # Копия: буфер приемника может переиспользоваться после возврата из write
+        self.queue.put(bytes(data))
+
+    def _run(self):
+        while True:
+            chunk = self.queue.get()
+            if chunk is None:
+                return
+            for hasher in self.hashers.values():
+                hasher.update(chunk)
+
+    def finish(self):
+        """Дожидается обработки очереди и возвращает суммы в hex"""
+        if self.digests is None:
+            if self.thread is not None:
+                self.queue.put(None)
+                self.thread.join()
+            self.digests = {name: hasher.hexdigest() for name, hasher in self.hashers.items()}
+        return self.digests
+
+    @classmethod
+    def of_file(cls, path):
+        """Суммы готового файла (для файлов, записанных не через этап сжатия)"""
+        tee = cls()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                for hasher in tee.hashers.values():
+                    hasher.update(chunk)
+        return tee.finish()
+
+
+class CompressedWriter(io.RawIOBase):
+    """Потоковый писатель: сжимает данные на лету и пишет их в приемник (файл или загрузку)"""
+    def __init__(self, raw, codec, level, threads=0, close_raw=True, hashing=True):
+        self.raw = raw
+        self.codec = codec
+        self.level = level
+        self.close_raw = close_raw
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.hashes = HashingTee() if hashing else None
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+        # Время внутри кодека и приемника: остальное время поток ждал данные от источника
+        self.write_seconds = 0.0
+
+        # Образец начала потока для бенчмарка кодеков (режим auto)
+        self.sample = None
+        self.sample_limit = 0
+        self.on_close = None
+
+        # Начало и конец несжатого потока для проверки копии без локального файла
+        self.head = None
+        self.tail = None
+
+        sink = _CountingSink(raw, self)
+
+        if codec == 'zstd':
+            import zstandard
+            compressor = zstandard.ZstdCompressor(level=level, threads=threads)
+            self._stream = compressor.stream_writer(sink, closefd=False)
+        elif codec == 'gzip':
+            import gzip
+            self._stream = gzip.GzipFile(fileobj=sink, mode='wb', compresslevel=level, mtime=0)
+        elif codec == 'lz4':
+            import lz4.frame
+            self._stream = lz4.frame.LZ4FrameFile(sink, mode='wb', compression_level=level)
+        else:
+            self._stream = sink
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        if self.sample is not None and len(self.sample) < self.sample_limit:
+            self.sample.extend(data[:self.sample_limit - len(self.sample)])
+        if self.head is not None:
+            if len(self.head) < 64:
+                self.head.extend(data[:64 - len(self.head)])
+            self.tail = bytes(data[-4096:]) if len(data) >= 4096 else (self.tail + bytes(data))[-4096:]
+        started = time.monotonic()
+        self._stream.write(data)
+        self.write_seconds += time.monotonic() - started
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._stream is not None and not isinstance(self._stream, _CountingSink):
+                self._stream.close()
+            if self.close_raw:
+                self.raw.close()
+            else:
+                self.raw.flush()
+        finally:
+            super().close()
+            if self.hashes:
+                self.hashes.finish()
+            self.elapsed = time.monotonic() - self.started
+
+        if self.on_close:
+            try:
+                self.on_close(self)
+            except Exception as e:
+                logging.warning(f"⚠️ Ошибка обработки завершения потока сжатия: {e}")
+
+
+class _CountingSink:
+    """Обертка над приемником, считающая количество записанных (сжатых) байт"""
+    def __init__(self, raw, owner):
+        self.raw = raw
+        self.owner = owner
+
+    def write(self, data):
+        self.owner.bytes_out += len(data)
+        if self.owner.hashes:
+            self.owner.hashes.update(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        if hasattr(self.raw, 'flush'):
+            self.raw.flush()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.owner.bytes_out
+
+
+class CompressionStage:
+    """Подключаемый этап сжатия между источником дампа и файлом/загрузкой"""
+
+    # Расширения файлов для каждого кодека
+    EXTENSIONS = {'zstd': '.zst', 'gzip': '.gz', 'lz4': '.lz4', 'none': ''}
+
+    # Python-модули, необходимые для кодеков
+    MODULES = {'zstd': 'zstandard', 'gzip': 'gzip', 'lz4': 'lz4.frame'}
+
+    # Уровни сжатия по умолчанию для каждой СУБД
+    DEFAULT_LEVELS = {
+        'postgresql': {'zstd': 3, 'gzip': 6, 'lz4': 0},      # pg_dump запускается с --compress=0
+        'mysql': {'zstd': 6, 'gzip': 6, 'lz4': 1},           # SQL текст сжимается в 5-10 раз
+        'mongodb': {'zstd': 3, 'gzip': 5, 'lz4': 0},
+        'redis': {'zstd': 1, 'gzip': 1, 'lz4': 0},           # RDB уже частично сжат (LZF)
+        'sqlite': {'zstd': 6, 'gzip': 6, 'lz4': 1},
+        'elasticsearch': {'zstd': 9, 'gzip': 6, 'lz4': 1},
+        'couchdb': {'zstd': 9, 'gzip': 6, 'lz4': 1},
+        'default': {'zstd': 3, 'gzip': 6, 'lz4': 0}
+    }
+
+    def __init__(self, codec='zstd', level=None, threads=0, tuner=None):
+        self.threads = threads
+        self.level_override = level
+        self.tuner = tuner
+        self.codec = self.resolve_codec(codec)
+        self.checksums = {}
+        # Завершенные потоки режима auto: в историю попадают только успешные дампы
+        self.pending_tuning = {}
+
+    def is_available(self, codec):
+        """Проверка наличия Python-модуля для кодека"""
+        if codec == 'none':
+            return True
+        if codec not in self.MODULES:
+            return False
+        try:
+            __import__(self.MODULES[codec])
+            return True
+        except ImportError:
+            return False
+
+    def resolve_codec(self, codec):
+        """Выбор доступного кодека с откатом на gzip"""
+        codec = (codec or 'none').lower()
+        if codec in ('off', 'no', 'false', '0'):
+            codec = 'none'
+
+        if codec == 'auto':
+            if self.tuner:
+                return 'auto'
+            logging.warning("⚠️ Режим auto требует истории сжатия, используется zstd")
+            codec = 'zstd'
+
+        if codec not in self.EXTENSIONS:
+            logging.warning(f"⚠️ Неизвестный кодек сжатия '{codec}', используется gzip")
+            return 'gzip'
+
+        if not self.is_available(codec):
+            logging.warning(f"⚠️ Модуль {self.MODULES[codec]} не установлен, используется gzip вместо {codec}")
+            return 'gzip'
+
+        return codec
+
+    @property
+    def enabled(self):
+        return self.codec != 'none'
+
+    def level_for(self, db_type, codec=None):
+        """Уровень сжатия для СУБД"""
+        codec = codec or self.codec
+        if self.level_override is not None:
+            return self.level_override
+        levels = self.DEFAULT_LEVELS.get(db_type, self.DEFAULT_LEVELS['default'])
+        return levels.get(codec, 0)
+
+    def select(self, db_type, target=None):
+        """Выбор кодека и уровня для цели (с учетом истории в режиме auto)"""
+        if self.codec != 'auto':
+            return self.codec, self.level_for(db_type)
+
+        choice = self.tuner.choose(target, self.is_available)
+        if choice:
+            return choice
+
+        # Истории еще нет: используем лучший доступный кодек по умолчанию
+        codec = 'zstd' if self.is_available('zstd') else 'gzip'
+        return codec, self.level_for(db_type, codec)
+
+    def final_path(self, path, codec=None):
+        """Путь к файлу с учетом расширения кодека"""
+        return path + self.EXTENSIONS[codec or self.codec]
+
+    def wrap(self, fileobj, db_type, codec=None, level=None, close_raw=True, target=None):
+        """Обертывание произвольного приемника (файл, поток загрузки) в сжимающий писатель"""
+        if codec is None:
+            codec, selected_level = self.select(db_type, target)
+            if level is None:
+                level = selected_level
+        elif level is None:
+            level = self.level_for(db_type, codec)
+
+        writer = CompressedWriter(fileobj, codec, level, threads=self.threads, close_raw=close_raw)
+
+        if self.codec == 'auto' and target and self.tuner.needs_benchmark(target):
+            writer.sample = bytearray()
+            writer.sample_limit = self.tuner.sample_bytes
+
+        return writer
+
+    @staticmethod
+    def open_reader(path, codec):
+        """Чтение резервной копии с распаковкой на лету"""
+        if codec == 'repository':
+            return ChunkRepository.open_reader(path)
+        if codec == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True,
+                                                              closefd=True)
+        if codec == 'gzip':
+            import gzip
+            return gzip.open(path, 'rb')
+        if codec == 'lz4':
+            import lz4.frame
+            return lz4.frame.open(path, 'rb')
+        return open(path, 'rb')
+
+    def open(self, path, db_type, codec=None, level=None, target=None):
+        """Открытие файла резервной копии для потоковой записи со сжатием"""
+        if codec is None:
+            codec, level = self.select(db_type, target)
+        return self.open_stream(open(self.final_path(path, codec), 'wb'), path, db_type, codec, level, target)
+
+    def open_stream(self, raw, path, db_type, codec=None, level=None, target=None):
+        """Сжимающий писатель в произвольный приемник с учетом контрольных сумм под именем path"""
+        if codec is None:
+            codec, level = self.select(db_type, target)
+        final_path = self.final_path(path, codec)
+        writer = self.wrap(raw, db_type, codec=codec, level=level, target=target)
+
+        # Суммы записанного файла считаются на лету: MD5 - для сравнения с md5Checksum на Drive,
+        # SHA-256 и xxHash64 - для манифеста запуска
+        def on_close(w):
+            self.checksums[final_path] = w.hashes.finish()
+            if self.codec == 'auto' and target:
+                self.pending_tuning[final_path] = (target, w)
+
+        writer.on_close = on_close
+        return writer, final_path
+
+    def record_success(self, final_path):
+        """Учет потока в истории автоподбора после успешного дампа"""
+        pending = self.pending_tuning.pop(final_path, None)
+        if pending:
+            target, writer = pending
+            self.tuner.record_stream(target, writer, self.is_available)
+
+
+class CompressionTuner:
+    """Автоподбор кодека сжатия по сохраненной истории бенчмарков каждой цели"""
+
+    # Пары кодек/уровень, участвующие в бенчмарке
+    CANDIDATES = [
+        ('none', 0),
+        ('lz4', 0),
+        ('gzip', 1), ('gzip', 6),
+        ('zstd', 1), ('zstd', 3), ('zstd', 9), ('zstd', 15)
+    ]
+
+    def __init__(self, history_file, sample_bytes=8 * 1024 * 1024, max_age_days=7,
+                 default_upload_mbps=10.0, threads=0):
+        self.history_file = history_file
+        self.sample_bytes = sample_bytes
+        self.max_age_days = max_age_days
+        self.default_upload_mbps = default_upload_mbps
+        self.threads = threads
+        self.lock = threading.Lock()
+        self.history = self._load()
+
+    def _load(self):
+        """Загрузка истории из файла"""
+        try:
+            if os.path.exists(self.history_file):
+                with open(self.history_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось прочитать историю сжатия: {e}")
+        return {'targets': {}, 'upload_mbps': None}
+
+    def _save(self):
+        """Сохранение истории в файл"""
+        try:
+            tmp_file = self.history_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.history, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.history_file)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения истории сжатия: {e}")
+
+    @property
+    def upload_mbps(self):
+        return self.history.get('upload_mbps') or self.default_upload_mbps
+
+    def needs_benchmark(self, target):
+        """Нужен ли новый бенчмарк для цели (нет истории или она устарела)"""
+        entry = self.history['targets'].get(target)
+        if not entry or not entry.get('results'):
+            return True
+        age = time.time() - entry.get('benchmarked_at', 0)
+        return age > self.max_age_days * 24 * 60 * 60
+
+    def choose(self, target, is_available):
+        """Выбор пары кодек/уровень с минимальным временем дамп + загрузка"""
+        entry = self.history['targets'].get(target)
+        if not entry or not entry.get('results'):
+            return None
+
+        # Скорость самого дампа ограничивает поток сверху
+        dump_mbps = entry.get('dump_mbps') or float('inf')
+        best = None
+
+        for key, result in entry['results'].items():
+            codec, level = key.split(':')
+            if not is_available(codec) or not result.get('mbps') or not result.get('ratio'):
+                continue
+
+            stream_mbps = min(dump_mbps, result['mbps'])
+            seconds_per_mb = 1 / stream_mbps + 1 / (result['ratio'] * self.upload_mbps)
+
+            if best is None or seconds_per_mb < best[0]:
+                best = (seconds_per_mb, codec, int(level))
+
+        if best is None:
+            return None
+
+        logging.debug(f"Автовыбор сжатия для {target}: {best[1]}:{best[2]} ({best[0]:.3f} с/МБ)")
+        return best[1], best[2]
+
+    def benchmark(self, sample, is_available):
+        """Короткий бенчмарк всех кандидатов на образце данных"""
+        results = {}
+        size_mb = len(sample) / (1024 * 1024)
+
+        for codec, level in self.CANDIDATES:
+            if not is_available(codec):
+                continue
+            sink = io.BytesIO()
+            started = time.perf_counter()
+            writer = CompressedWriter(sink, codec, level, threads=self.threads, close_raw=False, hashing=False)
+            writer.write(bytes(sample))
+            writer.close()
+            elapsed = max(time.perf_counter() - started, 1e-6)
+
+            results[f"{codec}:{level}"] = {
+                'ratio': round(len(sample) / max(writer.bytes_out, 1), 3),
+                'mbps': round(size_mb / elapsed, 2)
+            }
+
+        return results
+
+    def record_stream(self, target, writer, is_available):
+        """Учет завершенного потока: скорость дампа и бенчмарк образца"""
+        with self.lock:
+            entry = self.history['targets'].setdefault(target, {})
+
+            # Скорость источника без времени сжатия и записи, иначе она зависит от выбранного кодека
+            source_seconds = writer.elapsed - writer.write_seconds
+            if source_seconds > 0 and writer.bytes_in:
+                entry['dump_mbps'] = round(writer.bytes_in / (1024 * 1024) / source_seconds, 2)
+            entry['last_codec'] = f"{writer.codec}:{writer.level}"
+
+            if writer.sample and len(writer.sample) >= 64 * 1024:
+                entry['results'] = self.benchmark(writer.sample, is_available)
+                entry['benchmarked_at'] = time.time()
+                logging.info(f"📊 Бенчмарк сжатия для {target}: "
+                             + ', '.join(f"{k} x{v['ratio']} {v['mbps']} МБ/с" for k, v in entry['results'].items()))
+
+            self._save()
+
+    def record_upload(self, size_bytes, seconds):
+        """Учет измеренной пропускной способности загрузки (скользящее среднее)"""
+        if seconds <= 0 or size_bytes < 1024 * 1024:
+            return
+        measured = size_bytes / (1024 * 1024) / seconds
+        with self.lock:
+            previous = self.history.get('upload_mbps')
+            self.history['upload_mbps'] = round(measured if not previous else 0.7 * previous + 0.3 * measured, 2)
+            self._save()
+
+
+class BackupInventory:
+    """Инвентарь целей резервного копирования: отпечатки изменений и последние копии"""
+    def __init__(self, inventory_file):
+        self.inventory_file = inventory_file
+        self.lock = threading.Lock()
+        self.targets = self._load()
+
+    def _load(self):
+        """Загрузка инвентаря из файла"""
+        try:
+            if os.path.exists(self.inventory_file):
+                with open(self.inventory_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось прочитать инвентарь резервных копий: {e}")
+        return {}
+
+    def _save(self):
+        """Сохранение инвентаря в файл"""
+        try:
+            tmp_file = self.inventory_file + '.tmp'
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                json.dump(self.targets, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, self.inventory_file)
+        except Exception as e:
+            logging.error(f"Ошибка сохранения инвентаря: {e}")
+
+    def is_unchanged(self, target, fingerprint, max_age_seconds):
+        """Совпадает ли отпечаток с отпечатком последней резервной копии"""
+        entry = self.targets.get(target)
+        if not fingerprint or not entry or not entry.get('fingerprint') or not entry.get('last_backup'):
+            return False
+        if time.time() - entry.get('backed_up_at', 0) > max_age_seconds:
+            return False
+        return entry['fingerprint'] == fingerprint
+
+    def record_backup(self, target, fingerprint, backup_path):
+        """Запись новой резервной копии и отпечатка, на момент которого она сделана"""
+        with self.lock:
+            self.targets[target] = {
+                'fingerprint': fingerprint,
+                'last_backup': os.path.basename(backup_path),
+                'backed_up_at': time.time(),
+                'checked_at': time.time(),
+                'skipped_runs': 0
+            }
+            self._save()
+
+    def mark_current(self, target):
+        """Отметка, что предыдущая резервная копия все еще актуальна"""
+        with self.lock:
+            entry = self.targets[target]
+            entry['checked_at'] = time.time()
+            entry['skipped_runs'] = entry.get('skipped_runs', 0) + 1
+            self._save()
+            return entry['last_backup']
+
+    def forget_file(self, backup_path):
+        """Сброс отпечатка, если резервная копия не сохранена (например, ошибка загрузки)"""
+        name = os.path.basename(backup_path)
+        with self.lock:
+            for entry in self.targets.values():
+                if entry.get('last_backup') == name:
+                    entry['fingerprint'] = None
+            self._save()
+
+
+class PostgresWalArchiver:
+    """Инкрементальный режим PostgreSQL: периодический pg_basebackup и непрерывный прием WAL"""
+
+    WAL_SEGMENT_PATTERN = re.compile(r'^[0-9A-F]{24}$')
+
+    def __init__(self, backup_dir, compression, base_interval_hours=24, keep_base_backups=2,
+                 receivewal_compress=None, slot_lag_warn_bytes=1024 * 1024 * 1024, deadlines=None):
+        self.root_dir = os.path.join(backup_dir, 'wal_archive')
+        self.backup_dir = backup_dir
+        self.compression = compression
+        self.deadlines = deadlines
+        self.base_interval = base_interval_hours * 60 * 60
+        self.keep_base_backups = keep_base_backups
+        self.receivewal_compress = receivewal_compress
+        self.slot_lag_warn_bytes = slot_lag_warn_bytes
+        self.receivers = {}
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _cluster_dir(self, cluster):
+        path = os.path.join(self.root_dir, cluster)
+        os.makedirs(os.path.join(path, 'wal'), exist_ok=True)
+        return path
+
+    def _load_index(self, cluster):
+        """Индекс кластера: базовые копии и последний отправленный сегмент"""
+        index_file = os.path.join(self._cluster_dir(cluster), 'index.json')
+        if os.path.exists(index_file):
+            with open(index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'base_backups': [], 'segments': []}
+
+    def _save_index(self, cluster, index):
+        index_file = os.path.join(self._cluster_dir(cluster), 'index.json')
+        with open(index_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, ensure_ascii=False)
+        os.replace(index_file + '.tmp', index_file)
+
+    @staticmethod
+    def slot_name(cluster):
+        """Имя слота репликации для кластера"""
+        return ('dumpitall_' + re.sub(r'[^a-z0-9_]', '_', cluster.lower()))[:63]
+
+    @staticmethod
+    def _conn_args(conn):
+        return ['-h', conn['host'], '-p', str(conn['port']), '-U', conn['user'], '--no-password']
+
+    @staticmethod
+    def _env(conn):
+        env = os.environ.copy()
+        env['PGPASSWORD'] = conn.get('password', '')
+        return env
+
+    @staticmethod
+    def parse_lsn(lsn):
+        """Преобразование LSN вида 0/2000028 в число"""
+        high, low = lsn.split('/')
+        return (int(high, 16) << 32) | int(low, 16)
+
+    @staticmethod
+    def segment_position(segment_name):
+        """Позиция сегмента WAL (без таймлайна) для сравнения"""
+        return int(segment_name[8:16], 16), int(segment_name[16:24], 16)
+
+    @staticmethod
+    def lsn_segment_position(lsn, segment_size=16 * 1024 * 1024):
+        """Позиция сегмента WAL, содержащего LSN"""
+        value = PostgresWalArchiver.parse_lsn(lsn)
+        return value >> 32, (value & 0xFFFFFFFF) // segment_size
+
+    def _psql(self, conn, query):
+        cmd = ['psql'] + self._conn_args(conn) + ['-d', 'postgres', '-At', '-F', ' ', '-c', query]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10, env=self._env(conn))
+        return result.stdout.strip() if result.returncode == 0 else None
+
+    def _current_lsn(self, conn):
+        return self._psql(conn, 'SELECT pg_current_wal_lsn()')
+
+    def _receivewal_cmd(self, conn, cluster):
+        cmd = ['pg_receivewal'] + self._conn_args(conn) + [
+            '-D', os.path.join(self._cluster_dir(cluster), 'wal'),
+            '--slot', self.slot_name(cluster)
+        ]
+        if self.receivewal_compress:
+            cmd.append(f'--compress={self.receivewal_compress}')
+        return cmd
+
+    def _create_slot(self, conn, cluster):
+        """Создание слота репликации (если его еще нет)"""
+        cmd = ['pg_receivewal'] + self._conn_args(conn) + [
+            '--slot', self.slot_name(cluster), '--create-slot', '--if-not-exists'
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30, env=self._env(conn))
+        if result.returncode != 0:
+            raise RuntimeError(f"не удалось создать слот репликации: {result.stderr.strip()}")
+
+    def ensure_receiver(self, conn, cluster):
+        """Запуск непрерывного pg_receivewal (перезапуск, если процесс завершился)"""
+        process = self.receivers.get(cluster)
+        if process and process.poll() is None:
+            return
+
+        if process:
+            logging.warning(f"⚠️ pg_receivewal для {cluster} завершился с кодом {process.returncode}, перезапуск")
+
+        self._create_slot(conn, cluster)
+        log_file = open(os.path.join(self._cluster_dir(cluster), 'receivewal.log'), 'ab')
+        self.receivers[cluster] = subprocess.Popen(
+            self._receivewal_cmd(conn, cluster), stdout=log_file, stderr=log_file,
+            env=self._env(conn), start_new_session=True)
+        log_file.close()
+        logging.info(f"📡 Запущен pg_receivewal для {cluster} (слот {self.slot_name(cluster)})")
+
+    def archived_clusters(self):
+        """Кластеры с архивом WAL, слот которых еще не удален"""
+        clusters = []
+        for cluster in sorted(os.listdir(self.root_dir)):
+            index_file = os.path.join(self.root_dir, cluster, 'index.json')
+            if os.path.isfile(index_file) and not self._load_index(cluster).get('retired_at'):
+                clusters.append(cluster)
+        return clusters
+
+    def retire(self, conn, cluster):
+        """Остановка приема WAL и удаление слота кластера, исключенного из PG_WAL_ARCHIVE"""
+        process = self.receivers.pop(cluster, None)
+        if process and process.poll() is None:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+        cmd = ['pg_receivewal'] + self._conn_args(conn) + ['--slot', self.slot_name(cluster), '--drop-slot']
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30, env=self._env(conn))
+        if result.returncode != 0 and 'does not exist' not in result.stderr:
+            raise RuntimeError(f"не удалось удалить слот репликации: {result.stderr.strip()}")
+
+        # Архив остается доступным для восстановления, новые копии кластера делает pg_dump
+        index = self._load_index(cluster)
+        index['retired_at'] = time.time()
+        self._save_index(cluster, index)
+        logging.info(f"📡 {cluster} исключен из WAL режима: слот {self.slot_name(cluster)} удален")
+
+    def check_slot_lag(self, conn, cluster):
+        """Предупреждение, если слот удерживает на сервере больше WAL, чем допустимо"""
+        output = self._psql(conn, (
+            "SELECT pg_wal_lsn_diff(pg_current_wal_lsn(), restart_lsn)::bigint, "
+            "(SELECT setting FROM pg_settings WHERE name = 'max_slot_wal_keep_size') "
+            f"FROM pg_replication_slots WHERE slot_name = '{self.slot_name(cluster)}'"))
+        if not output or not output.split()[0].isdigit():
+            return None
+
+        lag = int(output.split()[0])
+        if self.slot_lag_warn_bytes and lag > self.slot_lag_warn_bytes:
+            # Без max_slot_wal_keep_size (-1 или PostgreSQL до 13) отставший слот удерживает WAL без ограничений
+            unlimited = len(output.split()) < 2 or output.split()[1] == '-1'
+            logging.warning(f"⚠️ Слот {self.slot_name(cluster)} удерживает {lag / (1024 * 1024):.0f} MB WAL на сервере"
+                            + ("; задайте max_slot_wal_keep_size, чтобы ограничить рост pg_wal" if unlimited else ""))
+        return lag
+
+    def drain(self, conn, cluster, timeout=600):
+        """Однократный прием WAL до текущей позиции (режим без демона)"""
+        self._create_slot(conn, cluster)
+        lsn = self._current_lsn(conn)
+        if not lsn:
+            raise RuntimeError("не удалось получить текущую позицию WAL")
+
+        cmd = self._receivewal_cmd(conn, cluster) + [f'--endpos={lsn}', '--no-loop']
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout, env=self._env(conn))
+        if result.returncode != 0:
+            raise RuntimeError(f"pg_receivewal: {result.stderr.strip()}")
+
+    def stop(self):
+        """Остановка всех процессов pg_receivewal"""
+        for cluster, process in self.receivers.items():
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                logging.info(f"📡 pg_receivewal для {cluster} остановлен")
+        self.receivers = {}
+
+    def collect_segments(self, cluster, index):
+        """Перенос завершенных сегментов WAL в папку резервных копий для загрузки"""
+        wal_dir = os.path.join(self._cluster_dir(cluster), 'wal')
+        shipped = []
+
+        names = sorted(os.listdir(wal_dir))
+        completed = [name for name in names
+                     if not name.endswith('.partial') and self.WAL_SEGMENT_PATTERN.match(name.split('.')[0])]
+
+        # Без .partial файла pg_receivewal (до PostgreSQL 15) определяет позицию старта
+        # по последнему сегменту в каталоге, поэтому его оставляем до следующего цикла
+        if completed and not any(name.endswith('.partial') for name in names):
+            names.remove(completed[-1])
+
+        for name in names:
+            base_name = name.split('.')[0]
+            if name.endswith('.partial') or not (self.WAL_SEGMENT_PATTERN.match(base_name)
+                                                 or name.endswith('.history')):
+                continue
+
+            source = os.path.join(wal_dir, name)
+            target = os.path.join(self.backup_dir, f"pgwal_{cluster}_{name}")
+
+            if self.receivewal_compress or name.endswith('.history'):
+                shutil.move(source, target)
+            else:
+                writer, target = self.compression.open(target, 'postgresql')
+                try:
+                    with open(source, 'rb') as src:
+                        shutil.copyfileobj(src, writer, 1024 * 1024)
+                finally:
+                    writer.close()
+                os.remove(source)
+
+            index['segments'].append({'segment': base_name, 'file': os.path.basename(target)})
+            shipped.append(target)
+
+        return shipped
+
+    def base_backup_due(self, index):
+        """Нужна ли новая базовая копия"""
+        if not index['base_backups']:
+            return True
+        return time.time() - index['base_backups'][-1]['created_at'] > self.base_interval
+
+    def take_base_backup(self, conn, cluster, timestamp):
+        """Потоковый pg_basebackup в формате tar через этап сжатия"""
+        backup_path = os.path.join(self.backup_dir, f"pg_base_{cluster}_{timestamp}.tar")
+        cmd = ['pg_basebackup'] + self._conn_args(conn) + [
+            '-D', '-', '-Ft', '-X', 'none', '--checkpoint=fast', '-v'
+        ]
+
+        writer, final_path = self.compression.open(backup_path, 'postgresql')
+        watchdog = None
+        with tempfile.TemporaryFile() as stderr_file:
+            try:
+                # Своя группа процессов: по истечении лимита дампа завершается вместе с дочерними
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, env=self._env(conn),
+                                           start_new_session=True)
+                
+                def kill(sig):
+                    try:
+                        os.killpg(process.pid, sig)
+                    except ProcessLookupError:
+                        pass
+                
+                if self.deadlines:
+                    # До wait() PID не освобожден и не может достаться другому процессу
+                    watchdog = self.deadlines.arm('postgresql', kill, os.path.basename(final_path),
+                                                  alive=lambda: process.returncode is None)
+                try:
+                    for chunk in iter(lambda: process.stdout.read(1024 * 1024), b''):
+                        writer.write(chunk)
+                finally:
+                    process.stdout.close()
+                    returncode = process.wait()
+                    if watchdog:
+                        watchdog.cancel()
+            finally:
+                writer.close()
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', errors='replace')
+
+        if watchdog and watchdog.reason:
+            returncode = returncode or -signal.SIGKILL
+            stderr = f"Базовая копия отменена: {watchdog.reason}\n{stderr}"
+
+        if returncode != 0:
+            if os.path.exists(final_path):
+                os.remove(final_path)
+            raise RuntimeError(f"pg_basebackup: {stderr.strip()}")
+
+        # "write-ahead log start point: 0/2000028 on timeline 1"
+        match = re.search(r'(?:write-ahead|transaction) log start point: ([0-9A-F]+/[0-9A-F]+) on timeline (\d+)',
+                          stderr)
+        start_lsn = match.group(1) if match else None
+
+        logging.info(f"🐘 Базовая копия {cluster}: {final_path} (начало WAL {start_lsn or 'неизвестно'})")
+        return {
+            'file': os.path.basename(final_path),
+            'start_lsn': start_lsn,
+            'timeline': int(match.group(2)) if match else None,
+            'created_at': time.time()
+        }
+
+    def apply_retention(self, cluster, index):
+        """Хранение N последних базовых копий и WAL, необходимого для их восстановления"""
+        expired = index['base_backups'][:-self.keep_base_backups] if self.keep_base_backups else []
+        index['base_backups'] = index['base_backups'][len(expired):]
+
+        for base in expired:
+            self._remove_local(base['file'])
+            logging.info(f"🗑️ Базовая копия {base['file']} вышла за пределы хранения")
+
+        oldest = index['base_backups'][0] if index['base_backups'] else None
+        if not oldest or not oldest.get('start_lsn'):
+            return
+
+        oldest_position = self.lsn_segment_position(oldest['start_lsn'])
+        kept = []
+        for segment in index['segments']:
+            if self.WAL_SEGMENT_PATTERN.match(segment['segment']) and \
+                    self.segment_position(segment['segment']) < oldest_position:
+                self._remove_local(segment['file'])
+            else:
+                kept.append(segment)
+
+        if len(kept) != len(index['segments']):
+            logging.info(f"🗑️ {cluster}: удалено {len(index['segments']) - len(kept)} сегментов WAL старше базовой копии")
+        index['segments'] = kept
+
+    def _remove_local(self, file_name):
+        path = os.path.join(self.backup_dir, file_name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def cycle(self, conn, cluster, timestamp, continuous=True):
+        """Цикл инкрементального копирования: прием WAL, базовая копия, хранение"""
+        index = self._load_index(cluster)
+        index.pop('retired_at', None)
+        files = []
+
+        try:
+            if continuous:
+                self.ensure_receiver(conn, cluster)
+            else:
+                self.drain(conn, cluster)
+
+            files.extend(self.collect_segments(cluster, index))
+            self.check_slot_lag(conn, cluster)
+
+            if self.base_backup_due(index):
+                base = self.take_base_backup(conn, cluster, timestamp)
+                index['base_backups'].append(base)
+                files.append(os.path.join(self.backup_dir, base['file']))
+
+            self.apply_retention(cluster, index)
+        finally:
+            self._save_index(cluster, index)
+
+        return files
+
+
+class MysqlBinlogStreamer:
+    """Инкрементальный режим MySQL: позиция binlog в полном дампе и потоковое копирование binlog"""
+
+    POSITION_PATTERN = re.compile(
+        r"(?:CHANGE MASTER TO MASTER_LOG_FILE|CHANGE REPLICATION SOURCE TO SOURCE_LOG_FILE)='([^']+)',\s*"
+        r"(?:MASTER|SOURCE)_LOG_POS=(\d+)")
+    GTID_PATTERN = re.compile(r"GTID_PURGED=(?:/\*!80000 '\+'\*/ )?'([^']*)'")
+
+    def __init__(self, backup_dir, compression, full_interval_hours=24, keep_full_dumps=2):
+        self.root_dir = os.path.join(backup_dir, 'binlog_archive')
+        self.backup_dir = backup_dir
+        self.compression = compression
+        self.full_interval = full_interval_hours * 60 * 60
+        self.keep_full_dumps = keep_full_dumps
+        self.streamers = {}
+        self.source_data_flags = {}
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _server_dir(self, server):
+        path = os.path.join(self.root_dir, server)
+        os.makedirs(os.path.join(path, 'binlog'), exist_ok=True)
+        return path
+
+    def load_index(self, server):
+        """Индекс сервера: полные дампы с позициями binlog и отправленные файлы binlog"""
+        index_file = os.path.join(self._server_dir(server), 'index.json')
+        if os.path.exists(index_file):
+            with open(index_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'full_dumps': [], 'binlogs': [], 'next_binlog': None, 'last_full_at': 0}
+
+    def save_index(self, server, index):
+        index_file = os.path.join(self._server_dir(server), 'index.json')
+        with open(index_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, ensure_ascii=False)
+        os.replace(index_file + '.tmp', index_file)
+
+    def full_dump_due(self, server):
+        """Нужен ли новый полный дамп сервера"""
+        index = self.load_index(server)
+        if not index['full_dumps'] or not index.get('next_binlog'):
+            return True
+        return time.time() - index.get('last_full_at', 0) > self.full_interval
+
+    def source_data_flag(self, cache_key, help_runner):
+        """Флаг записи позиции binlog в дамп (--source-data в MySQL 8.0.26+, иначе --master-data)"""
+        if cache_key not in self.source_data_flags:
+            try:
+                help_text = help_runner()
+            except Exception:
+                help_text = ''
+            self.source_data_flags[cache_key] = '--source-data=2' if '--source-data' in help_text else '--master-data=2'
+        return self.source_data_flags[cache_key]
+
+    @classmethod
+    def parse_position(cls, dump_head):
+        """Позиция binlog и GTID из заголовка дампа"""
+        text = dump_head.decode('utf-8', errors='replace') if isinstance(dump_head, bytes) else dump_head
+        match = cls.POSITION_PATTERN.search(text)
+        if not match:
+            return None
+        gtid = cls.GTID_PATTERN.search(text)
+        return {
+            'binlog_file': match.group(1),
+            'binlog_pos': int(match.group(2)),
+            'gtid_purged': gtid.group(1).replace('\n', '') if gtid else None
+        }
+
+    def record_full_dump(self, server, database, backup_path, dump_head):
+        """Запись позиции binlog, на которую согласован полный дамп"""
+        position = self.parse_position(dump_head)
+        if not position:
+            logging.warning(f"⚠️ Позиция binlog не найдена в дампе {os.path.basename(backup_path)} (binlog выключен?)")
+            return
+
+        index = self.load_index(server)
+        index['full_dumps'].append(dict(position, database=database, file=os.path.basename(backup_path),
+                                        created_at=time.time()))
+        index['last_full_at'] = time.time()
+
+        # Поток binlog непрерывен: позиция первого дампа задает начало цепочки,
+        # последующие полные дампы лишь добавляют точки восстановления
+        if not index.get('next_binlog'):
+            index['next_binlog'] = position['binlog_file']
+
+        self.save_index(server, index)
+        logging.info(f"🐬 {database}: дамп согласован с {position['binlog_file']}:{position['binlog_pos']}")
+
+    @staticmethod
+    def _binlog_number(name):
+        return int(name.rsplit('.', 1)[-1]) if name and name.rsplit('.', 1)[-1].isdigit() else -1
+
+    @staticmethod
+    def _conn_args(conn):
+        args = ['--host', conn['host'], '--port', str(conn['port']), '--user', conn['user']]
+        if conn.get('password'):
+            args.append(f"--password={conn['password']}")
+        return args
+
+    def _rotate(self, conn):
+        """Закрытие текущего binlog (FLUSH BINARY LOGS), чтобы отправить его в этом цикле"""
+        cmd = ['mysql'] + self._conn_args(conn) + ['-e', 'FLUSH BINARY LOGS']
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
+        if result.returncode != 0:
+            logging.warning(f"⚠️ FLUSH BINARY LOGS не выполнен: {result.stderr.strip()}")
+
+    def _mysqlbinlog_cmd(self, conn, server, start_file, stop_never):
+        cmd = ['mysqlbinlog', '--read-from-remote-server', '--raw'] + self._conn_args(conn) + [
+            '--result-file=' + os.path.join(self._server_dir(server), 'binlog') + os.sep
+        ]
+        if stop_never:
+            cmd.append('--stop-never')
+        cmd.append(start_file)
+        return cmd
+
+    def ensure_streamer(self, conn, server, start_file):
+        """Непрерывный mysqlbinlog --stop-never (перезапуск, если процесс завершился)"""
+        process = self.streamers.get(server)
+        if process and process.poll() is None:
+            return
+
+        if process:
+            logging.warning(f"⚠️ mysqlbinlog для {server} завершился с кодом {process.returncode}, перезапуск")
+
+        log_file = open(os.path.join(self._server_dir(server), 'mysqlbinlog.log'), 'ab')
+        self.streamers[server] = subprocess.Popen(
+            self._mysqlbinlog_cmd(conn, server, start_file, stop_never=True),
+            stdout=log_file, stderr=log_file, start_new_session=True)
+        log_file.close()
+        logging.info(f"📡 Запущен mysqlbinlog для {server} начиная с {start_file}")
+
+    def fetch_once(self, conn, server, start_file, timeout=600):
+        """Однократное копирование binlog до текущего конца (режим без демона)"""
+        result = subprocess.run(self._mysqlbinlog_cmd(conn, server, start_file, stop_never=False),
+                                capture_output=True, text=True, timeout=timeout)
+        if result.returncode != 0:
+            raise RuntimeError(f"mysqlbinlog: {result.stderr.strip()}")
+
+    def stop(self):
+        """Остановка всех процессов mysqlbinlog"""
+        for server, process in self.streamers.items():
+            if process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                logging.info(f"📡 mysqlbinlog для {server} остановлен")
+        self.streamers = {}
+
+    def collect_binlogs(self, server, index, continuous):
+        """Перенос закрытых binlog файлов в папку резервных копий"""
+        binlog_dir = os.path.join(self._server_dir(server), 'binlog')
+        names = sorted((n for n in os.listdir(binlog_dir) if self._binlog_number(n) >= 0), key=self._binlog_number)
+        if not names:
+            return []
+
+        # Последний файл еще пишется сервером - он будет отправлен в следующем цикле
+        active = names[-1]
+        full_dump = index['full_dumps'][-1]['file'] if index['full_dumps'] else None
+        shipped = []
+
+        for name in names[:-1]:
+            source = os.path.join(binlog_dir, name)
+            writer, target = self.compression.open(
+                os.path.join(self.backup_dir, f"mysqlbin_{server}_{name}"), 'mysql')
+            try:
+                with open(source, 'rb') as src:
+                    shutil.copyfileobj(src, writer, 1024 * 1024)
+            finally:
+                writer.close()
+            os.remove(source)
+
+            index['binlogs'].append({'binlog': name, 'file': os.path.basename(target), 'full_dump': full_dump,
+                                     'shipped_at': time.time()})
+            shipped.append(target)
+
+        index['next_binlog'] = active
+        if not continuous:
+            os.remove(os.path.join(binlog_dir, active))
+
+        return shipped
+
+    def apply_retention(self, server, index):
+        """Хранение N последних полных дампов и binlog, применимых к ним"""
+        generations = sorted({d['binlog_file'] for d in index['full_dumps']}, key=self._binlog_number)
+        if len(generations) <= self.keep_full_dumps:
+            return
+
+        oldest_kept = generations[-self.keep_full_dumps]
+        oldest_number = self._binlog_number(oldest_kept)
+
+        for dump in index['full_dumps']:
+            if self._binlog_number(dump['binlog_file']) < oldest_number:
+                self._remove_local(dump['file'])
+        index['full_dumps'] = [d for d in index['full_dumps'] if self._binlog_number(d['binlog_file']) >= oldest_number]
+
+        for binlog in index['binlogs']:
+            if self._binlog_number(binlog['binlog']) < oldest_number:
+                self._remove_local(binlog['file'])
+        index['binlogs'] = [b for b in index['binlogs'] if self._binlog_number(b['binlog']) >= oldest_number]
+
+    def _remove_local(self, file_name):
+        path = os.path.join(self.backup_dir, file_name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def cycle(self, conn, server, continuous=True):
+        """Цикл инкрементального копирования: ротация, прием binlog, хранение"""
+        index = self.load_index(server)
+        if not index.get('next_binlog'):
+            logging.warning(f"⚠️ {server}: нет полного дампа с позицией binlog, поток binlog не запущен")
+            return []
+
+        try:
+            self._rotate(conn)
+            if continuous:
+                self.ensure_streamer(conn, server, index['next_binlog'])
+                time.sleep(1)
+            else:
+                self.fetch_once(conn, server, index['next_binlog'])
+
+            files = self.collect_binlogs(server, index, continuous)
+            self.apply_retention(server, index)
+        finally:
+            self.save_index(server, index)
+
+        return files
+
+
+class MongoOplogTailer:
+    """Инкрементальный режим MongoDB: полный архив с --oplog и сжатые BSON фрагменты oplog между ними"""
+
+    def __init__(self, backup_dir, full_interval_hours=24, keep_full_archives=2):
+        self.root_dir = os.path.join(backup_dir, 'oplog_archive')
+        self.backup_dir = backup_dir
+        self.full_interval = full_interval_hours * 60 * 60
+        self.keep_full_archives = keep_full_archives
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _index_file(self, server):
+        return os.path.join(self.root_dir, f"{server}.json")
+
+    def load_index(self, server):
+        """Индекс сервера: полные архивы, фрагменты oplog и последняя сохраненная метка времени"""
+        if os.path.exists(self._index_file(server)):
+            with open(self._index_file(server), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'full_archives': [], 'chunks': [], 'last_ts': None}
+
+    def save_index(self, server, index):
+        index_file = self._index_file(server)
+        with open(index_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(index, f, indent=2, ensure_ascii=False)
+        os.replace(index_file + '.tmp', index_file)
+
+    @staticmethod
+    def parse_ts(value):
+        """Метка времени oplog "t:i" -> (t, i)"""
+        if not value:
+            return None
+        t, i = value.strip().split(':')
+        return int(t), int(i)
+
+    @staticmethod
+    def ts_query(after, until):
+        """Фильтр mongodump по диапазону меток времени oplog (Extended JSON)"""
+        return json.dumps({'ts': {
+            '$gt': {'$timestamp': {'t': after[0], 'i': after[1]}},
+            '$lte': {'$timestamp': {'t': until[0], 'i': until[1]}}
+        }})
+
+    def full_archive_due(self, index, oldest_ts):
+        """Нужен ли полный архив: по интервалу или из-за разрыва в окне oplog"""
+        if not index['full_archives'] or not index.get('last_ts'):
+            return True
+        if oldest_ts and oldest_ts > self.parse_ts(index['last_ts']):
+            logging.warning("⚠️ Окно oplog меньше интервала копирования, требуется полный архив")
+            return True
+        return time.time() - index['full_archives'][-1]['created_at'] > self.full_interval
+
+    def record_full_archive(self, index, backup_path, start_ts):
+        index['full_archives'].append({
+            'file': os.path.basename(backup_path),
+            'start_ts': f"{start_ts[0]}:{start_ts[1]}",
+            'created_at': time.time()
+        })
+        index['last_ts'] = f"{start_ts[0]}:{start_ts[1]}"
+
+    def record_chunk(self, index, backup_path, from_ts, to_ts):
+        index['chunks'].append({
+            'file': os.path.basename(backup_path),
+            'from_ts': f"{from_ts[0]}:{from_ts[1]}",
+            'to_ts': f"{to_ts[0]}:{to_ts[1]}",
+            'full_archive': index['full_archives'][-1]['file'] if index['full_archives'] else None,
+            'created_at': time.time()
+        })
+        index['last_ts'] = f"{to_ts[0]}:{to_ts[1]}"
+
+    def restore_chain(self, server, until_ts=None):
+        """Полный архив и фрагменты oplog для восстановления до метки времени (t, i)"""
+        index = self.load_index(server)
+        candidates = [a for a in index['full_archives']
+                      if until_ts is None or self.parse_ts(a['start_ts']) <= until_ts]
+        if not candidates:
+            return None
+
+        full = candidates[-1]
+        chunks = [c for c in index['chunks'] if c['full_archive'] == full['file']
+                  and (until_ts is None or self.parse_ts(c['from_ts']) < until_ts)]
+        return {'full_archive': full, 'chunks': chunks, 'oplog_limit': until_ts}
+
+    def apply_retention(self, server, index):
+        """Хранение N последних полных архивов и фрагментов oplog после них"""
+        if len(index['full_archives']) <= self.keep_full_archives:
+            return
+
+        expired = index['full_archives'][:-self.keep_full_archives]
+        index['full_archives'] = index['full_archives'][-self.keep_full_archives:]
+        oldest_ts = self.parse_ts(index['full_archives'][0]['start_ts'])
+
+        for archive in expired:
+            self._remove_local(archive['file'])
+
+        kept = []
+        for chunk in index['chunks']:
+            if self.parse_ts(chunk['to_ts']) <= oldest_ts:
+                self._remove_local(chunk['file'])
+            else:
+                kept.append(chunk)
+        index['chunks'] = kept
+        logging.info(f"🗑️ {server}: удалено {len(expired)} полных архивов MongoDB за пределами хранения")
+
+    def _remove_local(self, file_name):
+        path = os.path.join(self.backup_dir, file_name)
+        if os.path.isfile(path):
+            os.remove(path)
+
+
+class PostgresTableDiff:
+    """Дифференциальный режим PostgreSQL: дамп только измененных таблиц и манифест со ссылками на прежние копии"""
+
+    # Счетчики и время обслуживания каждой таблицы; filenode меняется после TRUNCATE и VACUUM FULL
+    STATS_QUERY = (
+        "SELECT concat_ws(chr(9), s.schemaname, s.relname, concat_ws(':', s.n_tup_ins, s.n_tup_upd, s.n_tup_del, "
+        "s.last_vacuum, s.last_autovacuum, s.last_analyze, s.last_autoanalyze, pg_relation_filenode(s.relid), "
+        "(SELECT stats_reset FROM pg_stat_database WHERE datname = current_database()))) "
+        "FROM pg_stat_user_tables s ORDER BY s.schemaname, s.relname"
+    )
+
+    def __init__(self, backup_dir, jobs=4, rebase_days=7):
+        self.state_dir = os.path.join(backup_dir, 'table_diff')
+        self.jobs = max(1, jobs)
+        self.rebase_age = rebase_days * 24 * 60 * 60
+        os.makedirs(self.state_dir, exist_ok=True)
+
+    def _state_file(self, target):
+        return os.path.join(self.state_dir, re.sub(r'[^\w.-]', '_', target) + '.json')
+
+    def load_state(self, target):
+        """Последние копии таблиц цели: имя -> отпечаток, файл, время дампа"""
+        if os.path.exists(self._state_file(target)):
+            with open(self._state_file(target), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'tables': {}}
+
+    def save_state(self, target, state):
+        state_file = self._state_file(target)
+        with open(state_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+        os.replace(state_file + '.tmp', state_file)
+
+    @staticmethod
+    def parse_stats(output):
+        """Вывод STATS_QUERY -> {schema.table: (schema, table, отпечаток)}"""
+        tables = {}
+        for line in output.splitlines():
+            parts = line.split('\t')
+            if len(parts) == 3:
+                tables[f"{parts[0]}.{parts[1]}"] = (parts[0], parts[1], parts[2])
+        return tables
+
+    @staticmethod
+    def table_pattern(schema, table):
+        """Шаблон --table с экранированием: имя совпадает буквально"""
+        quote = lambda name: '"' + name.replace('"', '""') + '"'
+        return f"{quote(schema)}.{quote(table)}"
+
+    def changed_tables(self, state, stats):
+        """Таблицы для дампа: новые, измененные и с копией старше интервала обновления"""
+        now = time.time()
+        changed = []
+        for name, (_, _, fingerprint) in stats.items():
+            previous = state['tables'].get(name)
+            if (not previous or previous['fingerprint'] != fingerprint
+                    or now - previous['dumped_at'] > self.rebase_age):
+                changed.append(name)
+        return changed
+
+    @staticmethod
+    def record_manifest(state, manifest_name):
+        """Файлы таблиц, на которые ссылается манифест: их нельзя удалять, пока манифест хранится"""
+        state.setdefault('manifests', {})[manifest_name] = sorted(info['file'] for info in state['tables'].values())
+
+    def referenced_files(self, target, manifest_names, load_manifest):
+        """Файлы таблиц, нужные манифестам; None - ссылки какого-то манифеста неизвестны"""
+        state = self.load_state(target)
+        manifests = state.setdefault('manifests', {})
+        missing = [name for name in manifest_names if name not in manifests]
+        for name in missing:
+            # Манифесты прежних версий: ссылки читаются из самого манифеста
+            manifest = load_manifest(name)
+            if manifest is None:
+                return None
+            manifests[name] = sorted(info['file'] for info in manifest['tables'].values())
+        if missing:
+            self.save_state(target, state)
+        return {file_name for name in manifest_names for file_name in manifests[name]}
+
+    def forget_manifests(self, target, manifest_names):
+        state = self.load_state(target)
+        for name in manifest_names:
+            state.get('manifests', {}).pop(name, None)
+        self.save_state(target, state)
+
+    def update_state(self, state, stats, dumped):
+        """Запись новых копий; удаленные из БД таблицы исключаются из состояния"""
+        now = time.time()
+        tables = {}
+        for name, (_, _, fingerprint) in stats.items():
+            if name in dumped:
+                tables[name] = {'fingerprint': fingerprint, 'file': os.path.basename(dumped[name]), 'dumped_at': now}
+            elif name in state['tables']:
+                tables[name] = state['tables'][name]
+        state['tables'] = tables
+
+    @staticmethod
+    def build_manifest(target, database, schema_path, state, dumped):
+        """Манифест восстановления: схема и актуальная копия данных каждой таблицы"""
+        return {
+            'format': 'pg_table_diff',
+            'target': target,
+            'database': database,
+            'created_at': datetime.now().isoformat(),
+            'schema': os.path.basename(schema_path),
+            'tables': {
+                name: {
+                    'file': info['file'],
+                    'dumped_at': datetime.fromtimestamp(info['dumped_at']).isoformat(),
+                    'changed': name in dumped
+                }
+                for name, info in sorted(state['tables'].items())
+            }
+        }
+
+
+class ContentDefinedChunker:
+    """Границы фрагментов по содержимому (FastCDC с нормализацией) для дедупликации потоков дампов
+
+    Побайтовый gear-хеш на чистом Python дает единицы МБ/с, поэтому кандидаты в границы ищутся
+    регулярным выражением (перевод строки, разделитель строк INSERT, пара нулевых байт), а условие
+    FastCDC проверяется по CRC32 окна перед кандидатом: строгая маска до нормального размера,
+    ослабленная после него. Граница зависит только от содержимого и расстояния до предыдущей,
+    поэтому вставка в начале дампа меняет лишь соседние фрагменты.
+    """
+
+    ANCHORS = re.compile(rb'\n|\),\(|\x00\x00')
+    WINDOW = 32
+
+    def __init__(self, avg_size=1024 * 1024):
+        self.avg_size = avg_size
+        self.min_size = avg_size // 4
+        self.max_size = avg_size * 4
+        bits = max(avg_size.bit_length() - 8, 4)
+        self.mask_strict = (1 << bits) - 1
+        self.mask_loose = (1 << (bits - 2)) - 1
+
+    def cut(self, buf, final=False):
+        """Длина первого фрагмента буфера; None - данных недостаточно для решения"""
+        size = len(buf)
+        if size < self.max_size and not final:
+            return None
+        if size <= self.min_size:
+            return size
+
+        limit = min(size, self.max_size)
+        for match in self.ANCHORS.finditer(buf, self.min_size, limit):
+            position = match.end()
+            if position < self.avg_size:
+                mask = self.mask_strict
+            elif position < self.avg_size * 2:
+                mask = self.mask_loose
+            else:
+                return position
+            if not zlib.crc32(buf[position - self.WINDOW:position]) & mask:
+                return position
+        return limit
+
+
+class RepositoryWriter(io.RawIOBase):
+    """Приемник дампа в репозитории: поток режется на фрагменты, новые фрагменты сжимаются в pack-файлы"""
+
+    def __init__(self, repository, snapshot_path, target, codec, level):
+        self.repository = repository
+        self.snapshot_path = snapshot_path
+        self.target = target
+        self.codec = codec
+        self.level = level
+        self.buffer = bytearray()
+        self.chunks = []
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.new_chunks = 0
+        self.reused_chunks = 0
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.bytes_in += len(data)
+        self.buffer.extend(data)
+        self._flush_chunks(final=False)
+        return len(data)
+
+    def _flush_chunks(self, final):
+        while self.buffer:
+            size = self.repository.chunker.cut(self.buffer, final)
+            if size is None:
+                return
+            data = bytes(self.buffer[:size])
+            del self.buffer[:size]
+            entry, stored = self.repository.store(data, self.codec, self.level)
+            self.chunks.append(entry)
+            if stored:
+                self.new_chunks += 1
+                self.bytes_out += stored
+            else:
+                self.reused_chunks += 1
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            self._flush_chunks(final=True)
+            self.repository.write_snapshot(self.snapshot_path, self.target, self.bytes_in, self.chunks)
+        finally:
+            super().close()
+            self.elapsed = time.monotonic() - self.started
+
+        total = self.new_chunks + self.reused_chunks
+        logging.info(f"🧩 {os.path.basename(self.snapshot_path)}: {total} фрагментов, новых {self.new_chunks} "
+                     f"({self.bytes_out / (1024 * 1024):.1f} MB из {self.bytes_in / (1024 * 1024):.1f} MB)")
+
+
+class SnapshotReader(io.RawIOBase):
+    """Сборка дампа из фрагментов pack-файлов с проверкой SHA-256 каждого фрагмента"""
+
+    def __init__(self, snapshot_path, pack_dirs):
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            self.snapshot = json.load(f)
+        self.pack_dirs = pack_dirs
+        self.entries = iter(self.snapshot['chunks'])
+        self.current = b''
+        self.position = 0
+        self.handles = {}
+
+    def readable(self):
+        return True
+
+    def _pack(self, pack):
+        if pack not in self.handles:
+            for directory in self.pack_dirs:
+                path = os.path.join(directory, pack)
+                if os.path.isfile(path):
+                    self.handles[pack] = open(path, 'rb')
+                    break
+            else:
+                raise FileNotFoundError(f"pack-файл {pack} не найден")
+        return self.handles[pack]
+
+    def _next_chunk(self):
+        entry = next(self.entries, None)
+        if entry is None:
+            return False
+        chunk_hash, pack, offset, length, _, codec = entry
+        handle = self._pack(pack)
+        handle.seek(offset)
+        data = ChunkRepository.decompress_chunk(handle.read(length), codec)
+        if hashlib.sha256(data).hexdigest() != chunk_hash:
+            raise ValueError(f"фрагмент {chunk_hash[:12]} в {pack} поврежден")
+        self.current, self.position = data, 0
+        return True
+
+    def readinto(self, buffer):
+        while self.position >= len(self.current):
+            if not self._next_chunk():
+                return 0
+        size = min(len(buffer), len(self.current) - self.position)
+        buffer[:size] = self.current[self.position:self.position + size]
+        self.position += size
+        return size
+
+    def close(self):
+        for handle in self.handles.values():
+            handle.close()
+        self.handles = {}
+        super().close()
+
+
+class ChunkRepository:
+    """Дедуплицирующий репозиторий: фрагменты по содержимому, адресуемые SHA-256 и сжатые в pack-файлы
+
+    Каждая копия - снимок (.snap) со списком ссылок на фрагменты; на Drive загружаются снимки
+    и только новые pack-файлы.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS chunks (
+            hash TEXT PRIMARY KEY,
+            pack TEXT NOT NULL,
+            offset INTEGER NOT NULL,
+            length INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            codec TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS packs (
+            name TEXT PRIMARY KEY,
+            size INTEGER NOT NULL DEFAULT 0,
+            sealed_at REAL
+        );
+        CREATE TABLE IF NOT EXISTS snapshot_packs (
+            snapshot TEXT NOT NULL,
+            pack TEXT NOT NULL,
+            PRIMARY KEY (snapshot, pack)
+        );
+        CREATE INDEX IF NOT EXISTS idx_chunks_pack ON chunks(pack);
+        CREATE INDEX IF NOT EXISTS idx_snapshot_packs_pack ON snapshot_packs(pack);
+    """
+
+    def __init__(self, root, compression, avg_chunk_size=1024 * 1024, pack_size=64 * 1024 * 1024,
+                 on_pack_sealed=None):
+        self.root = root
+        self.pack_dir = os.path.join(root, 'packs')
+        os.makedirs(self.pack_dir, exist_ok=True)
+        self.compression = compression
+        self.chunker = ContentDefinedChunker(avg_chunk_size)
+        self.pack_size = pack_size
+        self.on_pack_sealed = on_pack_sealed
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(os.path.join(root, 'index.db'), check_same_thread=False, timeout=30)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+        self.pack_name = None
+        self.pack_file = None
+        self.pack_offset = 0
+        self.stats = {'bytes_in': 0, 'new_bytes': 0, 'new_chunks': 0, 'reused_chunks': 0}
+        self.recovered = self._recover_unsealed()
+
+    def _recover_unsealed(self):
+        """Закрытие pack-файлов, оставшихся открытыми после аварийного завершения"""
+        # Их фрагменты уже используются для дедупликации: pack-файл обрезается до последнего
+        # записанного фрагмента и закрывается для загрузки, а без файла его фрагменты забываются
+        recovered = []
+        with self.lock, self.conn:
+            packs = [row[0] for row in self.conn.execute("SELECT name FROM packs WHERE sealed_at IS NULL")]
+            for pack in packs:
+                path = os.path.join(self.pack_dir, pack)
+                length = os.path.getsize(path) if os.path.isfile(path) else 0
+                self.conn.execute("DELETE FROM chunks WHERE pack = ? AND offset + length > ?", (pack, length))
+                end = self.conn.execute("SELECT MAX(offset + length) FROM chunks WHERE pack = ?", (pack,)).fetchone()[0]
+                if not end:
+                    self.conn.execute("DELETE FROM packs WHERE name = ?", (pack,))
+                    if os.path.isfile(path):
+                        os.remove(path)
+                    continue
+                with open(path, 'r+b') as f:
+                    f.truncate(end)
+                self.conn.execute("UPDATE packs SET size = ?, sealed_at = ? WHERE name = ?", (end, time.time(), pack))
+                recovered.append(path)
+        if recovered:
+            logging.warning(f"⚠️ Репозиторий: закрыто {len(recovered)} pack-файлов прерванного запуска")
+        return recovered
+
+    @staticmethod
+    def compress_chunk(data, codec, level):
+        if codec == 'zstd':
+            import zstandard
+            return zstandard.ZstdCompressor(level=level).compress(data)
+        if codec == 'gzip':
+            import gzip
+            return gzip.compress(data, compresslevel=min(max(level, 1), 9), mtime=0)
+        if codec == 'lz4':
+            import lz4.frame
+            return lz4.frame.compress(data, compression_level=level)
+        return data
+
+    @staticmethod
+    def decompress_chunk(blob, codec):
+        if codec == 'zstd':
+            import zstandard
+            return zstandard.ZstdDecompressor().decompress(blob)
+        if codec == 'gzip':
+            import gzip
+            return gzip.decompress(blob)
+        if codec == 'lz4':
+            import lz4.frame
+            return lz4.frame.decompress(blob)
+        return blob
+
+    @staticmethod
+    def open_reader(snapshot_path):
+        """Поток исходного дампа по снимку; pack-файлы ищутся рядом со снимком и в локальном репозитории"""
+        directory = os.path.dirname(os.path.abspath(snapshot_path))
+        pack_dirs = [directory, os.path.join(directory, 'repository', 'packs'),
+                     os.path.join(os.path.dirname(directory), 'repository', 'packs')]
+        return io.BufferedReader(SnapshotReader(snapshot_path, pack_dirs), buffer_size=1024 * 1024)
+
+    @staticmethod
+    def snapshot_packs(snapshot_path):
+        with open(snapshot_path, 'r', encoding='utf-8') as f:
+            return {entry[1] for entry in json.load(f)['chunks']}
+
+    def open_writer(self, backup_path, db_type, target=None):
+        codec, level = self.compression.select(db_type, target)
+        snapshot_path = backup_path + '.snap'
+        return RepositoryWriter(self, snapshot_path, target, codec, level), snapshot_path
+
+    def _lookup(self, chunk_hash):
+        # Вызывается под self.lock: соединение общее для потоков дампа
+        return self.conn.execute("SELECT pack, offset, length, size, codec FROM chunks WHERE hash = ?",
+                                 (chunk_hash,)).fetchone()
+
+    def store(self, data, codec, level):
+        """Запись фрагмента, если его еще нет; возвращает ссылку и число записанных байт (0 - повтор)"""
+        chunk_hash = hashlib.sha256(data).hexdigest()
+        blob = None
+        with self.lock:
+            known = self._lookup(chunk_hash)
+        if not known:
+            # Сжатие вне блокировки: параллельные дампы не ждут друг друга
+            blob = self.compress_chunk(data, codec, level)
+
+        sealed = None
+        with self.lock:
+            row = self._lookup(chunk_hash)
+            if row:
+                stored = 0
+                pack, offset, length, size, codec = row
+            else:
+                if blob is None:
+                    blob = self.compress_chunk(data, codec, level)
+                if self.pack_file is None:
+                    self._open_pack()
+                pack, offset, length, size = self.pack_name, self.pack_offset, len(blob), len(data)
+                self.pack_file.write(blob)
+                self.pack_file.flush()
+                self.pack_offset += length
+                with self.conn:
+                    self.conn.execute("INSERT INTO chunks (hash, pack, offset, length, size, codec) "
+                                      "VALUES (?, ?, ?, ?, ?, ?)", (chunk_hash, pack, offset, length, size, codec))
+                stored = length
+                if self.pack_offset >= self.pack_size:
+                    sealed = self._seal_locked()
+
+            self.stats['bytes_in'] += len(data)
+            self.stats['new_bytes'] += stored
+            self.stats['new_chunks' if stored else 'reused_chunks'] += 1
+
+        if sealed and self.on_pack_sealed:
+            self.on_pack_sealed(sealed)
+        return [chunk_hash, pack, offset, length, size, codec], stored
+
+    def _open_pack(self):
+        self.pack_name = f"pack_{datetime.now().strftime('%Y%m%d_%H%M%S')}_{os.urandom(4).hex()}.pack"
+        self.pack_file = open(os.path.join(self.pack_dir, self.pack_name), 'wb')
+        self.pack_offset = 0
+        with self.conn:
+            self.conn.execute("INSERT INTO packs (name) VALUES (?)", (self.pack_name,))
+
+    def _seal_locked(self):
+        self.pack_file.close()
+        with self.conn:
+            self.conn.execute("UPDATE packs SET size = ?, sealed_at = ? WHERE name = ?",
+                              (self.pack_offset, time.time(), self.pack_name))
+        path = os.path.join(self.pack_dir, self.pack_name)
+        self.pack_file = self.pack_name = None
+        return path
+
+    def seal(self):
+        """Закрытие текущего pack-файла (в конце запуска) и передача его на загрузку"""
+        with self.lock:
+            sealed = self._seal_locked() if self.pack_file else None
+        if sealed and self.on_pack_sealed:
+            self.on_pack_sealed(sealed)
+        return sealed
+
+    def write_snapshot(self, snapshot_path, target, size, chunks):
+        snapshot = {
+            'version': 1,
+            'name': os.path.basename(snapshot_path),
+            'target': target,
+            'created_at': datetime.now().isoformat(),
+            'size': size,
+            'chunks': chunks
+        }
+        with open(snapshot_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(snapshot, f, separators=(',', ':'))
+        os.replace(snapshot_path + '.tmp', snapshot_path)
+
+    def commit_snapshot(self, snapshot_path):
+        """Ссылки успешного снимка на pack-файлы; снимки неудачных дампов pack-файлы не удерживают"""
+        packs = self.snapshot_packs(snapshot_path)
+        with self.lock, self.conn:
+            self.conn.executemany("INSERT OR IGNORE INTO snapshot_packs (snapshot, pack) VALUES (?, ?)",
+                                  [(os.path.basename(snapshot_path), pack) for pack in packs])
+
+    def forget_snapshot(self, name):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM snapshot_packs WHERE snapshot = ?", (name,))
+
+    def prune(self):
+        """Удаление закрытых pack-файлов, на которые не ссылается ни один снимок"""
+        with self.lock, self.conn:
+            packs = [row[0] for row in self.conn.execute(
+                "SELECT name FROM packs WHERE sealed_at IS NOT NULL "
+                "AND name NOT IN (SELECT DISTINCT pack FROM snapshot_packs)")]
+            for pack in packs:
+                # Фрагменты удаляемого pack-файла больше не используются для дедупликации
+                self.conn.execute("DELETE FROM chunks WHERE pack = ?", (pack,))
+                self.conn.execute("DELETE FROM packs WHERE name = ?", (pack,))
+        for pack in packs:
+            path = os.path.join(self.pack_dir, pack)
+            if os.path.isfile(path):
+                os.remove(path)
+        return packs
+
+    def run_summary(self):
+        stats = dict(self.stats)
+        stats['dedup_ratio'] = round(stats['bytes_in'] / stats['new_bytes'], 2) if stats['new_bytes'] else None
+        return stats
+
+
+class DriveStreamUpload:
+    """Потоковая resumable-загрузка на Drive без локального файла
+
+    Сжатый поток режется на фрагменты (кратные 256 КБ) и отправляется отдельным потоком.
+    В памяти держится не больше memory_chunks фрагментов, при медленной загрузке следующие
+    фрагменты уходят во временный файл до spill_bytes, после чего дамп ждет. Отправляемый
+    фрагмент хранится до подтверждения сервером и при сбое досылается с подтвержденного смещения.
+    Последний фрагмент отправляется только в commit(): без него Drive не создает файл,
+    поэтому оборванный дамп отменяется через abort().
+    """
+
+    UPLOAD_URL = 'https://www.googleapis.com/upload/drive/v3/files?uploadType=resumable&fields=id,md5Checksum'
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, session, name, folder_id=None, chunk_size=8 * 1024 * 1024, memory_chunks=2,
+                 spill_bytes=64 * 1024 * 1024, spill_dir=None, limiter=None, max_retries=8, sleep=time.sleep):
+        self.session = session
+        self.name = name
+        self.chunk_size = max(1, chunk_size // (256 * 1024)) * 256 * 1024
+        self.memory_chunks = max(1, memory_chunks)
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.sleep = sleep
+
+        response = session.post(self.UPLOAD_URL, json={'name': name, 'parents': [folder_id] if folder_id else []},
+                                headers={'X-Upload-Content-Type': 'application/octet-stream'}, timeout=60)
+        if response.status_code != 200:
+            raise RuntimeError(f"Drive не открыл сессию загрузки: HTTP {response.status_code}")
+        self.session_uri = response.headers['Location']
+
+        self.pending = bytearray()
+        self.items = []
+        self.in_memory = 0
+        self.spill = None
+        self.spill_used = 0
+        self.spill_peak = 0
+        self.condition = threading.Condition()
+        self.finished = False
+        self.error = None
+        self.size = 0
+        self.sent = 0
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name=f"stream-{name[:20]}", daemon=True)
+        self.thread.start()
+
+    def writable(self):
+        return True
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        if self.error:
+            raise RuntimeError(f"Потоковая загрузка {self.name} прервана: {self.error}")
+        self.size += len(data)
+        self.pending.extend(data)
+        while len(self.pending) >= self.chunk_size:
+            chunk = bytes(self.pending[:self.chunk_size])
+            del self.pending[:self.chunk_size]
+            self._enqueue(chunk)
+        return len(data)
+
+    def _enqueue(self, chunk):
+        with self.condition:
+            # Порядок сохраняется: пока в файле есть фрагменты, новые идут туда же
+            while not self.error:
+                to_memory = self.in_memory < self.memory_chunks and not self.spill_used
+                if to_memory or self.spill_used + len(chunk) <= self.spill_bytes:
+                    break
+                self.condition.wait(timeout=5)
+            if self.error:
+                raise RuntimeError(f"Потоковая загрузка {self.name} прервана: {self.error}")
+            if to_memory:
+                self.items.append(('memory', chunk))
+                self.in_memory += 1
+            else:
+                if self.spill is None:
+                    self.spill = tempfile.TemporaryFile(dir=self.spill_dir)
+                self.spill.seek(0, os.SEEK_END)
+                offset = self.spill.tell()
+                self.spill.write(chunk)
+                self.spill_used += len(chunk)
+                self.spill_peak = max(self.spill_peak, self.spill_used)
+                self.items.append(('spill', offset, len(chunk)))
+            self.condition.notify_all()
+
+    def _take(self):
+        with self.condition:
+            while not self.items and not self.finished:
+                self.condition.wait(timeout=5)
+            if not self.items:
+                return None
+            item = self.items.pop(0)
+            if item[0] == 'memory':
+                self.in_memory -= 1
+                data = item[1]
+            else:
+                self.spill.seek(item[1])
+                data = self.spill.read(item[2])
+                self.spill_used -= item[2]
+                if not self.spill_used:
+                    # Окно опустело - место на диске освобождается
+                    self.spill.seek(0)
+                    self.spill.truncate()
+            self.condition.notify_all()
+            return data
+
+    def _run(self):
+        try:
+            while True:
+                data = self._take()
+                if data is None:
+                    return
+                self._send(data)
+        except Exception as e:
+            with self.condition:
+                self.error = str(e)
+                self.condition.notify_all()
+
+    def _query_offset(self):
+        response = self.session.put(self.session_uri, headers={'Content-Range': 'bytes */*'}, timeout=60)
+        if response.status_code == 308:
+            received = response.headers.get('Range')
+            return int(received.split('-')[-1]) + 1 if received else 0
+        raise RuntimeError(f"сессия загрузки недоступна (HTTP {response.status_code})")
+
+    def _send(self, data, total=None):
+        """Отправка фрагмента с позиции self.sent; досылка после частичного приема или сбоя"""
+        start = self.sent
+        attempt = 0
+        while True:
+            offset = self.sent - start
+            body = data[offset:]
+            if self.limiter:
+                self.limiter.consume(len(body))
+            if body:
+                content_range = f"bytes {self.sent}-{self.sent + len(body) - 1}/{total if total is not None else '*'}"
+            else:
+                content_range = f"bytes */{total}"
+            try:
+                response = self.session.put(self.session_uri, data=body, timeout=300,
+                                            headers={'Content-Range': content_range,
+                                                     'Content-Length': str(len(body))})
+                status = response.status_code
+            except Exception as e:
+                response, status = None, None
+                logging.debug(f"Сбой отправки фрагмента {self.name}: {e}")
+
+            if status in (200, 201):
+                self.sent = start + len(data)
+                return response.json()
+            if status == 308:
+                received = response.headers.get('Range')
+                self.sent = int(received.split('-')[-1]) + 1 if received else 0
+                if self.sent >= start + len(data) and total is None:
+                    return None
+                if self.sent < start:
+                    raise RuntimeError(f"сервер подтвердил {self.sent} байт, фрагмент начинается с {start}")
+                continue
+            if status is not None and status not in self.RETRY_STATUSES:
+                raise RuntimeError(f"HTTP {status}")
+
+            attempt += 1
+            if attempt > self.max_retries:
+                raise RuntimeError(f"фрагмент не отправлен за {self.max_retries} попыток")
+            self.sleep(min(2 ** attempt, 64))
+            self.sent = self._query_offset()
+            if self.sent < start:
+                raise RuntimeError(f"сервер подтвердил {self.sent} байт, фрагмент начинается с {start}")
+
+    def close(self):
+        """Конец потока: все полные фрагменты отправлены, хвост ждет commit()"""
+        if self.closed:
+            return
+        self.closed = True
+        with self.condition:
+            self.finished = True
+            self.condition.notify_all()
+        self.thread.join()
+        if self.spill:
+            self.spill.close()
+        if self.error:
+            raise RuntimeError(f"Потоковая загрузка {self.name} прервана: {self.error}")
+
+    def commit(self):
+        """Отправка последнего фрагмента: файл появляется на Drive; возвращает id и md5Checksum"""
+        result = self._send(bytes(self.pending), total=self.size)
+        self.pending = bytearray()
+        return result
+
+    def abort(self):
+        """Отмена сессии - незавершенная загрузка не оставляет файла на Drive"""
+        try:
+            self.session.delete(self.session_uri, timeout=60)
+        except Exception as e:
+            logging.debug(f"Не удалось отменить сессию загрузки {self.name}: {e}")
+
+
+class LocalStorageBackend:
+    """Каталог на локальном или смонтированном диске (второй диск, NFS, NAS)"""
+
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, remote_id):
+        return os.path.join(self.root, os.path.basename(remote_id))
+
+    def put(self, source, name, size=None, md5=None):
+        path = self._path(name)
+        digest = hashlib.md5()
+        written = 0
+        with open(path + '.tmp', 'wb') as f:
+            for chunk in iter(lambda: source.read(1024 * 1024), b''):
+                digest.update(chunk)
+                f.write(chunk)
+                written += len(chunk)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+        return {'id': name, 'size': written, 'md5': digest.hexdigest()}
+
+    def head(self, remote_id):
+        path = self._path(remote_id)
+        if not os.path.isfile(path):
+            return None
+        return {'id': remote_id, 'name': os.path.basename(path), 'size': os.path.getsize(path), 'md5': None}
+
+    def list(self, prefix=''):
+        return [self.head(name) for name in sorted(os.listdir(self.root))
+                if name.startswith(prefix) and not name.endswith('.tmp') and os.path.isfile(self._path(name))]
+
+    def delete(self, remote_id):
+        path = self._path(remote_id)
+        if os.path.isfile(path):
+            os.remove(path)
+
+    def get(self, remote_id, destination):
+        with open(self._path(remote_id), 'rb') as f:
+            shutil.copyfileobj(f, destination, 1024 * 1024)
+
+
+class DriveStorageBackend:
+    """Google Drive: resumable-загрузка фрагментами с продолжением прерванной сессии по журналу загрузок"""
+
+    name = 'drive'
+
+    def __init__(self, backup):
+        self.backup = backup
+
+    def put(self, source, name, size=None, md5=None, journal_key=None):
+        backup = self.backup
+        if size is None:
+            size = source.seek(0, os.SEEK_END)
+            source.seek(0)
+        
+        media = MediaIoBaseUpload(source, mimetype='application/octet-stream',
+                                  chunksize=backup.upload_chunk_size, resumable=True)
+        started = time.monotonic()
+        request = backup._thread_drive_service().files().create(
+            body={'name': name, 'parents': [backup.DRIVE_FOLDER_ID] if backup.DRIVE_FOLDER_ID else []},
+            media_body=media,
+            fields='id, md5Checksum'
+        )
+        
+        file = None
+        sent = resumed_from = 0
+        
+        # Продолжение сессии, прерванной перезапуском, с последнего подтвержденного фрагмента
+        entry = backup.upload_journal.get(journal_key) if journal_key else None
+        if entry:
+            offset, drive_file = self._query_session(entry['session_uri'], size)
+            if offset is None:
+                backup.upload_journal.remove(journal_key)
+            elif offset >= size:
+                backup.upload_journal.remove(journal_key)
+                if not drive_file.get('id'):
+                    drive_file = self._find(name) or {}
+                if drive_file.get('id'):
+                    logging.info(f"Файл {name} уже был загружен на Google Drive до перезапуска")
+                    return {'id': drive_file['id'], 'size': size, 'md5': drive_file.get('md5Checksum')}
+                logging.warning(f"⚠️ Сессия загрузки {name} завершена, но файл на Google Drive не найден, "
+                                f"загрузка начнется заново")
+            else:
+                request.resumable_uri = entry['session_uri']
+                request.resumable_progress = sent = resumed_from = offset
+                logging.info(f"🔁 {name}: продолжение загрузки с {offset / (1024 * 1024):.1f} MB")
+        
+        while file is None:
+            backup.upload_limiter.consume(min(backup.upload_chunk_size, size - sent))
+            status, file = request.next_chunk(num_retries=3)
+            if status and journal_key:
+                backup.upload_journal.update(journal_key, request.resumable_uri, status.resumable_progress)
+            if status and size > backup.upload_chunk_size:
+                sent = status.resumable_progress
+                elapsed = max(time.monotonic() - started, 0.001)
+                logging.info(f"⬆️ {name}: {status.progress() * 100:.0f}% "
+                             f"({sent / (1024 * 1024):.1f}/{size / (1024 * 1024):.1f} MB, "
+                             f"{(sent - resumed_from) / (1024 * 1024) / elapsed:.1f} MB/s)")
+        
+        # Учет пропускной способности для автоподбора сжатия
+        if backup.compression.tuner:
+            backup.compression.tuner.record_upload(size - resumed_from, time.monotonic() - started)
+        if journal_key:
+            backup.upload_journal.remove(journal_key)
+        return {'id': file.get('id'), 'size': size, 'md5': file.get('md5Checksum')}
+
+    def _query_session(self, session_uri, total_size):
+        """Подтвержденное сервером смещение сессии и, если загрузка завершена, ресурс файла
+
+        (None, None) - сессия истекла или недоступна.
+        """
+        backup = self.backup
+        session = getattr(backup.drive_local, 'session', None)
+        if session is None:
+            session = AuthorizedSession(backup.drive_credentials)
+            backup.drive_local.session = session
+        
+        response = session.put(session_uri, headers={'Content-Length': '0',
+                                                     'Content-Range': f"bytes */{total_size}"}, timeout=60)
+        if response.status_code in (200, 201):
+            try:
+                drive_file = response.json()
+            except ValueError:
+                drive_file = {}
+            return total_size, drive_file if isinstance(drive_file, dict) else {}
+        if response.status_code == 308:
+            # Range: bytes=0-N - получены байты до N включительно
+            received = response.headers.get('Range')
+            return (int(received.split('-')[-1]) + 1 if received else 0), None
+        logging.info(f"Сессия загрузки недоступна (HTTP {response.status_code}), загрузка начнется заново")
+        return None, None
+
+    def _find(self, name):
+        """Последний загруженный файл с именем name (ресурс Drive) или None"""
+        escaped = name.replace('\\', '\\\\').replace("'", "\\'")
+        query = f"name = '{escaped}' and trashed = false"
+        if self.backup.DRIVE_FOLDER_ID:
+            query += f" and '{self.backup.DRIVE_FOLDER_ID}' in parents"
+        response = self.backup._thread_drive_service().files().list(
+            q=query, fields='files(id, name, size, md5Checksum)', orderBy='createdTime desc',
+            pageSize=1).execute()
+        files = response.get('files', [])
+        return files[0] if files else None
+
+    @staticmethod
+    def _normalize(drive_file):
+        return {'id': drive_file['id'], 'name': drive_file['name'],
+                'size': int(drive_file['size']) if drive_file.get('size') else None,
+                'md5': drive_file.get('md5Checksum')}
+
+    def head(self, remote_id):
+        try:
+            drive_file = self.backup._thread_drive_service().files().get(
+                fileId=remote_id, fields='id, name, size, md5Checksum, trashed').execute()
+        except Exception as e:
+            if getattr(getattr(e, 'resp', None), 'status', None) == 404:
+                return None
+            raise
+        return None if drive_file.get('trashed') else self._normalize(drive_file)
+
+    def list(self, prefix=''):
+        query = "trashed = false"
+        if self.backup.DRIVE_FOLDER_ID:
+            query += f" and '{self.backup.DRIVE_FOLDER_ID}' in parents"
+        files = []
+        page_token = None
+        while True:
+            response = self.backup._thread_drive_service().files().list(
+                q=query, fields='nextPageToken, files(id, name, size, md5Checksum)',
+                pageSize=1000, pageToken=page_token).execute()
+            files.extend(self._normalize(f) for f in response.get('files', []) if f['name'].startswith(prefix))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return files
+
+    def delete(self, remote_id):
+        self.backup._thread_drive_service().files().delete(fileId=remote_id).execute()
+
+    def get(self, remote_id, destination):
+        request = self.backup._thread_drive_service().files().get_media(fileId=remote_id)
+        downloader = MediaIoBaseDownload(destination, request, chunksize=self.backup.upload_chunk_size)
+        done = False
+        while not done:
+            _, done = downloader.next_chunk(num_retries=3)
+
+
+class S3StorageBackend:
+    """S3-совместимое хранилище (AWS S3, MinIO, Yandex Object Storage и др.)
+
+    Запросы подписываются AWS Signature V4, адресация - path-style (endpoint/bucket/key).
+    Файл до part_size отправляется одним PUT, крупнее - multipart-загрузкой: части читаются
+    из источника по очереди и отправляются workers потоками, в памяти не больше workers + 1 частей.
+    Каждая часть сверяется сервером по Content-MD5; MD5 всего файла сохраняется в x-amz-meta-md5.
+    При ошибке незавершенная multipart-загрузка отменяется.
+    """
+
+    name = 's3'
+    MIN_PART_SIZE = 5 * 1024 * 1024
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region='us-east-1', prefix='',
+                 part_size=16 * 1024 * 1024, workers=4, limiter=None, max_retries=4, sleep=time.sleep):
+        import requests
+        self.endpoint = endpoint.rstrip('/')
+        self.host = self.endpoint.split('://', 1)[-1]
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip('/')
+        self.part_size = max(part_size, self.MIN_PART_SIZE)
+        self.workers = max(1, workers)
+        self.limiter = limiter
+        self.max_retries = max_retries
+        self.sleep = sleep
+        self.http = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=self.workers + 2)
+        self.http.mount('http://', adapter)
+        self.http.mount('https://', adapter)
+
+    def _key(self, name):
+        return f"{self.prefix}/{name}" if self.prefix else name
+
+    def _sign(self, method, path, query, headers):
+        """Заголовок Authorization по AWS Signature V4 (тело запроса не подписывается)"""
+        amz_date = time.strftime('%Y%m%dT%H%M%SZ', time.gmtime())
+        headers.update({'host': self.host, 'x-amz-date': amz_date, 'x-amz-content-sha256': 'UNSIGNED-PAYLOAD'})
+        signed = sorted(headers)
+        canonical = '\n'.join([
+            method, path, query,
+            ''.join(f"{name}:{str(headers[name]).strip()}\n" for name in signed),
+            ';'.join(signed), 'UNSIGNED-PAYLOAD'
+        ])
+        scope = f"{amz_date[:8]}/{self.region}/s3/aws4_request"
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                    hashlib.sha256(canonical.encode()).hexdigest()])
+        key = ('AWS4' + self.secret_key).encode()
+        for part in (amz_date[:8], self.region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+        headers['authorization'] = (f"AWS4-HMAC-SHA256 Credential={self.access_key}/{scope}, "
+                                    f"SignedHeaders={';'.join(signed)}, Signature={signature}")
+
+    def _request(self, method, key='', params=None, data=b'', headers=None, ok=(200,), stream=False):
+        path = f"/{self.bucket}" + (f"/{quote(key, safe='/-_.~')}" if key else '')
+        query = '&'.join(f"{quote(k, safe='-_.~')}={quote(str(v), safe='-_.~')}"
+                         for k, v in sorted((params or {}).items()))
+        url = self.endpoint + path + (f"?{query}" if query else '')
+        
+        attempt = 0
+        while True:
+            request_headers = {k.lower(): v for k, v in (headers or {}).items()}
+            self._sign(method, path, query, request_headers)
+            try:
+                response = self.http.request(method, url, data=data, headers=request_headers, timeout=300,
+                                             stream=stream)
+                status = response.status_code
+            except Exception as e:
+                response, status = None, None
+                logging.debug(f"Сбой запроса S3 {method} {key}: {e}")
+            
+            if status in ok:
+                return response
+            if status is not None and status not in self.RETRY_STATUSES:
+                raise RuntimeError(f"S3 {method} {key or self.bucket}: HTTP {status} {response.text[:200]}")
+            attempt += 1
+            if attempt > self.max_retries:
+                raise RuntimeError(f"S3 {method} {key or self.bucket}: нет ответа после {self.max_retries} попыток")
+            self.sleep(min(2 ** attempt, 30))
+
+    @staticmethod
+    def _content_md5(data):
+        return base64.b64encode(hashlib.md5(data).digest()).decode()
+
+    def put(self, source, name, size=None, md5=None):
+        key = self._key(name)
+        metadata = {'x-amz-meta-md5': md5} if md5 else {}
+        first = source.read(self.part_size)
+        
+        if len(first) < self.part_size:
+            # Небольшой файл - одним запросом
+            if self.limiter:
+                self.limiter.consume(len(first))
+            self._request('PUT', key, data=first, headers={**metadata, 'content-md5': self._content_md5(first)})
+            return {'id': key, 'size': len(first), 'md5': hashlib.md5(first).hexdigest()}
+        
+        response = self._request('POST', key, {'uploads': ''}, headers=metadata)
+        upload_id = ET.fromstring(response.content).find('{*}UploadId').text
+        digest = hashlib.md5()
+        total = 0
+        etags = {}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as pool:
+                pending = []
+                number = 0
+                chunk = first
+                while chunk:
+                    number += 1
+                    digest.update(chunk)
+                    total += len(chunk)
+                    while len(pending) >= self.workers:
+                        done_number, etag = pending.pop(0).result()
+                        etags[done_number] = etag
+                    pending.append(pool.submit(self._put_part, key, upload_id, number, chunk))
+                    chunk = source.read(self.part_size)
+                for future in pending:
+                    done_number, etag = future.result()
+                    etags[done_number] = etag
+            
+            body = ''.join(f"<Part><PartNumber>{n}</PartNumber><ETag>{etags[n]}</ETag></Part>" for n in sorted(etags))
+            response = self._request('POST', key, {'uploadId': upload_id},
+                                     data=f"<CompleteMultipartUpload>{body}</CompleteMultipartUpload>".encode())
+            # Ошибка сборки может прийти в теле ответа с кодом 200
+            if b'<Error>' in response.content:
+                raise RuntimeError(f"S3 не собрал {key}: {response.text[:200]}")
+        except Exception:
+            try:
+                self._request('DELETE', key, {'uploadId': upload_id}, ok=(200, 204))
+            except Exception as e:
+                logging.warning(f"⚠️ Не удалось отменить multipart-загрузку {key}: {e}")
+            raise
+        
+        logging.debug(f"S3: {key} загружен {len(etags)} частями по {self.part_size // (1024 * 1024)} MB")
+        return {'id': key, 'size': total, 'md5': digest.hexdigest()}
+
+    def _put_part(self, key, upload_id, number, data):
+        if self.limiter:
+            self.limiter.consume(len(data))
+        response = self._request('PUT', key, {'partNumber': number, 'uploadId': upload_id}, data=data,
+                                 headers={'content-md5': self._content_md5(data)})
+        return number, response.headers['ETag']
+
+    def head(self, remote_id):
+        response = self._request('HEAD', remote_id, ok=(200, 404))
+        if response.status_code == 404:
+            return None
+        etag = response.headers.get('ETag', '').strip('"')
+        return {'id': remote_id, 'name': os.path.basename(remote_id),
+                'size': int(response.headers.get('Content-Length', 0)),
+                'md5': response.headers.get('x-amz-meta-md5') or (etag if '-' not in etag else None)}
+
+    def list(self, prefix=''):
+        objects = []
+        params = {'list-type': 2, 'prefix': self._key(prefix)}
+        while True:
+            root = ET.fromstring(self._request('GET', params=params).content)
+            for item in root.findall('{*}Contents'):
+                etag = item.findtext('{*}ETag', '').strip('"')
+                key = item.findtext('{*}Key')
+                objects.append({'id': key, 'name': os.path.basename(key), 'size': int(item.findtext('{*}Size', 0)),
+                                'md5': etag if '-' not in etag else None})
+            token = root.findtext('{*}NextContinuationToken')
+            if root.findtext('{*}IsTruncated') != 'true' or not token:
+                return objects
+            params['continuation-token'] = token
+
+    def delete(self, remote_id):
+        self._request('DELETE', remote_id, ok=(200, 204, 404))
+
+    def get(self, remote_id, destination):
+        response = self._request('GET', remote_id, stream=True)
+        for chunk in response.iter_content(1024 * 1024):
+            destination.write(chunk)
+
+
+class LoadGovernor:
+    """Регулятор нагрузки дампов: допуск по давлению на хост и активности БД
+
+    Перед дампом снимаются PSI (/proc/pressure/io и cpu, some avg10), loadavg на ядро и число
+    активных запросов БД. При превышении порогов дамп откладывается до max_wait секунд, затем
+    запускается с пониженным приоритетом. Общее ожидание за запуск ограничено max_run_wait секундами:
+    после его исчерпания дампы при нагрузке запускаются сразу с пониженным приоритетом. Во время дампа замеры повторяются каждые poll_interval
+    секунд: при росте нагрузки процессам дампа ставятся nice 19 и ionice best-effort 7, при спаде
+    возвращается обычный приоритет. Параллельные дампы сокращаются вдвое за каждый превышенный порог.
+    """
+
+    THROTTLED_NICE = 19
+
+    def __init__(self, enabled=False, io_pressure=30.0, cpu_pressure=60.0, load_per_cpu=2.0, db_active=30,
+                 max_wait=1800, max_run_wait=3600, poll_interval=30, nice=0, ionice=None, proc_root='/proc',
+                 sleep=time.sleep):
+        self.enabled = enabled
+        self.limits = {'io': io_pressure, 'cpu': cpu_pressure, 'load': load_per_cpu, 'db': db_active}
+        self.max_wait = max_wait
+        self.max_run_wait = max_run_wait
+        self.waited = 0.0
+        self.poll_interval = max(1, poll_interval)
+        self.nice = nice
+        self.ionice = self.parse_ionice(ionice)
+        self.proc_root = proc_root
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.decisions = []
+        self.job = None
+        self.probe = None
+        self.throttled = False
+
+    @staticmethod
+    def parse_ionice(value):
+        """'idle' или 'best-effort:N' -> (класс psutil, уровень)"""
+        if not value:
+            return None
+        name, _, level = value.partition(':')
+        if name == 'idle':
+            return psutil.IOPRIO_CLASS_IDLE, None
+        if name == 'best-effort':
+            return psutil.IOPRIO_CLASS_BE, int(level or 4)
+        raise ValueError(f"неизвестный класс ionice: {value}")
+
+    def _psi(self, resource):
+        try:
+            with open(os.path.join(self.proc_root, 'pressure', resource), 'r') as f:
+                for line in f:
+                    if line.startswith('some'):
+                        return float(line.split('avg10=')[1].split()[0])
+        except (OSError, ValueError, IndexError):
+            pass
+        return None
+
+    def sample(self, probe=None):
+        values = {'io': self._psi('io'), 'cpu': self._psi('cpu'), 'load': None, 'db': None}
+        try:
+            values['load'] = round(os.getloadavg()[0] / (os.cpu_count() or 1), 2)
+        except OSError:
+            pass
+        if probe:
+            try:
+                values['db'] = probe()
+            except Exception as e:
+                logging.debug(f"Не удалось получить активность БД для регулятора: {e}")
+        return values
+
+    def over(self, values):
+        """Превышенные пороги в виде 'io 42.0 > 30.0'"""
+        return [f"{name} {values[name]} > {limit}" for name, limit in self.limits.items()
+                if limit and values.get(name) is not None and values[name] > limit]
+
+    def _record(self, job, action, reasons, **extra):
+        with self.lock:
+            self.decisions.append({'job': job, 'action': action, 'reasons': reasons, **extra})
+
+    def admit(self, job, probe=None):
+        """Ожидание допуска дампа job; probe() возвращает число активных запросов БД"""
+        self.job, self.probe, self.throttled = job, probe, False
+        if not self.enabled:
+            return
+        reasons = self.over(self.sample(probe))
+        if not reasons:
+            return
+        
+        max_wait = self.max_wait
+        if self.max_run_wait:
+            max_wait = min(max_wait, max(0.0, self.max_run_wait - self.waited))
+        initial = reasons
+        started = time.monotonic()
+        if max_wait > 0:
+            logging.info(f"⏳ {job}: дамп отложен, высокая нагрузка ({', '.join(reasons)})")
+        while reasons and time.monotonic() - started < max_wait:
+            self.sleep(min(self.poll_interval, max(1, max_wait - (time.monotonic() - started))))
+            reasons = self.over(self.sample(probe))
+        self.waited += time.monotonic() - started
+        waited = round(time.monotonic() - started)
+        
+        if reasons:
+            self.throttled = True
+            logging.warning(f"🐢 {job}: нагрузка не снизилась за {waited} с, дамп запускается "
+                            f"с пониженным приоритетом ({', '.join(reasons)})")
+            self._record(job, 'throttled', reasons, waited=waited)
+        else:
+            logging.info(f"▶️ {job}: нагрузка снизилась, дамп запущен после ожидания {waited} с")
+            self._record(job, 'deferred', initial, waited=waited)
+
+    def parallelism(self, jobs):
+        """Число параллельных дампов с учетом текущей нагрузки"""
+        if not self.enabled or jobs <= 1:
+            return jobs
+        reasons = self.over(self.sample(self.probe))
+        allowed = max(1, jobs >> len(reasons))
+        if allowed < jobs:
+            logging.info(f"🐢 {self.job}: параллельных дампов {allowed} вместо {jobs} ({', '.join(reasons)})")
+            self._record(self.job, 'parallelism', reasons, jobs=allowed)
+        return allowed
+
+    def _set_priority(self, pid, throttled):
+        """Приоритет процесса pid и его потомков; текст ошибки, если ОС отказала в изменении"""
+        # ionice есть только в Linux
+        best_effort = getattr(psutil, 'IOPRIO_CLASS_BE', None)
+        if throttled:
+            nice, ionice = self.THROTTLED_NICE, (best_effort, 7) if best_effort is not None else None
+        else:
+            nice, ionice = self.nice, self.ionice or ((best_effort, 4) if best_effort is not None else None)
+        try:
+            root = psutil.Process(pid)
+            processes = [root] + root.children(recursive=True)
+        except psutil.NoSuchProcess:
+            return None
+        for process in processes:
+            try:
+                process.nice(nice)
+                if ionice:
+                    process.ionice(*ionice)
+            except psutil.NoSuchProcess:
+                continue
+            except (psutil.AccessDenied, ValueError) as e:
+                logging.debug(f"Не удалось изменить приоритет процесса {process.pid}: {e}")
+                return f"{type(e).__name__} {e}".strip()
+        return None
+
+    def watch(self, pid):
+        """Приоритет процесса дампа pid по нагрузке до установки возвращенного события"""
+        stop = threading.Event()
+        if not pid:
+            return stop
+        job, probe, current = self.job, self.probe, self.throttled
+        if current or self.nice or self.ionice:
+            error = self._set_priority(pid, current)
+            if error:
+                logging.warning(f"⚠️ {job}: не удалось установить приоритет дампа: {error}")
+        if not self.enabled:
+            return stop
+        
+        def monitor():
+            nonlocal current
+            while not stop.wait(self.poll_interval):
+                reasons = self.over(self.sample(probe))
+                if bool(reasons) == current:
+                    continue
+                current = bool(reasons)
+                error = self._set_priority(pid, current)
+                if current:
+                    logging.info(f"🐢 {job}: приоритет дампа понижен ({', '.join(reasons)})")
+                    self._record(job, 'lowered', reasons)
+                elif error:
+                    # Повысить приоритет обратно без CAP_SYS_NICE нельзя - дамп остается пониженным
+                    logging.warning(f"⚠️ {job}: нагрузка снизилась, но вернуть приоритет дампа не удалось: {error}")
+                    self._record(job, 'restore_failed', [error])
+                    return
+                else:
+                    logging.info(f"▶️ {job}: нагрузка снизилась, приоритет дампа восстановлен")
+                    self._record(job, 'restored', reasons)
+        
+        threading.Thread(target=monitor, name=f"governor-{pid}", daemon=True).start()
+        return stop
+
+    def summary(self):
+        counts = {}
+        for decision in self.decisions:
+            counts[decision['action']] = counts.get(decision['action'], 0) + 1
+        return {'counts': counts, 'decisions': self.decisions}
+
+
+class DumpDeadlines:
+    """Лимиты времени дампов по СУБД, размеру БД и истории длительностей цели
+
+    Лимит цели - наибольшее из базового лимита СУБД, времени чтения БД со скоростью min_rate
+    и factor x самый долгий из последних успешных дампов, но не больше max_timeout. Лимит
+    отсчитывается от начала дампа цели и общий для всех его процессов. Не уложившийся процесс
+    завершается вместе с группой процессов (SIGTERM, через grace секунд SIGKILL, если процесс
+    еще жив и сторож не снят).
+    """
+
+    HISTORY = 10
+
+    def __init__(self, state_file, default_timeout=3600, engine_timeouts=None, min_rate=5 * 1024 * 1024,
+                 factor=3.0, max_timeout=12 * 3600, grace=30):
+        self.state_file = state_file
+        self.default_timeout = default_timeout
+        self.engine_timeouts = engine_timeouts or {}
+        self.min_rate = min_rate
+        self.factor = factor
+        self.max_timeout = max_timeout
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.current = None
+        self.cancelled = []
+        self.history = self._load()
+
+    @staticmethod
+    def parse_engine_timeouts(value):
+        """'redis=10,sqlite=5' (минуты) -> {'redis': 600, 'sqlite': 300}"""
+        timeouts = {}
+        for item in (value or '').split(','):
+            if '=' in item:
+                engine, minutes = item.split('=', 1)
+                timeouts[engine.strip()] = int(float(minutes) * 60)
+        return timeouts
+
+    def _load(self):
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save(self):
+        try:
+            with open(self.state_file + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.history, f, indent=2)
+            os.replace(self.state_file + '.tmp', self.state_file)
+        except OSError as e:
+            logging.error(f"Ошибка сохранения истории длительностей дампов: {e}")
+
+    def _job(self, target, engine, size=None):
+        base = self.engine_timeouts.get(engine, self.default_timeout)
+        job = {'target': target, 'engine': engine, 'timeout': 0, 'basis': None, 'started': time.monotonic()}
+        if not base:
+            return job
+        
+        candidates = {'СУБД': base}
+        if size and self.min_rate:
+            candidates['размер БД'] = size / self.min_rate
+        if self.history.get(target):
+            candidates['история'] = max(self.history[target]) * self.factor
+        job['basis'], timeout = max(candidates.items(), key=lambda item: item[1])
+        job['timeout'] = int(min(timeout, self.max_timeout) if self.max_timeout else timeout)
+        return job
+
+    def begin(self, target, engine, size=None):
+        """Начало дампа цели: расчет лимита"""
+        self.current = self._job(target, engine, size)
+        if self.current['timeout']:
+            logging.debug(f"⏱️ {target}: лимит дампа {self.current['timeout']} с ({self.current['basis']})")
+        return self.current['timeout']
+
+    def finish(self, target, ok):
+        """Конец дампа цели: длительность успешного дампа попадает в историю"""
+        job, self.current = self.current, None
+        if not ok or not job or job['target'] != target:
+            return
+        durations = self.history.setdefault(target, [])
+        durations.append(round(time.monotonic() - job['started'], 1))
+        del durations[:-self.HISTORY]
+        self._save()
+
+    def arm(self, engine, kill, label, alive=None):
+        """Сторож процесса дампа; kill(sig) посылает сигнал его группе процессов, alive() - жив ли процесс"""
+        job = self.current
+        if job is None or job['engine'] != engine:
+            # Дамп вне цикла по базам (инкрементальные режимы) - лимит СУБД от текущего момента
+            job = self._job(None, engine)
+        if not job['timeout']:
+            return None
+        
+        timer = threading.Timer(max(job['started'] + job['timeout'] - time.monotonic(), 0),
+                                lambda: self._expire(timer, job, kill, label, alive))
+        timer.daemon = True
+        timer.reason = None
+        timer.start()
+        return timer
+
+    def _expire(self, timer, job, kill, label, alive):
+        elapsed = round(time.monotonic() - job['started'])
+        timer.reason = f"превышен лимит {job['timeout']} с ({job['basis']}), прошло {elapsed} с"
+        logging.error(f"⏹️ {label}: {timer.reason}, процесс дампа завершается")
+        with self.lock:
+            self.cancelled.append({'job': job['target'] or label, 'engine': job['engine'],
+                                   'timeout': job['timeout'], 'elapsed': elapsed, 'reason': timer.reason})
+        try:
+            kill(signal.SIGTERM)
+            # cancel() сторожа после завершения дампа прерывает ожидание: SIGKILL уже некому слать,
+            # а PID завершенного процесса может достаться другому
+            if timer.finished.wait(self.grace):
+                return
+            if alive is None or alive():
+                kill(signal.SIGKILL)
+        except Exception as e:
+            logging.error(f"Ошибка завершения процесса дампа {label}: {e}")
+
+
+class UploadPipeline:
+    """Конвейер загрузки: файлы уходят на загрузку сразу после закрытия, пока идут следующие дампы"""
+
+    def __init__(self, upload_func, on_failure, backup_dir, workers=1, queue_size=8,
+                 max_pending_bytes=0, min_free_bytes=0, keep_local=None):
+        self.upload_func = upload_func
+        self.on_failure = on_failure
+        self.keep_local = keep_local or (lambda path: False)
+        self.backup_dir = backup_dir
+        self.workers = max(1, workers)
+        self.queue = queue.Queue(maxsize=max(1, queue_size))
+        self.max_pending_bytes = max_pending_bytes
+        self.min_free_bytes = min_free_bytes
+        self.condition = threading.Condition()
+        self.pending_bytes = 0
+        self.pending_files = 0
+        self.uploaded = 0
+        self.failed = []
+        self.threads = []
+
+    @staticmethod
+    def _size(path):
+        if os.path.isdir(path):
+            return sum(os.path.getsize(os.path.join(root, name))
+                       for root, _, names in os.walk(path) for name in names)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"upload-{number}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, path):
+        """Постановка файла в очередь (блокируется, если очередь заполнена)"""
+        size = self._size(path)
+        with self.condition:
+            self.pending_bytes += size
+            self.pending_files += 1
+        self.queue.put((path, size))
+
+    def _over_budget(self):
+        if self.max_pending_bytes and self.pending_bytes > self.max_pending_bytes:
+            return True
+        if self.min_free_bytes and shutil.disk_usage(self.backup_dir).free < self.min_free_bytes:
+            return True
+        return False
+
+    def wait_for_capacity(self):
+        """Обратное давление: новый дамп ждет, пока незагруженные файлы занимают слишком много места"""
+        with self.condition:
+            if self.pending_files and self._over_budget():
+                logging.info(f"⏸️ Ожидание загрузки: в очереди {self.pending_files} файлов, "
+                             f"{self.pending_bytes / (1024 * 1024):.1f} MB")
+            # Без файлов в очереди ждать нечего - иначе дамп не начнется никогда
+            while self.pending_files and self._over_budget():
+                self.condition.wait(timeout=5)
+
+    def _worker(self):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                self.queue.task_done()
+                return
+
+            path, size = item
+            try:
+                if self.upload_func(path):
+                    with self.condition:
+                        self.uploaded += 1
+                    logging.info(f"☁️ Загружено в хранилище: {os.path.basename(path)}")
+
+                    # Удаление локального файла после успешной загрузки
+                    try:
+                        if self.keep_local(path):
+                            pass
+                        elif os.path.isfile(path):
+                            os.remove(path)
+                            logging.debug(f"🗑️ Локальный файл удален: {path}")
+                        elif os.path.isdir(path):
+                            shutil.rmtree(path)
+                            logging.debug(f"🗑️ Локальный файл удален: {path}")
+                    except Exception as e:
+                        logging.error(f"Ошибка удаления локального файла: {e}")
+                else:
+                    logging.error(f"❌ Ошибка загрузки в хранилище: {os.path.basename(path)}")
+                    with self.condition:
+                        self.failed.append(path)
+                    self.on_failure(path)
+            except Exception as e:
+                logging.error(f"❌ Ошибка обработки файла {path}: {e}")
+                with self.condition:
+                    self.failed.append(path)
+                try:
+                    self.on_failure(path)
+                except Exception as failure_error:
+                    logging.error(f"Ошибка обработки неудачной загрузки {path}: {failure_error}")
+            finally:
+                with self.condition:
+                    self.pending_bytes -= size
+                    self.pending_files -= 1
+                    self.condition.notify_all()
+                self.queue.task_done()
+
+    def close(self):
+        """Дожидается загрузки всех файлов и останавливает воркеры"""
+        for _ in self.threads:
+            self.queue.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
+
+
+class BandwidthLimiter:
+    """Общее ограничение скорости загрузки для всех потоков"""
+
+    def __init__(self, bytes_per_second=0):
+        self.rate = bytes_per_second
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def consume(self, amount):
+        """Ожидание очереди на передачу amount байт"""
+        if not self.rate or amount <= 0:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(self.next_slot, now) + amount / self.rate
+        if wait > 0:
+            time.sleep(wait)
+
+
+class UploadJournal:
+    """Журнал resumable-загрузок: URI сессии и подтвержденное смещение для продолжения после перезапуска"""
+
+    # Сессии resumable-загрузки Google Drive действуют около недели
+    SESSION_TTL = 6 * 24 * 60 * 60
+
+    def __init__(self, journal_file):
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.entries = self._load()
+
+    def _load(self):
+        try:
+            if os.path.exists(self.journal_file):
+                with open(self.journal_file, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось прочитать журнал загрузок: {e}")
+        return {}
+
+    def _save(self):
+        with open(self.journal_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.entries, f, indent=2, ensure_ascii=False)
+        os.replace(self.journal_file + '.tmp', self.journal_file)
+
+    @staticmethod
+    def _signature(file_path):
+        stat = os.stat(file_path)
+        return stat.st_size, stat.st_mtime
+
+    def get(self, file_path):
+        """Сессия для продолжения загрузки, если файл не изменился и сессия не истекла"""
+        with self.lock:
+            entry = self.entries.get(file_path)
+        if not entry or not os.path.isfile(file_path):
+            return None
+        if (entry['size'], entry['mtime']) != self._signature(file_path):
+            return None
+        if time.time() - entry['created_at'] > self.SESSION_TTL:
+            return None
+        return entry
+
+    def update(self, file_path, session_uri, offset):
+        with self.lock:
+            entry = self.entries.get(file_path)
+            if not entry or entry['session_uri'] != session_uri:
+                size, mtime = self._signature(file_path)
+                entry = {'session_uri': session_uri, 'size': size, 'mtime': mtime, 'created_at': time.time()}
+                self.entries[file_path] = entry
+            entry['offset'] = offset
+            self._save()
+
+    def remove(self, file_path):
+        with self.lock:
+            if self.entries.pop(file_path, None) is not None:
+                self._save()
+
+    def pending(self):
+        """Файлы с незавершенной загрузкой; истекшие сессии и удаленные файлы убираются из журнала"""
+        with self.lock:
+            expired = [path for path, entry in self.entries.items()
+                       if not os.path.isfile(path) or time.time() - entry['created_at'] > self.SESSION_TTL]
+            for path in expired:
+                del self.entries[path]
+            if expired:
+                self._save()
+                logging.info(f"🧹 Удалено {len(expired)} истекших сессий загрузки из журнала")
+            return list(self.entries)
+
+
+class BackupCatalog:
+    """Каталог резервных копий (SQLite): одна строка на каждый артефакт"""
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS artefacts (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL UNIQUE,
+            run_id TEXT,
+            target TEXT NOT NULL,
+            engine TEXT,
+            kind TEXT NOT NULL DEFAULT 'full',
+            format TEXT,
+            codec TEXT,
+            size INTEGER,
+            md5 TEXT,
+            sha256 TEXT,
+            xxh64 TEXT,
+            started_at REAL,
+            finished_at REAL NOT NULL,
+            local_path TEXT,
+            remote TEXT,
+            remote_id TEXT,
+            reference INTEGER NOT NULL DEFAULT 0,
+            parent TEXT,
+            chain INTEGER NOT NULL DEFAULT 0,
+            verified INTEGER,
+            scrubbed_at REAL,
+            scrub_status TEXT,
+            deleted_at REAL
+        );
+        CREATE INDEX IF NOT EXISTS idx_artefacts_target ON artefacts(target, finished_at);
+        CREATE INDEX IF NOT EXISTS idx_artefacts_live ON artefacts(deleted_at, chain);
+        CREATE INDEX IF NOT EXISTS idx_artefacts_remote ON artefacts(remote_id);
+        CREATE INDEX IF NOT EXISTS idx_artefacts_run ON artefacts(run_id);
+        CREATE INDEX IF NOT EXISTS idx_artefacts_parent ON artefacts(parent);
+        CREATE TABLE IF NOT EXISTS copies (
+            name TEXT NOT NULL,
+            backend TEXT NOT NULL,
+            remote_id TEXT NOT NULL,
+            size INTEGER,
+            md5 TEXT,
+            uploaded_at REAL NOT NULL,
+            PRIMARY KEY (name, backend)
+        );
+    """
+
+    TIMESTAMP_PATTERN = re.compile(r'_\d{8}_\d{6}')
+    CODEC_EXTENSIONS = {'.zst': 'zstd', '.gz': 'gzip', '.lz4': 'lz4', '.snap': 'repository'}
+    FORMATS = {'.sql': 'sql', '.dump': 'custom', '.archive': 'archive', '.bson': 'bson', '.tar': 'tar',
+               '.rdb': 'rdb', '.db': 'sqlite', '.sqlite': 'sqlite', '.sqlite3': 'sqlite', '.json': 'json'}
+
+    def __init__(self, catalog_file):
+        self.catalog_file = catalog_file
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(catalog_file, check_same_thread=False, timeout=30)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.executescript(self.SCHEMA)
+        self._migrate()
+        self._import_legacy(os.path.dirname(catalog_file))
+
+    def _select(self, query, params=()):
+        """Чтение под той же блокировкой, что и запись: соединение общее для всех потоков"""
+        with self.lock:
+            return self.conn.execute(query, params).fetchall()
+
+    def _select_one(self, query, params=()):
+        with self.lock:
+            return self.conn.execute(query, params).fetchone()
+
+    # Столбцы, добавленные после первой версии каталога
+    ADDED_COLUMNS = {'verified': 'INTEGER', 'scrubbed_at': 'REAL', 'scrub_status': 'TEXT', 'accessed_at': 'REAL'}
+
+    def _migrate(self):
+        """Добавление столбцов, появившихся после создания каталога"""
+        columns = {row[1] for row in self.conn.execute('PRAGMA table_info(artefacts)')}
+        with self.conn:
+            for column, column_type in self.ADDED_COLUMNS.items():
+                if column not in columns:
+                    self.conn.execute(f"ALTER TABLE artefacts ADD COLUMN {column} {column_type}")
+
+    @classmethod
+    def legacy_series_key(cls, name):
+        """Цель по имени файла без метки времени (для файлов вне каталога)"""
+        return cls.TIMESTAMP_PATTERN.sub('', os.path.basename(name))
+
+    @classmethod
+    def describe(cls, name, engine):
+        """Кодек и формат артефакта по расширениям, которые задает этап сжатия"""
+        base, ext = os.path.splitext(name)
+        codec = cls.CODEC_EXTENSIONS.get(ext, 'none')
+        if codec != 'none':
+            base, ext = os.path.splitext(base)
+        fmt = cls.FORMATS.get(ext)
+        if engine == 'postgresql' and ext == '.sql':
+            fmt = 'custom'    # pg_dump --format=custom
+        if base.endswith('.gz') and ext == '.archive':
+            fmt, codec = 'archive', 'mongodump-gzip'
+        return codec, fmt
+
+    def _import_legacy(self, backup_dir):
+        """Однократный перенос индекса и истории загрузок из JSON файлов прежних версий"""
+        index_file = os.path.join(backup_dir, 'backup_index.json')
+        history_file = os.path.join(backup_dir, 'upload_history.json')
+        try:
+            with self.lock, self.conn:
+                if os.path.exists(index_file):
+                    with open(index_file, 'r', encoding='utf-8') as f:
+                        for name, entry in json.load(f).items():
+                            self.conn.execute(
+                                "INSERT OR IGNORE INTO artefacts (name, target, finished_at, local_path, remote, "
+                                "remote_id, reference, chain) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                (name, entry['series'], entry['created_at'], entry.get('local_path'),
+                                 'drive' if entry.get('drive_id') else None, entry.get('drive_id'),
+                                 int(entry.get('reference', False)), int(entry.get('chain', False))))
+                    os.replace(index_file, index_file + '.migrated')
+
+                if os.path.exists(history_file):
+                    with open(history_file, 'r', encoding='utf-8') as f:
+                        for series, entry in json.load(f).items():
+                            self.conn.execute(
+                                "INSERT OR IGNORE INTO artefacts (name, target, finished_at, remote, remote_id) "
+                                "VALUES (?, ?, ?, 'drive', ?)",
+                                (entry['name'], series, entry['uploaded_at'], entry.get('file_id')))
+                            self.conn.execute("UPDATE artefacts SET md5 = ? WHERE name = ?", (entry['md5'], entry['name']))
+                    os.replace(history_file, history_file + '.migrated')
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось перенести индекс прежней версии в каталог: {e}")
+
+    def register(self, file_path, target, engine=None, kind='full', run_id=None, md5=None, parent=None,
+                 chain=False, started_at=None, size=None):
+        """Регистрация созданного артефакта (повторная регистрация ничего не меняет)"""
+        name = os.path.basename(file_path)
+        exists = os.path.exists(file_path)
+        codec, fmt = self.describe(name, engine)
+        with self.lock, self.conn:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO artefacts (name, run_id, target, engine, kind, format, codec, size, md5, "
+                "started_at, finished_at, local_path, parent, chain) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (name, run_id, target, engine, kind, fmt, codec,
+                 os.path.getsize(file_path) if exists and os.path.isfile(file_path) else size, md5, started_at,
+                 os.path.getmtime(file_path) if exists else time.time(), file_path if exists else None, parent,
+                 int(chain)))
+
+    def get(self, file_path):
+        row = self._select_one("SELECT * FROM artefacts WHERE name = ?", (os.path.basename(file_path),))
+        return dict(row) if row else None
+
+    def find_targets(self, query):
+        """Цели с живыми артефактами, ключ которых совпадает с запросом или содержит его"""
+        return [row[0] for row in self._select(
+            "SELECT DISTINCT target FROM artefacts WHERE deleted_at IS NULL AND (target = ? OR target LIKE ?) "
+            "ORDER BY target", (query, f"%{query}%"))]
+
+    def children(self, parent, kind=None):
+        """Звенья цепочки, ссылающиеся на артефакт parent, в порядке создания"""
+        query = "SELECT * FROM artefacts WHERE parent = ? AND deleted_at IS NULL"
+        params = [parent]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        return [dict(row) for row in self._select(query + " ORDER BY finished_at, name", params)]
+
+    def live_of_kind(self, target, kind):
+        """Живые артефакты цели вида kind в порядке создания"""
+        return [dict(row) for row in self._select(
+            "SELECT * FROM artefacts WHERE target = ? AND kind = ? AND deleted_at IS NULL ORDER BY finished_at, name",
+            (target, kind))]
+
+    def set_checksums(self, file_path, **checksums):
+        columns = [c for c in ('md5', 'sha256', 'xxh64') if checksums.get(c)]
+        if not columns:
+            return
+        with self.lock, self.conn:
+            self.conn.execute(f"UPDATE artefacts SET {', '.join(c + ' = ?' for c in columns)} WHERE name = ?",
+                              [checksums[c] for c in columns] + [os.path.basename(file_path)])
+
+    def mark_verified(self, file_path, ok):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE artefacts SET verified = ? WHERE name = ?",
+                              (int(ok), os.path.basename(file_path)))
+
+    def mark_uploaded(self, file_path, remote_id, reference=False, remote='drive'):
+        """Место хранения загруженного артефакта; reference - совпал с ранее загруженным файлом"""
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE artefacts SET remote = ?, remote_id = ?, reference = ? WHERE name = ?",
+                              (remote, remote_id, int(reference), os.path.basename(file_path)))
+
+    def add_copy(self, name, backend, remote_id, size=None, md5=None):
+        """Копия артефакта в дополнительном хранилище"""
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO copies (name, backend, remote_id, size, md5, uploaded_at) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (name, backend, remote_id, size, md5, time.time()))
+
+    def copies(self, name):
+        return [dict(row) for row in self._select(
+            "SELECT * FROM copies WHERE name = ? ORDER BY uploaded_at", (name,))]
+
+    def forget_copies(self, name, backend):
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM copies WHERE name = ? AND backend = ?", (name, backend))
+
+    def previous_upload(self, target, exclude_name):
+        """Последний загруженный артефакт цели"""
+        row = self._select_one(
+            "SELECT name, md5, remote_id FROM artefacts WHERE target = ? AND remote_id IS NOT NULL "
+            "AND deleted_at IS NULL AND name != ? ORDER BY finished_at DESC LIMIT 1",
+            (target, exclude_name))
+        return dict(row) if row else None
+
+    def latest(self, target, kind=None, until=None):
+        """Последний живой артефакт цели (опционально - вида kind и не позже момента until)"""
+        query = "SELECT * FROM artefacts WHERE target = ? AND deleted_at IS NULL"
+        params = [target]
+        if kind:
+            query += " AND kind = ?"
+            params.append(kind)
+        if until:
+            query += " AND finished_at <= ?"
+            params.append(until)
+        row = self._select_one(query + " ORDER BY finished_at DESC LIMIT 1", params)
+        return dict(row) if row else None
+
+    def live_by_target(self):
+        """Живые артефакты вне инкрементальных цепочек, сгруппированные по целям"""
+        grouped = {}
+        for row in self._select("SELECT * FROM artefacts WHERE deleted_at IS NULL AND chain = 0"):
+            grouped.setdefault(row['target'], []).append(dict(row))
+        return grouped
+
+    # Виды корней инкрементальных цепочек: остальные звенья ссылаются на корень через parent
+    CHAIN_ROOT_KINDS = ('base', 'full', 'manifest')
+
+    def chain_roots(self):
+        """Живые корни инкрементальных цепочек, сгруппированные по целям"""
+        grouped = {}
+        for row in self._select(
+                "SELECT * FROM artefacts WHERE deleted_at IS NULL AND chain = 1 AND parent IS NULL "
+                f"AND kind IN ({', '.join('?' * len(self.CHAIN_ROOT_KINDS))})", self.CHAIN_ROOT_KINDS):
+            grouped.setdefault(row['target'], []).append(dict(row))
+        return grouped
+
+    def chain_orphans(self):
+        """Живые звенья цепочек без живого корня (WAL до первой базовой копии, таблицы удаленного манифеста)"""
+        # Файлы истории таймлайнов малы и нужны всем базовым копиям, поэтому хранятся всегда
+        return [dict(row) for row in self._select(
+            "SELECT * FROM artefacts WHERE deleted_at IS NULL AND chain = 1 "
+            f"AND kind NOT IN ({', '.join('?' * len(self.CHAIN_ROOT_KINDS))}, 'pack', 'history') "
+            "AND (parent IS NULL OR parent NOT IN (SELECT name FROM artefacts WHERE deleted_at IS NULL))",
+            self.CHAIN_ROOT_KINDS)]
+
+    def parents_of(self, target):
+        """Корни, на которые ссылаются звенья цели (цепочка binlog ссылается на дампы другой цели)"""
+        return {row[0] for row in self._select(
+            "SELECT DISTINCT parent FROM artefacts WHERE target = ? AND parent IS NOT NULL", (target,))}
+
+    def shared_remote_ids(self):
+        """ID файлов на Drive, на которые ссылаются живые артефакты-ссылки"""
+        return {row[0] for row in self._select(
+            "SELECT DISTINCT remote_id FROM artefacts WHERE reference = 1 AND deleted_at IS NULL")}
+
+    def live_remote_ids(self, kind):
+        return {row[0] for row in self._select(
+            "SELECT remote_id FROM artefacts WHERE kind = ? AND remote_id IS NOT NULL AND deleted_at IS NULL",
+            (kind,))}
+
+    def target_for_remote(self, remote_id):
+        row = self._select_one("SELECT target FROM artefacts WHERE remote_id = ? LIMIT 1", (remote_id,))
+        return row[0] if row else None
+
+    def uploaded_record(self, remote_id):
+        """Исходная (не ссылочная) запись файла на Drive: размер и MD5 на момент загрузки"""
+        row = self._select_one(
+            "SELECT * FROM artefacts WHERE remote_id = ? AND reference = 0 AND deleted_at IS NULL "
+            "ORDER BY finished_at LIMIT 1", (remote_id,))
+        return dict(row) if row else None
+
+    def mark_scrubbed(self, remote_id, status):
+        with self.lock, self.conn:
+            self.conn.execute("UPDATE artefacts SET scrubbed_at = ?, scrub_status = ? WHERE remote_id = ?",
+                              (time.time(), status, remote_id))
+
+    def unscrubbed_uploads(self, since):
+        """Загруженные до начала цикла проверки файлы, которые цикл не встретил на Drive"""
+        return [dict(row) for row in self._select(
+            "SELECT * FROM artefacts WHERE remote = 'drive' AND remote_id IS NOT NULL AND reference = 0 "
+            "AND deleted_at IS NULL AND finished_at < ? AND (scrubbed_at IS NULL OR scrubbed_at < ?)",
+            (since, since))]
+
+    def mark_deleted(self, names):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE artefacts SET deleted_at = ? WHERE name = ?",
+                                  [(time.time(), name) for name in names])
+
+    def local_before(self, cutoff):
+        """Локальные копии, созданные раньше момента cutoff"""
+        return [(row[0], row[1]) for row in self._select(
+            "SELECT name, local_path FROM artefacts WHERE local_path IS NOT NULL AND deleted_at IS NULL "
+            "AND kind != 'pack' AND finished_at < ?", (cutoff,))]
+
+    def cached_uploads(self):
+        """Загруженные артефакты, локальная копия которых еще хранится, - новые первыми"""
+        return [dict(row) for row in self._select(
+            "SELECT name, target, size, local_path, finished_at, COALESCE(accessed_at, finished_at) AS accessed_at "
+            "FROM artefacts WHERE local_path IS NOT NULL AND deleted_at IS NULL AND kind != 'pack' "
+            "AND (remote_id IS NOT NULL OR EXISTS (SELECT 1 FROM copies WHERE copies.name = artefacts.name)) "
+            "ORDER BY target, finished_at DESC")]
+
+    def touch(self, names):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE artefacts SET accessed_at = ? WHERE name = ?",
+                                  [(time.time(), name) for name in names])
+
+    def clear_local(self, names):
+        with self.lock, self.conn:
+            self.conn.executemany("UPDATE artefacts SET local_path = NULL WHERE name = ?", [(n,) for n in names])
+
+    def run_artefacts(self, run_id):
+        return [dict(row) for row in self._select(
+            "SELECT * FROM artefacts WHERE run_id = ? ORDER BY finished_at, name", (run_id,))]
+
+    def run_summary(self, run_id):
+        row = self._select_one(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0), COUNT(remote_id), COALESCE(SUM(reference), 0) "
+            "FROM artefacts WHERE run_id = ?", (run_id,))
+        return {'artefacts': row[0], 'bytes': row[1], 'uploaded': row[2], 'references': row[3]}
+
+
+class DriveRetention:
+    """Хранение резервных копий на Google Drive: постраничный список папки и пакетное удаление"""
+
+    BATCH_SIZE = 100
+    PAGE_SIZE = 1000
+    RETRY_STATUSES = (403, 429, 500, 502, 503)
+
+    def __init__(self, service, folder_id, keep_days, protected_ids=(), series_of=None, max_retries=5,
+                 sleep=time.sleep):
+        self.service = service
+        self.folder_id = folder_id
+        self.keep_days = keep_days
+        self.protected_ids = set(protected_ids)
+        self.series_of = series_of or (lambda drive_file: BackupCatalog.legacy_series_key(drive_file['name']))
+        self.max_retries = max_retries
+        self.sleep = sleep
+
+    def list_files(self):
+        """Все файлы папки резервных копий (files.list по страницам)"""
+        files = []
+        page_token = None
+        while True:
+            response = self.service.files().list(
+                q=f"'{self.folder_id}' in parents and trashed = false",
+                fields='nextPageToken, files(id, name, createdTime, size)',
+                pageSize=self.PAGE_SIZE,
+                pageToken=page_token
+            ).execute()
+            files.extend(response.get('files', []))
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return files
+
+    @staticmethod
+    def _created_at(drive_file):
+        return datetime.fromisoformat(drive_file['createdTime'].replace('Z', '+00:00')).timestamp()
+
+    def select_expired(self, files):
+        """Файлы старше срока хранения; последняя копия каждой цели и файлы со ссылками сохраняются"""
+        cutoff = time.time() - self.keep_days * 24 * 60 * 60
+
+        latest = {}
+        for drive_file in files:
+            key = self.series_of(drive_file)
+            if key not in latest or self._created_at(drive_file) > self._created_at(latest[key]):
+                latest[key] = drive_file
+
+        keep_ids = {drive_file['id'] for drive_file in latest.values()}
+        return [f for f in files if self._created_at(f) < cutoff
+                and f['id'] not in keep_ids and f['id'] not in self.protected_ids]
+
+    def delete(self, files):
+        """Удаление пакетами по 100 запросов с экспоненциальной паузой при ограничении частоты"""
+        deleted, failed = [], []
+
+        for start in range(0, len(files), self.BATCH_SIZE):
+            pending = {f['id']: f for f in files[start:start + self.BATCH_SIZE]}
+
+            for attempt in range(self.max_retries + 1):
+                retry = {}
+
+                def callback(request_id, response, exception):
+                    drive_file = pending[request_id]
+                    status = getattr(getattr(exception, 'resp', None), 'status', None)
+                    if exception is None or status == 404:
+                        deleted.append(drive_file)
+                    elif status in self.RETRY_STATUSES:
+                        retry[request_id] = drive_file
+                    else:
+                        logging.error(f"❌ Не удалось удалить {drive_file['name']} с Google Drive: {exception}")
+                        failed.append(drive_file)
+
+                batch = self.service.new_batch_http_request(callback=callback)
+                for file_id in pending:
+                    batch.add(self.service.files().delete(fileId=file_id), request_id=file_id)
+                batch.execute()
+
+                if not retry:
+                    break
+                if attempt == self.max_retries:
+                    failed.extend(retry.values())
+                    break
+
+                delay = min(2 ** attempt, 64)
+                logging.info(f"⏳ Ограничение частоты Google Drive, повтор {len(retry)} удалений через {delay} с")
+                self.sleep(delay)
+                pending = retry
+
+        return deleted, failed
+
+    def apply(self):
+        files = self.list_files()
+        expired = self.select_expired(files)
+        if not expired:
+            logging.info(f"☁️ На Google Drive {len(files)} файлов, устаревших нет")
+            return [], []
+
+        deleted, failed = self.delete(expired)
+        logging.info(f"🗑️ С Google Drive удалено {len(deleted)} из {len(expired)} устаревших файлов "
+                     f"(всего в папке: {len(files)})")
+        return deleted, failed
+
+
+class RemoteScrub:
+    """Проверка копий на Google Drive по метаданным (размер и md5Checksum) без скачивания"""
+
+    PAGE_SIZE = 1000
+
+    def __init__(self, service, folder_id, catalog, state_file, files_per_run=1000, files_per_minute=600,
+                 sleep=time.sleep):
+        self.service = service
+        self.folder_id = folder_id
+        self.catalog = catalog
+        self.state_file = state_file
+        self.files_per_run = max(1, files_per_run)
+        self.files_per_minute = files_per_minute
+        self.sleep = sleep
+
+    def load_state(self):
+        if os.path.exists(self.state_file):
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        return {'cycle_started': None, 'page_token': None, 'checked': 0, 'findings': [], 'last_completed': None}
+
+    def save_state(self, state):
+        with open(self.state_file + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(state, f, indent=2, ensure_ascii=False)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+    def due(self, interval_hours):
+        """Незавершенный цикл продолжается при каждом запуске, новый - раз в interval_hours"""
+        state = self.load_state()
+        if state.get('cycle_started'):
+            return True
+        return not state.get('last_completed') or time.time() - state['last_completed'] >= interval_hours * 60 * 60
+
+    def check(self, drive_file):
+        """Сравнение файла на Drive с размером и MD5, записанными при загрузке"""
+        record = self.catalog.uploaded_record(drive_file['id'])
+        if not record:
+            return 'untracked', None
+        remote_size = int(drive_file.get('size', -1))
+        if record['size'] is not None and remote_size < record['size']:
+            return 'truncated', f"{remote_size} из {record['size']} байт"
+        if record['size'] is not None and remote_size != record['size']:
+            return 'mismatch', f"размер {remote_size}, ожидался {record['size']}"
+        remote_md5 = drive_file.get('md5Checksum')
+        if record['md5'] and remote_md5 and remote_md5 != record['md5']:
+            return 'mismatch', f"md5Checksum {remote_md5}, ожидался {record['md5']}"
+        return 'ok', None
+
+    def _finding(self, drive_file, status, detail):
+        logging.error(f"❌ Google Drive: {drive_file['name']} - {status}" + (f" ({detail})" if detail else ''))
+        return {'name': drive_file['name'], 'id': drive_file['id'], 'status': status, 'detail': detail}
+
+    def _list_page(self, page_token, page_size):
+        return self.service.files().list(
+            q=f"'{self.folder_id}' in parents and trashed = false",
+            fields='nextPageToken, files(id, name, size, md5Checksum)',
+            orderBy='name',
+            pageSize=page_size,
+            pageToken=page_token
+        ).execute()
+
+    def _confirm_missing(self, record):
+        """Файл, не встреченный в списке, проверяется отдельным запросом (мог быть загружен во время цикла)"""
+        try:
+            drive_file = self.service.files().get(
+                fileId=record['remote_id'], fields='id, name, size, md5Checksum, trashed').execute()
+        except Exception as e:
+            if getattr(getattr(e, 'resp', None), 'status', None) == 404:
+                return 'missing', None
+            raise
+        if drive_file.get('trashed'):
+            return 'missing', 'в корзине'
+        return self.check(drive_file)
+
+    def run(self):
+        """Проверка очередной порции файлов; состояние цикла сохраняется после каждой страницы"""
+        state = self.load_state()
+        if not state.get('cycle_started'):
+            state.update(cycle_started=time.time(), page_token=None, checked=0, findings=[])
+            logging.info("🔬 Новый цикл проверки копий на Google Drive")
+        elif state.get('page_token'):
+            logging.info(f"🔬 Продолжение проверки Google Drive (проверено файлов: {state['checked']})")
+
+        processed = 0
+        counts = {}
+        while processed < self.files_per_run:
+            try:
+                response = self._list_page(state['page_token'], min(self.PAGE_SIZE, self.files_per_run - processed))
+            except Exception as e:
+                if state['page_token'] and getattr(getattr(e, 'resp', None), 'status', None) == 400:
+                    # Токен страницы истек - цикл начинается заново
+                    logging.warning("⚠️ Токен страницы Google Drive истек, проверка начинается сначала")
+                    state.update(cycle_started=time.time(), page_token=None, checked=0, findings=[])
+                    continue
+                raise
+
+            files = response.get('files', [])
+            for drive_file in files:
+                status, detail = self.check(drive_file)
+                counts[status] = counts.get(status, 0) + 1
+                if status != 'untracked':
+                    self.catalog.mark_scrubbed(drive_file['id'], status)
+                if status not in ('ok', 'untracked'):
+                    state['findings'].append(self._finding(drive_file, status, detail))
+
+            processed += len(files)
+            state['checked'] += len(files)
+            state['page_token'] = response.get('nextPageToken')
+
+            if not state['page_token']:
+                # Конец списка: файлы из каталога, которых в нем не было
+                for record in self.catalog.unscrubbed_uploads(state['cycle_started']):
+                    status, detail = self._confirm_missing(record)
+                    counts[status] = counts.get(status, 0) + 1
+                    self.catalog.mark_scrubbed(record['remote_id'], status)
+                    if status != 'ok':
+                        state['findings'].append(self._finding(
+                            {'name': record['name'], 'id': record['remote_id']}, status, detail))
+                state.update(cycle_started=None, last_completed=time.time())
+                self.save_state(state)
+                break
+
+            self.save_state(state)
+            if self.files_per_minute and files:
+                self.sleep(len(files) * 60 / self.files_per_minute)
+
+        report = {
+            'checked': processed,
+            'counts': counts,
+            'cycle_complete': not state['cycle_started'],
+            'findings': state['findings']
+        }
+        logging.info(f"🔬 Проверено файлов на Google Drive: {processed} "
+                     f"({', '.join(f'{k}: {v}' for k, v in sorted(counts.items())) or 'нет'}), "
+                     f"{'цикл завершен' if report['cycle_complete'] else 'цикл продолжится при следующем запуске'}")
+        return report
+
+
+class GfsRetention:
+    """Ротация дед-отец-сын: почасовые, ежедневные, еженедельные и ежемесячные копии каждой цели"""
+
+    TIERS = (('hourly', '%Y%m%d%H'), ('daily', '%Y%m%d'), ('weekly', '%G-W%V'), ('monthly', '%Y%m'))
+
+    def __init__(self, hourly=24, daily=7, weekly=4, monthly=6):
+        self.limits = {'hourly': hourly, 'daily': daily, 'weekly': weekly, 'monthly': monthly}
+
+    def select(self, backups):
+        """Разделение копий одной цели на сохраняемые и устаревшие"""
+        ordered = sorted(backups, key=lambda b: b['finished_at'], reverse=True)
+        keep = {ordered[0]['name']} if ordered else set()
+
+        # В каждом уровне сохраняется самая новая копия каждого из последних N периодов
+        for tier, period_format in self.TIERS:
+            periods = set()
+            for backup in ordered:
+                period = datetime.fromtimestamp(backup['finished_at']).strftime(period_format)
+                if period in periods:
+                    continue
+                if len(periods) >= self.limits[tier]:
+                    break
+                periods.add(period)
+                keep.add(backup['name'])
+
+        return ([b for b in ordered if b['name'] in keep],
+                [b for b in ordered if b['name'] not in keep])
+
+
+class LocalCache:
+    """Локальный кэш загруженных копий для восстановления без скачивания с Drive
+
+    После загрузки файл остается в BACKUP_DIR, если кэш включен. Для каждой цели хранятся
+    keep_per_target последних копий; при превышении бюджета удаляются копии, к которым
+    дольше всего не обращались (время обращения обновляет восстановление).
+    Незагруженные файлы и pack-файлы репозитория кэшем не учитываются.
+    """
+
+    def __init__(self, catalog, budget_bytes=0, keep_per_target=2):
+        self.catalog = catalog
+        self.budget_bytes = budget_bytes
+        self.keep_per_target = keep_per_target
+        self.lock = threading.Lock()
+        self.evicted = 0
+
+    @property
+    def enabled(self):
+        return self.budget_bytes > 0 and self.keep_per_target > 0
+
+    def admit(self, path):
+        """Решение конвейера загрузки: оставить ли загруженный файл локально"""
+        if not self.enabled or os.path.isdir(path):
+            return False
+        self.evict()
+        return True
+
+    def evict(self):
+        """Удаление лишних копий: сверх keep_per_target на цель, затем по LRU до бюджета"""
+        if not self.enabled:
+            return []
+        with self.lock:
+            entries = [e for e in self.catalog.cached_uploads() if os.path.isfile(e['local_path'])]
+            for entry in entries:
+                entry['size'] = entry['size'] or os.path.getsize(entry['local_path'])
+
+            evict = []
+            kept = []
+            per_target = {}
+            for entry in entries:
+                per_target[entry['target']] = per_target.get(entry['target'], 0) + 1
+                (kept if per_target[entry['target']] <= self.keep_per_target else evict).append(entry)
+
+            used = sum(e['size'] for e in kept)
+            for entry in sorted(kept, key=lambda e: e['accessed_at']):
+                if used <= self.budget_bytes:
+                    break
+                evict.append(entry)
+                used -= entry['size']
+
+            removed = []
+            for entry in evict:
+                try:
+                    os.remove(entry['local_path'])
+                    removed.append(entry['name'])
+                    logging.debug(f"🗑️ Удален из локального кэша: {entry['name']}")
+                except OSError as e:
+                    logging.error(f"Ошибка удаления файла из локального кэша: {e}")
+            self.catalog.clear_local(removed)
+            self.evicted += len(removed)
+            return removed
+
+    def usage(self):
+        entries = [e for e in self.catalog.cached_uploads() if os.path.isfile(e['local_path'])]
+        return {'files': len(entries), 'bytes': sum(os.path.getsize(e['local_path']) for e in entries),
+                'budget_bytes': self.budget_bytes, 'evicted': self.evicted}
+
+
+class RestoreManager:
+    """Восстановление по каталогу: цепочка артефактов, параллельная загрузка с Drive и подача в утилиты СУБД"""
+
+    def __init__(self, backup, jobs=4):
+        self.backup = backup
+        self.catalog = backup.catalog
+        self.jobs = max(1, jobs)
+        self.work_dir = os.path.join(backup.BACKUP_DIR, 'restore')
+        self.stats = {'downloaded_bytes': 0, 'download_seconds': 0.0, 'restored_bytes': 0, 'restore_seconds': 0.0}
+        self.lock = threading.Lock()
+        self.temp_files = []
+        os.makedirs(self.work_dir, exist_ok=True)
+
+    # ---------- Поиск цепочки ----------
+
+    def resolve_target(self, query):
+        """Цель по точному ключу каталога или по уникальной подстроке"""
+        targets = self.catalog.find_targets(query)
+        if query in targets:
+            return query
+        if len(targets) == 1:
+            return targets[0]
+        if not targets:
+            raise RuntimeError(f"Цель '{query}' не найдена в каталоге")
+        raise RuntimeError(f"Цель '{query}' неоднозначна: {', '.join(targets[:10])}")
+
+    def plan(self, target, until=None):
+        """Артефакты, необходимые для восстановления цели на момент until"""
+        if target.startswith('pgwal:'):
+            base = self.catalog.latest(target, kind='base', until=until)
+            if not base:
+                raise RuntimeError(f"Нет базовой копии {target} на выбранный момент")
+            return {'mode': 'pg_physical', 'target': target, 'root': base,
+                    'artefacts': [base] + self.catalog.children(base['name'], kind='wal')
+                    + self.catalog.live_of_kind(target, 'history')}
+
+        if target.startswith('oplog:'):
+            server = target.split(':', 1)[1]
+            tailer = self.backup.oplog_tailer or MongoOplogTailer(self.backup.BACKUP_DIR)
+            until_ts = (int(until), 0) if until else None
+            chain = tailer.restore_chain(server, until_ts)
+            if not chain:
+                raise RuntimeError(f"Нет полного архива {target} на выбранный момент")
+            names = [chain['full_archive']['file']] + [c['file'] for c in chain['chunks']]
+            artefacts = [self._artefact(n) for n in names]
+            return {'mode': 'mongo_oplog', 'target': target, 'server': server, 'oplog_limit': until_ts,
+                    'root': artefacts[0], 'artefacts': artefacts}
+
+        root = self.catalog.latest(target, until=until)
+        if not root:
+            raise RuntimeError(f"Нет резервной копии {target} на выбранный момент")
+
+        if root['kind'] == 'manifest':
+            return {'mode': 'pg_table_diff', 'target': target, 'root': root, 'artefacts': [root]}
+
+        plan = {'mode': root['engine'] or 'file', 'target': target, 'root': root, 'artefacts': [root]}
+
+        # MySQL в режиме binlog: дамп + binlog от его позиции до выбранного момента
+        if root['engine'] == 'mysql':
+            server = self._mysql_server(target)
+            streamer = self.backup.binlog_streamer or MysqlBinlogStreamer(self.backup.BACKUP_DIR,
+                                                                          self.backup.compression)
+            index = streamer.load_index(server) if server else None
+            position = next((d for d in index['full_dumps'] if d['file'] == root['name']), None) if index else None
+            if position:
+                start = streamer._binlog_number(position['binlog_file'])
+                binlogs = sorted((b for b in index['binlogs'] if streamer._binlog_number(b['binlog']) >= start),
+                                 key=lambda b: streamer._binlog_number(b['binlog']))
+                plan['binlog_position'] = position
+                plan['binlogs'] = {b['binlog']: b['file'] for b in binlogs}
+                plan['artefacts'] += [self._artefact(b['file']) for b in binlogs]
+        return plan
+
+    def _artefact(self, name):
+        """Живая запись звена цепочки: без любого звена восстановление было бы неполным"""
+        record = self.catalog.get(name)
+        if not record or record.get('deleted_at'):
+            raise RuntimeError(f"Звено цепочки {name} отсутствует в каталоге или удалено ротацией")
+        return record
+
+    @staticmethod
+    def _mysql_server(target):
+        parts = target.split(':')
+        if parts[0] == 'docker':
+            return f"docker_{parts[1]}"
+        if parts[0] == 'mysql' and len(parts) >= 4:
+            return f"{parts[1]}_{parts[2]}"
+        return None
+
+    # ---------- Загрузка ----------
+
+    def fetch(self, artefacts):
+        """Локальные пути артефактов; отсутствующие локально скачиваются с Drive параллельно"""
+        paths = {}
+        missing = []
+        for artefact in artefacts:
+            if artefact.get('local_path') and os.path.isfile(artefact['local_path']):
+                paths[artefact['name']] = artefact['local_path']
+            elif artefact.get('remote_id') or self.catalog.copies(artefact['name']):
+                missing.append(artefact)
+            else:
+                raise RuntimeError(f"Артефакт {artefact['name']} недоступен ни локально, ни в хранилищах")
+
+        if paths:
+            # Обращение продлевает жизнь копий в локальном кэше
+            self.catalog.touch(list(paths))
+            logging.info(f"📦 Из локального кэша: {len(paths)} из {len(artefacts)} файлов")
+
+        if missing:
+            started = time.monotonic()
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                for name, path in pool.map(self._download, missing):
+                    paths[name] = path
+            self.stats['download_seconds'] += time.monotonic() - started
+            mb = self.stats['downloaded_bytes'] / (1024 * 1024)
+            logging.info(f"⬇️ Загружено из хранилищ {len(missing)} файлов, {mb:.1f} MB "
+                         f"({mb / max(self.stats['download_seconds'], 0.001):.1f} MB/s)")
+        
+        self._fetch_packs([a for a in artefacts if a.get('codec') == 'repository'], paths)
+        return paths
+
+    def _fetch_packs(self, snapshots, paths):
+        """pack-файлы снимков репозитория, отсутствующие локально, скачиваются в локальный репозиторий"""
+        pack_dir = os.path.join(self.backup.BACKUP_DIR, 'repository', 'packs')
+        needed = set()
+        for snapshot in snapshots:
+            needed |= ChunkRepository.snapshot_packs(paths[snapshot['name']])
+        missing = []
+        for name in sorted(needed):
+            if os.path.isfile(os.path.join(pack_dir, name)):
+                continue
+            record = self.catalog.get(name)
+            if not record or not (record.get('remote_id') or self.catalog.copies(name)):
+                raise RuntimeError(f"pack-файл {name} недоступен ни локально, ни в хранилищах")
+            missing.append(record)
+        if missing:
+            os.makedirs(pack_dir, exist_ok=True)
+            with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+                list(pool.map(lambda record: self._download(record, pack_dir), missing))
+            logging.info(f"🧩 Загружено pack-файлов репозитория: {len(missing)}")
+
+    def _download(self, artefact, directory=None):
+        path = os.path.join(directory or self.work_dir, artefact['name'])
+        
+        # Drive, затем дополнительные хранилища в порядке загрузки
+        sources = [('drive', artefact['remote_id'])] if artefact.get('remote_id') else []
+        sources += [(c['backend'], c['remote_id']) for c in self.catalog.copies(artefact['name'])]
+        for backend_name, remote_id in sources:
+            backend = self.backup.storage_backend(backend_name)
+            if not backend:
+                continue
+            try:
+                with open(path, 'wb') as f:
+                    backend.get(remote_id, f)
+                break
+            except Exception as e:
+                logging.warning(f"⚠️ {artefact['name']} не получен из хранилища {backend_name}: {e}")
+        else:
+            raise RuntimeError(f"Артефакт {artefact['name']} не удалось получить ни из одного хранилища")
+        with self.lock:
+            self.stats['downloaded_bytes'] += os.path.getsize(path)
+            if not directory:
+                self.temp_files.append(path)
+        return artefact['name'], path
+
+    # ---------- Подача в утилиты ----------
+
+    def _reader(self, path, artefact):
+        return CompressionStage.open_reader(path, artefact.get('codec') or 'none')
+
+    def _decompress_to(self, path, artefact, destination):
+        with self._reader(path, artefact) as src, open(destination, 'wb') as dst:
+            shutil.copyfileobj(src, dst, 1024 * 1024)
+        with self.lock:
+            self.stats['restored_bytes'] += os.path.getsize(destination)
+        return destination
+
+    def _pipe(self, cmd, reader, env=None, container=None):
+        """Потоковая подача данных в stdin утилиты на хосте или в контейнере"""
+        copied = 0
+        if container is not None:
+            api = self.backup.docker_client.api
+            exec_id = api.exec_create(container.id, cmd, stdin=True, environment=env or {})['Id']
+            sock = api.exec_start(exec_id, socket=True)
+            raw = getattr(sock, '_sock', sock)
+            for chunk in iter(lambda: reader.read(1024 * 1024), b''):
+                raw.sendall(chunk)
+                copied += len(chunk)
+            raw.shutdown(socket.SHUT_WR)
+            output = b''.join(iter(lambda: raw.recv(65536), b''))
+            raw.close()
+            returncode = api.exec_inspect(exec_id).get('ExitCode')
+            stderr = output.decode('utf-8', errors='replace')
+        else:
+            with tempfile.TemporaryFile() as stderr_file:
+                process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL,
+                                           stderr=stderr_file, env=env)
+                try:
+                    for chunk in iter(lambda: reader.read(1024 * 1024), b''):
+                        process.stdin.write(chunk)
+                        copied += len(chunk)
+                except BrokenPipeError:
+                    pass
+                finally:
+                    process.stdin.close()
+                    returncode = process.wait()
+                stderr_file.seek(0)
+                stderr = stderr_file.read().decode('utf-8', errors='replace')
+
+        with self.lock:
+            self.stats['restored_bytes'] += copied
+        if returncode != 0:
+            raise RuntimeError(f"{cmd[0]}: {stderr.strip()[-2000:]}")
+
+    def _run(self, cmd, env=None, container=None, check=True):
+        if container is not None:
+            result = container.exec_run(cmd, environment=env or {})
+            returncode, output = result.exit_code, result.output.decode('utf-8', errors='replace')
+        else:
+            result = subprocess.run(cmd, capture_output=True, text=True, env=env)
+            returncode, output = result.returncode, result.stderr
+        if check and returncode != 0:
+            raise RuntimeError(f"{cmd[0]}: {output.strip()[-2000:]}")
+        return returncode
+
+    def _connection(self, target, engine):
+        """Параметры подключения: (аргументы утилиты, env, контейнер, исходная база)"""
+        parts = target.split(':')
+        if parts[0] == 'docker':
+            container = self.backup.docker_client.containers.get(parts[1])
+            return self._container_credentials(parts[1]), container, parts[3]
+
+        credentials = dict(self.backup.auto_credentials.get(engine, {}))
+        credentials.update({'host': parts[1], 'port': parts[2]})
+        return credentials, None, parts[3]
+
+    def _container_credentials(self, container_name):
+        """Учетные данные БД в контейнере, найденные при обнаружении баз"""
+        info = next((d for d in self.backup.discover_all_databases()
+                     if d.get('container_name') == container_name), {})
+        return info.get('credentials', {})
+
+    def _restore_postgres(self, plan, paths, destination):
+        root = plan['root']
+        credentials, container, database = self._connection(plan['target'], 'postgresql')
+        database = destination or database
+        if container is not None:
+            args = ['-h', credentials.get('host', 'postgres'), '-U', credentials.get('user', 'postgres')]
+            env = {'PGPASSWORD': credentials['password']} if credentials.get('password') else {}
+        else:
+            args = ['-h', credentials['host'], '-p', str(credentials['port']),
+                    '-U', credentials.get('user', 'postgres')]
+            env = os.environ.copy()
+            env['PGPASSWORD'] = credentials.get('password', '')
+
+        self._run(['createdb'] + args + ['--no-password', database], env, container, check=False)
+
+        if container is not None:
+            # В контейнер архив передается потоком: pg_restore --jobs требует файл с произвольным доступом
+            with self._reader(paths[root['name']], root) as reader:
+                self._pipe(['pg_restore'] + args + ['--no-password', '--no-owner', '-d', database], reader, env, container)
+            return database
+
+        archive = paths[root['name']]
+        if root.get('codec') not in (None, 'none'):
+            archive = self._decompress_to(archive, root, os.path.join(self.work_dir, f"{root['name']}.dump"))
+            self.temp_files.append(archive)
+        self._run(['pg_restore'] + args + ['--no-password', '--no-owner', '--jobs', str(self.jobs),
+                                            '-d', database, archive], env)
+        return database
+
+    def _restore_pg_table_diff(self, plan, paths, destination):
+        """Схема (pre-data), данные таблиц параллельно, затем индексы и ограничения (post-data)"""
+        with open(paths[plan['root']['name']], 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        parts = [self._artefact(manifest['schema'])] + [self._artefact(t['file']) for t in manifest['tables'].values()]
+        paths.update(self.fetch(parts))
+
+        credentials, container, database = self._connection(plan['target'], 'postgresql')
+        if container is not None:
+            raise RuntimeError("Дифференциальные копии восстанавливаются через порт на хосте (--restore-to с host)")
+        database = destination or database
+        args = ['-h', credentials['host'], '-p', str(credentials['port']), '-U', credentials.get('user', 'postgres'),
+                '--no-password', '--no-owner', '-d', database]
+        env = os.environ.copy()
+        env['PGPASSWORD'] = credentials.get('password', '')
+        self._run(['createdb'] + args[:6] + [database], env, check=False)
+
+        def restore_part(artefact, extra):
+            with self._reader(paths[artefact['name']], artefact) as reader:
+                self._pipe(['pg_restore'] + args + extra, reader, env)
+
+        schema = parts[0]
+        restore_part(schema, ['--section=pre-data'])
+        with ThreadPoolExecutor(max_workers=self.jobs) as pool:
+            list(pool.map(lambda a: restore_part(a, ['--data-only']), parts[1:]))
+        restore_part(schema, ['--section=post-data'])
+        return database
+
+    def _restore_mysql(self, plan, paths, destination, until):
+        root = plan['root']
+        credentials, container, database = self._connection(plan['target'], 'mysql')
+        database = destination or database
+        if container is not None:
+            args = ['-u', credentials.get('user', 'root')]
+        else:
+            args = ['-h', credentials['host'], '-P', str(credentials['port']), '-u', credentials.get('user', 'root')]
+        if credentials.get('password'):
+            args.append(f"-p{credentials['password']}")
+
+        self._run(['mysql'] + args + ['-e', f"CREATE DATABASE IF NOT EXISTS `{database}`"], container=container)
+        with self._reader(paths[root['name']], root) as reader:
+            self._pipe(['mysql'] + args + [database], reader, container=container)
+
+        if plan.get('binlogs') and container is None:
+            # Повтор изменений из binlog от позиции дампа до выбранного момента
+            files = []
+            artefacts = {a['name']: a for a in plan['artefacts']}
+            for name, file_name in plan['binlogs'].items():
+                binlog = artefacts[file_name]
+                files.append(self._decompress_to(paths[binlog['name']], binlog, os.path.join(self.work_dir, name)))
+                self.temp_files.append(files[-1])
+            cmd = ['mysqlbinlog', f"--start-position={plan['binlog_position']['binlog_pos']}",
+                   f"--database={plan['binlog_position']['database']}"]
+            if until:
+                cmd.append(f"--stop-datetime={datetime.fromtimestamp(until).strftime('%Y-%m-%d %H:%M:%S')}")
+            with tempfile.TemporaryFile() as stderr_file:
+                replay = subprocess.Popen(cmd + files, stdout=subprocess.PIPE, stderr=stderr_file)
+                try:
+                    self._pipe(['mysql'] + args + [database], replay.stdout)
+                finally:
+                    replay.stdout.close()
+                    if replay.wait() != 0:
+                        stderr_file.seek(0)
+                        stderr = stderr_file.read().decode('utf-8', errors='replace')
+                        raise RuntimeError(f"mysqlbinlog: {stderr.strip()[-2000:]}")
+            logging.info(f"🐬 Применено binlog файлов: {len(files)}")
+        return database
+
+    def _mongo_args(self, target, credentials):
+        args = ['--numParallelCollections', str(self.jobs)]
+        if credentials.get('password'):
+            args += ['--username', credentials.get('user', 'admin'), '--password', credentials['password'],
+                     '--authenticationDatabase', 'admin']
+        return args
+
+    def _restore_mongodb(self, plan, paths, destination):
+        root = plan['root']
+        credentials, container, database = self._connection(plan['target'], 'mongodb')
+        args = self._mongo_args(plan['target'], credentials)
+        if container is None:
+            args = ['--host', f"{credentials['host']}:{credentials['port']}"] + args
+        if destination:
+            args += ['--nsFrom', f"{database}.*", '--nsTo', f"{destination}.*"]
+        if root.get('codec') == 'mongodump-gzip':
+            args.append('--gzip')
+        with self._reader(paths[root['name']], root) as reader:
+            self._pipe(['mongorestore', '--archive'] + args, reader, container=container)
+        return destination or database
+
+    def _restore_mongo_oplog(self, plan, paths):
+        server = plan['server']
+        container = None
+        if server.startswith('docker_'):
+            container = self.backup.docker_client.containers.get(server[len('docker_'):])
+            credentials = self._container_credentials(server[len('docker_'):])
+            args = []
+        else:
+            host, port = server.rsplit('_', 1)
+            credentials = self.backup.auto_credentials.get('mongodb', {})
+            args = ['--host', f"{host}:{port}"]
+        args += self._mongo_args(plan['target'], credentials)
+
+        full = plan['artefacts'][0]
+        with self._reader(paths[full['name']], full) as reader:
+            self._pipe(['mongorestore', '--archive', '--oplogReplay'] + args, reader, container=container)
+
+        limit = ['--oplogLimit', f"{plan['oplog_limit'][0]}:{plan['oplog_limit'][1]}"] if plan['oplog_limit'] else []
+        for chunk in plan['artefacts'][1:]:
+            chunk_dir = tempfile.mkdtemp(dir=self.work_dir)
+            try:
+                self._decompress_to(paths[chunk['name']], chunk, os.path.join(chunk_dir, 'oplog.bson'))
+                if container is None:
+                    self._run(['mongorestore', '--oplogReplay'] + limit + args + [chunk_dir])
+                    continue
+                
+                # mongorestore --oplogReplay читает oplog.bson из каталога: файл копируется в контейнер
+                container_dir = f"/tmp/dumpitall_oplog_{os.path.basename(chunk_dir)}"
+                with tempfile.TemporaryFile(dir=self.work_dir) as archive_file:
+                    with tarfile.open(fileobj=archive_file, mode='w') as archive:
+                        archive.add(os.path.join(chunk_dir, 'oplog.bson'), arcname='oplog.bson')
+                    archive_file.seek(0)
+                    self._run(['mkdir', '-p', container_dir], container=container)
+                    try:
+                        if not container.put_archive(container_dir, archive_file):
+                            raise RuntimeError(f"не удалось скопировать {chunk['name']} в контейнер")
+                        self._run(['mongorestore', '--oplogReplay'] + limit + args + [container_dir],
+                                  container=container)
+                    finally:
+                        self._run(['rm', '-rf', container_dir], container=container, check=False)
+            finally:
+                shutil.rmtree(chunk_dir, ignore_errors=True)
+        logging.info(f"🍃 Применено фрагментов oplog: {len(plan['artefacts']) - 1}")
+        return server
+
+    def _restore_pg_physical(self, plan, paths, destination, until):
+        """Размещение базовой копии и WAL в каталоге данных с настройкой восстановления"""
+        if not destination:
+            raise RuntimeError("Для физического восстановления укажите каталог данных: --restore-to /path/to/pgdata")
+        os.makedirs(destination, exist_ok=True)
+        base = plan['artefacts'][0]
+        with self._reader(paths[base['name']], base) as reader:
+            with tarfile.open(fileobj=reader, mode='r|') as archive:
+                self._extract_tar(archive, destination)
+
+        wal_dir = os.path.join(destination, 'restore_wal')
+        os.makedirs(wal_dir, exist_ok=True)
+        for segment in plan['artefacts'][1:]:
+            name = segment['name'].rsplit('_', 1)[-1]
+            name = os.path.splitext(name)[0] if segment.get('codec') not in (None, 'none') else name
+            self._decompress_to(paths[segment['name']], segment, os.path.join(wal_dir, name))
+
+        with open(os.path.join(destination, 'postgresql.auto.conf'), 'a', encoding='utf-8') as f:
+            f.write(f"\nrestore_command = 'cp \"{wal_dir}/%f\" \"%p\"'\n")
+            if until:
+                f.write(f"recovery_target_time = '{datetime.fromtimestamp(until).strftime('%Y-%m-%d %H:%M:%S')}'\n")
+                f.write("recovery_target_action = 'promote'\n")
+        open(os.path.join(destination, 'recovery.signal'), 'w').close()
+        logging.info(f"🐘 Базовая копия и {len(plan['artefacts']) - 1} сегментов WAL размещены в {destination}")
+        return destination
+
+    @staticmethod
+    def _extract_tar(archive, destination):
+        """Извлечение архива только внутрь destination: без абсолютных путей, '..' и ссылок наружу"""
+        if hasattr(tarfile, 'data_filter'):
+            archive.extractall(destination, filter='data')
+            return
+        
+        # Python без фильтров извлечения (до 3.8.17 / 3.9.17 / 3.10.12 / 3.11.4)
+        root = os.path.realpath(destination)
+        
+        def inside(path):
+            return os.path.commonpath([root, os.path.realpath(path)]) == root
+        
+        for member in archive:
+            path = os.path.join(root, member.name)
+            if os.path.isabs(member.name) or not inside(path):
+                raise RuntimeError(f"Недопустимый путь в архиве: {member.name}")
+            if member.issym() and (os.path.isabs(member.linkname)
+                                   or not inside(os.path.join(os.path.dirname(path), member.linkname))):
+                raise RuntimeError(f"Ссылка за пределы каталога в архиве: {member.name} -> {member.linkname}")
+            if member.islnk() and (os.path.isabs(member.linkname) or not inside(os.path.join(root, member.linkname))):
+                raise RuntimeError(f"Ссылка за пределы каталога в архиве: {member.name} -> {member.linkname}")
+            if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+                continue
+            member.mode &= 0o755 if member.isdir() else 0o644
+            archive.extract(member, root, set_attrs=not member.issym())
+
+    def _place_file(self, plan, paths, destination):
+        """SQLite, RDB и JSON экспорты: распаковка файла в место назначения"""
+        root = plan['root']
+        if not destination:
+            if plan['target'].startswith('sqlite:'):
+                destination = plan['target'].split(':', 1)[1] + '.restored'
+            else:
+                name = root['name']
+                if root.get('codec') not in (None, 'none'):
+                    name = os.path.splitext(name)[0]
+                destination = os.path.join(self.work_dir, name)
+        self._decompress_to(paths[root['name']], root, destination + '.tmp')
+        os.replace(destination + '.tmp', destination)
+        return destination
+
+    def restore(self, query, until=None, destination=None):
+        """Восстановление цели на момент until (по умолчанию - последняя копия)"""
+        started = time.monotonic()
+        target = self.resolve_target(query)
+        plan = self.plan(target, until)
+        logging.info(f"♻️ Восстановление {target}: {plan['root']['name']} "
+                     f"(+{len(plan['artefacts']) - 1} звеньев цепочки)")
+
+        try:
+            paths = self.fetch(plan['artefacts'])
+            restore_started = time.monotonic()
+
+            mode = plan['mode']
+            if mode == 'pg_physical':
+                result = self._restore_pg_physical(plan, paths, destination, until)
+            elif mode == 'mongo_oplog':
+                result = self._restore_mongo_oplog(plan, paths)
+            elif mode == 'pg_table_diff':
+                result = self._restore_pg_table_diff(plan, paths, destination)
+            elif mode == 'postgresql':
+                result = self._restore_postgres(plan, paths, destination)
+            elif mode == 'mysql':
+                result = self._restore_mysql(plan, paths, destination, until)
+            elif mode == 'mongodb':
+                result = self._restore_mongodb(plan, paths, destination)
+            else:
+                result = self._place_file(plan, paths, destination)
+        finally:
+            # Загруженные и распакованные промежуточные файлы
+            for path in self.temp_files:
+                if os.path.isfile(path):
+                    os.remove(path)
+            self.temp_files = []
+
+        self.stats['restore_seconds'] = time.monotonic() - restore_started
+        total = time.monotonic() - started
+        restored_mb = self.stats['restored_bytes'] / (1024 * 1024)
+        report = dict(self.stats, target=target, destination=result, artefacts=len(plan['artefacts']),
+                      recovery_seconds=round(total, 1), backup=plan['root']['name'],
+                      restore_mbps=round(restored_mb / max(self.stats['restore_seconds'], 0.001), 1),
+                      timestamp=datetime.now().isoformat())
+
+        logging.info("=" * 80)
+        logging.info(f"✅ Восстановлено: {target} -> {result}")
+        logging.info(f"⏱️ Время восстановления (RTO): {total:.1f} с, загрузка {self.stats['download_seconds']:.1f} с")
+        logging.info(f"📈 Восстановлено {restored_mb:.1f} MB ({report['restore_mbps']} MB/s)")
+        logging.info("=" * 80)
+        return report
+
+
+class BackupVerifier:
+    """Проверка целостности созданных копий, параллельно с дампами следующих БД"""
+
+    MONGO_ARCHIVE_MAGIC = b'\x6d\xe2\x99\x81'
+    MYSQL_TRAILER = b'-- Dump completed'
+    BINLOG_MAGIC = b'\xfebin'
+
+    def __init__(self, workers=2, temp_dir=None):
+        self.executor = ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix='verify')
+        self.temp_dir = temp_dir
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.results = []
+
+    def submit(self, path, engine=None, kind='full'):
+        with self.lock:
+            if path not in self.futures:
+                self.futures[path] = self.executor.submit(self.verify, path, engine, kind)
+            return self.futures[path]
+
+    def result(self, path):
+        """Результат проверки файла (None - файл не ставился на проверку)"""
+        with self.lock:
+            future = self.futures.get(path)
+        return future.result() if future else None
+
+    def close(self):
+        """Дожидается всех проверок; возвращает сводку для статистики запуска"""
+        self.executor.shutdown(wait=True)
+        failed = [r for r in self.results if r['ok'] is False]
+        return {
+            'checked': sum(1 for r in self.results if r['ok'] is not None),
+            'passed': sum(1 for r in self.results if r['ok']),
+            'failed': failed,
+            'unchecked': sum(1 for r in self.results if r['ok'] is None),
+            'results': self.results
+        }
+
+    def verify(self, path, engine=None, kind='full'):
+        name = os.path.basename(path)
+        codec, fmt = BackupCatalog.describe(name, engine)
+        check = kind if kind in ('binlog', 'wal', 'history') else fmt
+        started = time.monotonic()
+
+        if os.path.isdir(path):
+            ok, detail, check = None, 'каталог не проверяется', None
+        else:
+            method = getattr(self, f"_check_{check}", None)
+            try:
+                # Собственное сжатие mongodump затрагивает только коллекции внутри архива
+                with CompressionStage.open_reader(path, 'none' if codec == 'mongodump-gzip' else codec) as reader:
+                    if method:
+                        ok, detail = method(reader)
+                    else:
+                        total = self._drain(reader)[2]
+                        ok, detail, check = (None if codec == 'none' else True), f"{total} байт", 'stream'
+            except Exception as e:
+                ok, detail = False, f"{type(e).__name__}: {e}"
+
+        return self._record(name, check, ok, detail, started)
+
+    def verify_edges(self, name, engine, kind, head, tail, total):
+        """Проверка копии, переданной на Drive без локального файла, по началу и концу потока"""
+        started = time.monotonic()
+        codec, fmt = BackupCatalog.describe(name, engine)
+        check = 'binlog' if kind == 'binlog' else fmt
+        method = getattr(self, f"_edges_{check}", None)
+        if method:
+            ok, detail = method(head, tail, total)
+        else:
+            ok, detail = None, 'формат проверяется только по локальному файлу'
+        return self._record(name, f"{check}/edges" if method else check, ok, detail, started)
+
+    def _record(self, name, check, ok, detail, started):
+        result = {'file': name, 'check': check, 'ok': ok, 'detail': detail,
+                  'seconds': round(time.monotonic() - started, 2)}
+        with self.lock:
+            self.results.append(result)
+
+        if ok is False:
+            logging.error(f"❌ Проверка {name} ({check}) не пройдена: {detail}")
+        elif ok:
+            logging.info(f"🔎 {name}: проверка {check} пройдена ({detail})")
+        return result
+
+    @staticmethod
+    def _drain(reader, head_size=0, tail_size=0):
+        """Чтение потока до конца (распаковка проверяет и целостность сжатия)"""
+        head = bytearray()
+        tail = b''
+        total = 0
+        for chunk in iter(lambda: reader.read(1024 * 1024), b''):
+            if len(head) < head_size:
+                head.extend(chunk[:head_size - len(head)])
+            if tail_size:
+                tail = (tail + chunk)[-tail_size:]
+            total += len(chunk)
+        return bytes(head), tail, total
+
+    def _edges_custom(self, head, tail, total):
+        if head[:5] != b'PGDMP':
+            return False, f"нет заголовка PGDMP (начало: {head[:5]!r})"
+        return True, f"заголовок PGDMP, {total} байт"
+
+    def _check_custom(self, reader):
+        """Архив pg_dump --format=custom: заголовок и оглавление через pg_restore --list"""
+        head = reader.read(5)
+        if head != b'PGDMP':
+            return False, f"нет заголовка PGDMP (начало: {head!r})"
+        if not shutil.which('pg_restore'):
+            total = len(head) + self._drain(reader)[2]
+            return True, f"заголовок PGDMP, {total} байт (pg_restore не найден)"
+
+        with tempfile.TemporaryFile() as out_file, tempfile.TemporaryFile() as err_file:
+            process = subprocess.Popen(['pg_restore', '--list'], stdin=subprocess.PIPE, stdout=out_file,
+                                       stderr=err_file)
+            try:
+                process.stdin.write(head)
+                for chunk in iter(lambda: reader.read(1024 * 1024), b''):
+                    process.stdin.write(chunk)
+            except BrokenPipeError:
+                # pg_restore читает только оглавление; остаток дочитываем для проверки сжатия
+                self._drain(reader)
+            finally:
+                try:
+                    process.stdin.close()
+                except BrokenPipeError:
+                    pass
+                returncode = process.wait()
+            out_file.seek(0)
+            entries = sum(1 for line in out_file if line.strip() and not line.startswith(b';'))
+            err_file.seek(0)
+            stderr = err_file.read().decode('utf-8', errors='replace').strip()
+
+        if returncode != 0:
+            if 'unsupported version' in stderr:
+                # pg_restore хоста старше pg_dump в контейнере - доступна только проверка заголовка
+                return True, f"заголовок PGDMP ({stderr})"
+            return False, f"pg_restore --list: {stderr}"
+        return True, f"{entries} объектов в оглавлении"
+
+    def _check_sql(self, reader):
+        return self._edges_sql(*self._drain(reader, tail_size=4096))
+
+    def _edges_sql(self, head, tail, total):
+        """Дамп mysqldump: оборванный дамп не содержит завершающего комментария"""
+        if self.MYSQL_TRAILER not in tail:
+            return False, f"нет строки '{self.MYSQL_TRAILER.decode()}' в конце дампа ({total} байт)"
+        return True, f"{total} байт, дамп завершен"
+
+    def _check_sqlite(self, reader):
+        """Копия SQLite: PRAGMA integrity_check на распакованной копии"""
+        with tempfile.NamedTemporaryFile(suffix='.db', dir=self.temp_dir) as copy:
+            shutil.copyfileobj(reader, copy, 1024 * 1024)
+            copy.flush()
+            conn = sqlite3.connect(f"file:{copy.name}?mode=ro", uri=True)
+            try:
+                rows = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+            finally:
+                conn.close()
+        if rows != ['ok']:
+            return False, f"integrity_check: {'; '.join(rows[:5])}"
+        return True, 'integrity_check: ok'
+
+    def _check_rdb(self, reader):
+        return self._edges_rdb(*self._drain(reader, head_size=9, tail_size=9))
+
+    def _edges_rdb(self, head, tail, total):
+        """RDB Redis: сигнатура REDIS, версия формата и маркер конца файла"""
+        head, tail = head[:9], tail[-9:]
+        if head[:5] != b'REDIS' or not head[5:9].isdigit():
+            return False, f"нет сигнатуры REDIS (начало: {head!r})"
+        version = int(head[5:9])
+        if not 1 <= version <= 99:
+            return False, f"неизвестная версия RDB {version}"
+        # Начиная с версии 5 за маркером EOF (0xFF) идет CRC64
+        eof = tail[0:1] if version >= 5 else tail[-1:]
+        if eof != b'\xff':
+            return False, f"RDB версии {version} без маркера конца файла ({total} байт)"
+        return True, f"RDB версии {version}, {total} байт"
+
+    def _check_archive(self, reader):
+        return self._edges_archive(*self._drain(reader, head_size=4))
+
+    def _edges_archive(self, head, tail, total):
+        """Архив mongodump --archive: магическое число формата"""
+        if head[:4] != self.MONGO_ARCHIVE_MAGIC:
+            return False, f"нет сигнатуры архива mongodump (начало: {head[:4]!r})"
+        return True, f"{total} байт"
+
+    def _check_bson(self, reader):
+        """Фрагмент oplog: последовательность BSON документов без обрыва"""
+        count = 0
+        while True:
+            size_bytes = reader.read(4)
+            if not size_bytes:
+                return True, f"{count} записей oplog"
+            size = int.from_bytes(size_bytes, 'little') if len(size_bytes) == 4 else 0
+            if size < 5:
+                return False, f"поврежден заголовок документа {count + 1}"
+            body = reader.read(size - 4)
+            while len(body) < size - 4:
+                more = reader.read(size - 4 - len(body))
+                if not more:
+                    return False, f"документ {count + 1} оборван"
+                body += more
+            if body[-1:] != b'\x00':
+                return False, f"документ {count + 1} поврежден"
+            count += 1
+
+    def _check_tar(self, reader):
+        """Базовая копия pg_basebackup: заголовки всех элементов tar"""
+        members = 0
+        with tarfile.open(fileobj=reader, mode='r|') as archive:
+            # В потоковом режиме данные элементов прочитываются при переходе к следующему
+            for member in archive:
+                members += 1
+        if not members:
+            return False, 'пустой tar архив'
+        return True, f"{members} элементов tar"
+
+    def _check_json(self, reader):
+        """Экспорт Elasticsearch/CouchDB и манифест дифференциального режима"""
+        json.load(io.TextIOWrapper(reader, encoding='utf-8'))
+        return True, 'корректный JSON'
+
+    def _check_binlog(self, reader):
+        return self._edges_binlog(*self._drain(reader, head_size=4))
+
+    def _edges_binlog(self, head, tail, total):
+        if head[:4] != self.BINLOG_MAGIC:
+            return False, f"нет сигнатуры binlog (начало: {head[:4]!r})"
+        return True, f"{total} байт"
+
+    def _check_wal(self, reader):
+        """Сегмент WAL: размер сегмента - степень двойки от 1 МБ"""
+        total = self._drain(reader)[2]
+        if total < 1024 * 1024 or total & (total - 1):
+            return False, f"размер сегмента {total} байт"
+        return True, f"{total} байт"
+
+    def _check_history(self, reader):
+        """История таймлайна: строки "таймлайн<TAB>LSN<TAB>причина" и комментарии"""
+        lines = [line.strip() for line in reader.read().decode('utf-8', errors='replace').splitlines()]
+        entries = [line for line in lines if line and not line.startswith('#')]
+        for line in entries:
+            if not re.match(r'^\d+\s+[0-9A-F]+/[0-9A-F]+', line):
+                return False, f"неверная строка истории: {line[:60]}"
+        return True, f"переключений таймлайна: {len(entries)}"
+
+
+class RunManifest:
+    """Манифест запуска: размер и контрольные суммы каждого артефакта, подписанные HMAC-SHA256"""
+
+    FIELDS = ('name', 'target', 'engine', 'kind', 'codec', 'size', 'md5', 'sha256', 'xxh64', 'finished_at')
+
+    @staticmethod
+    def _canonical(body):
+        return json.dumps(body, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    @classmethod
+    def build(cls, run_id, artefacts, key=None):
+        body = {
+            'version': 1,
+            'run_id': run_id,
+            'host': socket.gethostname(),
+            'created_at': datetime.now().isoformat(),
+            'artefacts': [{field: artefact.get(field) for field in cls.FIELDS} for artefact in artefacts]
+        }
+        manifest = dict(body)
+        manifest['signature'] = {
+            'algorithm': 'HMAC-SHA256',
+            'value': hmac.new(key.encode('utf-8'), cls._canonical(body), hashlib.sha256).hexdigest()
+        } if key else None
+        return manifest
+
+    @classmethod
+    def signature_valid(cls, manifest, key):
+        signature = manifest.get('signature')
+        if not signature or not key:
+            return False
+        body = {k: v for k, v in manifest.items() if k != 'signature'}
+        expected = hmac.new(key.encode('utf-8'), cls._canonical(body), hashlib.sha256).hexdigest()
+        return hmac.compare_digest(expected, signature.get('value', ''))
+
+    @staticmethod
+    def check_files(manifest, backup_dir):
+        """Сверка локальных копий с манифестом: name -> ok / mismatch / missing"""
+        results = {}
+        for entry in manifest['artefacts']:
+            path = os.path.join(backup_dir, entry['name'])
+            if not os.path.isfile(path):
+                results[entry['name']] = 'missing'
+                continue
+            digests = HashingTee.of_file(path)
+            expected = {name: entry.get(name) for name in HashingTee.ALGORITHMS if entry.get(name)}
+            matches = os.path.getsize(path) == entry.get('size', os.path.getsize(path)) and all(
+                digests.get(name) == value for name, value in expected.items() if name in digests)
+            results[entry['name']] = 'ok' if matches else 'mismatch'
+        return results
+
+
 class UniversalBackup:
     def __init__(self):
         # Настройки Google Drive
@@ -542,10 +4832,182 @@ class UniversalBackup:
         self.BACKUP_DIR = os.getenv('BACKUP_DIR', './backups')
         os.makedirs(self.BACKUP_DIR, exist_ok=True)
         
+        # Потоковое сжатие дампов (zstd, gzip, lz4, none или auto)
+        level = os.getenv('BACKUP_COMPRESSION_LEVEL')
+        codec = os.getenv('BACKUP_COMPRESSION', 'zstd')
+        threads = int(os.getenv('BACKUP_COMPRESSION_THREADS', '-1'))
+        tuner = None
+        if codec.lower() == 'auto':
+            tuner = CompressionTuner(
+                os.path.join(self.BACKUP_DIR, 'compression_history.json'),
+                sample_bytes=int(os.getenv('BACKUP_COMPRESSION_SAMPLE_MB', '8')) * 1024 * 1024,
+                max_age_days=int(os.getenv('BACKUP_COMPRESSION_BENCHMARK_DAYS', '7')),
+                default_upload_mbps=float(os.getenv('BACKUP_UPLOAD_MBPS', '10')),
+                threads=threads
+            )
+        self.compression = CompressionStage(
+            codec=codec,
+            level=int(level) if level else None,
+            threads=threads,
+            tuner=tuner
+        )
+        
+        # Хранилища копий: drive - Google Drive, local - каталог BACKUP_STORAGE_LOCAL_DIR,
+        # s3 - S3-совместимое хранилище; копии загружаются во все перечисленные
+        self.storage_names = [n.strip() for n in os.getenv('BACKUP_STORAGE', 'drive').split(',') if n.strip()]
+        
         # Инициализация сервисов
-        self.drive_service = self._init_drive_service()
+        self.drive_credentials = None
+        self.drive_service = self._init_drive_service() if 'drive' in self.storage_names else None
         self.docker_client = self._init_docker_client()
         
+        # Пропуск неизменившихся БД по отпечатку изменений
+        self.skip_unchanged = os.getenv('BACKUP_SKIP_UNCHANGED', 'false').lower() in ('1', 'true', 'yes')
+        self.unchanged_max_age = float(os.getenv('BACKUP_UNCHANGED_MAX_AGE_HOURS', '24')) * 60 * 60
+        self.inventory = BackupInventory(os.path.join(self.BACKUP_DIR, 'backup_inventory.json'))
+        self.skipped_unchanged = []
+        
+        # Лимиты времени дампов: зависший дамп завершается, запуск продолжается
+        self.deadlines = DumpDeadlines(
+            os.path.join(self.BACKUP_DIR, 'dump_durations.json'),
+            default_timeout=int(float(os.getenv('BACKUP_DUMP_TIMEOUT_MINUTES', '60')) * 60),
+            engine_timeouts=DumpDeadlines.parse_engine_timeouts(os.getenv('BACKUP_DUMP_TIMEOUTS', '')),
+            min_rate=float(os.getenv('BACKUP_DUMP_MIN_RATE_MBPS', '5')) * 1024 * 1024,
+            factor=float(os.getenv('BACKUP_DUMP_TIMEOUT_FACTOR', '3')),
+            max_timeout=float(os.getenv('BACKUP_DUMP_TIMEOUT_MAX_HOURS', '12')) * 3600,
+            grace=int(os.getenv('BACKUP_DUMP_KILL_GRACE_SECONDS', '30'))
+        )
+        
+        # Инкрементальный режим PostgreSQL (pg_basebackup + pg_receivewal) для выбранных кластеров
+        self.wal_archive_targets = [t.strip() for t in os.getenv('PG_WAL_ARCHIVE', '').split(',') if t.strip()]
+        self.wal_archiver = PostgresWalArchiver(
+            self.BACKUP_DIR, self.compression,
+            base_interval_hours=float(os.getenv('PG_BASEBACKUP_INTERVAL_HOURS', '24')),
+            keep_base_backups=int(os.getenv('PG_BASEBACKUP_KEEP', '2')),
+            receivewal_compress=os.getenv('PG_RECEIVEWAL_COMPRESS') or None,
+            slot_lag_warn_bytes=int(float(os.getenv('PG_WAL_SLOT_LAG_WARN_MB', '1024')) * 1024 * 1024),
+            deadlines=self.deadlines
+        ) if self.wal_archive_targets or os.path.isdir(os.path.join(self.BACKUP_DIR, 'wal_archive')) else None
+        self.daemon_mode = False
+        
+        # Инкрементальный режим MySQL (позиция binlog в дампе + mysqlbinlog --stop-never)
+        self.binlog_targets = [t.strip() for t in os.getenv('MYSQL_BINLOG_STREAM', '').split(',') if t.strip()]
+        self.binlog_streamer = MysqlBinlogStreamer(
+            self.BACKUP_DIR, self.compression,
+            full_interval_hours=float(os.getenv('MYSQL_FULL_DUMP_INTERVAL_HOURS', '24')),
+            keep_full_dumps=int(os.getenv('MYSQL_FULL_DUMP_KEEP', '2'))
+        ) if self.binlog_targets else None
+        
+        # Дифференциальный режим PostgreSQL: дамп только измененных таблиц по pg_stat_user_tables
+        self.table_diff_targets = [t.strip() for t in os.getenv('PG_TABLE_DIFF', '').split(',') if t.strip()]
+        self.table_diff = PostgresTableDiff(
+            self.BACKUP_DIR,
+            jobs=int(os.getenv('PG_TABLE_DIFF_JOBS', '4')),
+            rebase_days=float(os.getenv('PG_TABLE_DIFF_REBASE_DAYS', '7'))
+        ) if self.table_diff_targets else None
+        
+        # Инкрементальный режим MongoDB (полный архив с --oplog + фрагменты oplog) для replica set
+        self.oplog_targets = [t.strip() for t in os.getenv('MONGO_OPLOG_TAIL', '').split(',') if t.strip()]
+        self.oplog_tailer = MongoOplogTailer(
+            self.BACKUP_DIR,
+            full_interval_hours=float(os.getenv('MONGO_FULL_ARCHIVE_INTERVAL_HOURS', '24')),
+            keep_full_archives=int(os.getenv('MONGO_FULL_ARCHIVE_KEEP', '2'))
+        ) if self.oplog_targets else None
+        
+        # Конвейер загрузки: дампы и загрузки на Drive выполняются одновременно
+        self.upload_workers = int(os.getenv('BACKUP_UPLOAD_WORKERS', '3'))
+        self.upload_queue_size = int(os.getenv('BACKUP_UPLOAD_QUEUE_SIZE', '8'))
+        self.max_pending_bytes = int(float(os.getenv('BACKUP_MAX_PENDING_GB', '0')) * 1024 ** 3)
+        self.min_free_bytes = int(float(os.getenv('BACKUP_MIN_FREE_GB', '0')) * 1024 ** 3)
+        self.pipeline = None
+        self.submitted_files = set()
+        
+        # Размер фрагмента resumable-загрузки (кратен 256 КБ) и общий лимит скорости
+        chunk_mb = float(os.getenv('BACKUP_UPLOAD_CHUNK_MB', '32'))
+        self.upload_chunk_size = max(1, round(chunk_mb * 4)) * 256 * 1024
+        self.upload_limiter = BandwidthLimiter(float(os.getenv('BACKUP_UPLOAD_LIMIT_MBPS', '0')) * 1024 * 1024)
+        self.drive_local = threading.local()
+        self.upload_journal = UploadJournal(os.path.join(self.BACKUP_DIR, 'upload_journal.json'))
+        
+        # Пропуск загрузки копий, побайтно совпадающих с предыдущей загрузкой цели
+        self.upload_dedup = os.getenv('BACKUP_UPLOAD_DEDUP', 'true').lower() in ('1', 'true', 'yes')
+        self.deduplicated_uploads = []
+        
+        # Проверка целостности копий перед загрузкой (pg_restore --list, трейлер mysqldump, integrity_check...)
+        self.verify_backups = os.getenv('BACKUP_VERIFY', 'true').lower() in ('1', 'true', 'yes')
+        self.verify_workers = int(os.getenv('BACKUP_VERIFY_WORKERS', '2'))
+        self.verifier = None
+        
+        # Манифест запуска с контрольными суммами артефактов, подписанный ключом HMAC
+        self.manifest_key = os.getenv('BACKUP_MANIFEST_KEY', '')
+        
+        # Ротация копий: gfs - уровни по целям из индекса, days - удаление локальных файлов старше N дней
+        self.retention_policy = os.getenv('BACKUP_RETENTION_POLICY', 'gfs').lower()
+        self.retention_days = int(os.getenv('BACKUP_RETENTION_DAYS', '7'))
+        self.catalog = BackupCatalog(os.path.join(self.BACKUP_DIR, 'backup_catalog.db'))
+        self.run_id = None
+        self.gfs = GfsRetention(
+            hourly=int(os.getenv('BACKUP_KEEP_HOURLY', '24')),
+            daily=int(os.getenv('BACKUP_KEEP_DAILY', '7')),
+            weekly=int(os.getenv('BACKUP_KEEP_WEEKLY', '4')),
+            monthly=int(os.getenv('BACKUP_KEEP_MONTHLY', '6'))
+        )
+        self.retention_deleted = 0
+        
+        # Срок хранения копий на Google Drive (0 - удаленные копии не удаляются)
+        self.remote_retention_days = float(os.getenv('BACKUP_REMOTE_RETENTION_DAYS', '0'))
+        self.remote_deleted = 0
+        
+        # Периодическая проверка копий на Google Drive по размеру и MD5 (0 - не проверять)
+        self.scrub_interval_hours = float(os.getenv('BACKUP_SCRUB_INTERVAL_HOURS', '24'))
+        self.scrub_files_per_run = int(os.getenv('BACKUP_SCRUB_FILES_PER_RUN', '1000'))
+        self.scrub_files_per_minute = float(os.getenv('BACKUP_SCRUB_FILES_PER_MINUTE', '600'))
+        
+        self.drive_backend = DriveStorageBackend(self)
+        self.storage_backends = self._init_storage_backends()
+        
+        # Регулятор нагрузки: откладывание дампов и приоритет процессов по нагрузке хоста и БД
+        self.governor = LoadGovernor(
+            enabled=os.getenv('BACKUP_THROTTLE', 'false').lower() in ('1', 'true', 'yes'),
+            io_pressure=float(os.getenv('BACKUP_THROTTLE_IO_PRESSURE', '30')),
+            cpu_pressure=float(os.getenv('BACKUP_THROTTLE_CPU_PRESSURE', '60')),
+            load_per_cpu=float(os.getenv('BACKUP_THROTTLE_LOAD_PER_CPU', '2')),
+            db_active=int(os.getenv('BACKUP_THROTTLE_DB_ACTIVE', '30')),
+            max_wait=float(os.getenv('BACKUP_THROTTLE_MAX_WAIT_MINUTES', '30')) * 60,
+            max_run_wait=float(os.getenv('BACKUP_THROTTLE_MAX_RUN_WAIT_MINUTES', '60')) * 60,
+            poll_interval=int(os.getenv('BACKUP_THROTTLE_POLL_SECONDS', '30')),
+            nice=int(os.getenv('BACKUP_DUMP_NICE', '0')),
+            ionice=os.getenv('BACKUP_DUMP_IONICE') or None
+        )
+        
+        # Локальный кэш загруженных копий для быстрого восстановления
+        self.local_cache = LocalCache(
+            self.catalog,
+            budget_bytes=int(float(os.getenv('BACKUP_CACHE_MB', '0')) * 1024 * 1024),
+            keep_per_target=int(os.getenv('BACKUP_CACHE_KEEP', '2'))
+        )
+        
+        # Потоковая загрузка дампов на Drive без промежуточного файла в BACKUP_DIR
+        self.stream_uploads = os.getenv('BACKUP_STREAM_UPLOAD', 'false').lower() in ('1', 'true', 'yes')
+        self.stream_chunk_size = int(float(os.getenv('BACKUP_STREAM_CHUNK_MB', '8')) * 1024 * 1024)
+        self.stream_memory_chunks = int(os.getenv('BACKUP_STREAM_MEMORY_CHUNKS', '2'))
+        self.stream_spill_bytes = int(float(os.getenv('BACKUP_STREAM_SPILL_MB', '64')) * 1024 * 1024)
+        self.remote_streams = {}
+        self.streamed_uploads = 0
+        self.stream_failures = []
+        
+        # Дедуплицирующий репозиторий вместо отдельных файлов: фрагменты по содержимому в pack-файлах
+        self.repository = ChunkRepository(
+            os.path.join(self.BACKUP_DIR, 'repository'), self.compression,
+            avg_chunk_size=int(os.getenv('BACKUP_REPOSITORY_CHUNK_KB', '1024')) * 1024,
+            pack_size=int(os.getenv('BACKUP_REPOSITORY_PACK_MB', '64')) * 1024 * 1024,
+            on_pack_sealed=lambda path: self._file_ready(path, 'repository', kind='pack', chain=True)
+        ) if os.getenv('BACKUP_REPOSITORY', 'false').lower() in ('1', 'true', 'yes') else None
+        
+        # Сжатие внутри Docker контейнеров перед передачей через сокет
+        self.container_compression = os.getenv('DOCKER_CONTAINER_COMPRESSION', 'false').lower() in ('1', 'true', 'yes')
+        self.container_compressors = {}
+        
         # Обнаруженные базы данных
         self.discovered_databases = []
         
@@ -594,6 +5056,7 @@ class UniversalBackup:
                     self.CREDENTIALS_FILE,
                     scopes=['https://www.googleapis.com/auth/drive']
                 )
+                self.drive_credentials = credentials
                 return build('drive', 'v3', credentials=credentials)
             else:
                 logging.warning(f"Файл {self.CREDENTIALS_FILE} не найден")
@@ -602,6 +5065,44 @@ class UniversalBackup:
             logging.error(f"Ошибка инициализации Google Drive API: {e}")
             return None
 
+    def _init_storage_backends(self):
+        """Дополнительные хранилища из BACKUP_STORAGE (кроме Google Drive)
+
+        Хранилища LocalStorageBackend, DriveStorageBackend и S3StorageBackend взаимозаменяемы:
+        name - имя хранилища в каталоге копий; put(source, name, size, md5) - потоковая запись
+        из файлового объекта, возвращает {'id', 'size', 'md5'}; head(remote_id) - {'id', 'name',
+        'size', 'md5'} или None, если копии нет; list(prefix) - список таких же словарей;
+        delete(remote_id) - удаление копии (отсутствующая копия не ошибка); get(remote_id,
+        destination) - чтение копии в файловый объект. Ошибки хранилища выбрасываются исключениями.
+        """
+        backends = []
+        for name in self.storage_names:
+            try:
+                if name == 'local':
+                    root = os.getenv('BACKUP_STORAGE_LOCAL_DIR')
+                    if not root:
+                        logging.warning("⚠️ BACKUP_STORAGE_LOCAL_DIR не задан, хранилище local отключено")
+                        continue
+                    backends.append(LocalStorageBackend(root))
+                elif name == 's3':
+                    if not os.getenv('S3_BUCKET'):
+                        logging.warning("⚠️ S3_BUCKET не задан, хранилище s3 отключено")
+                        continue
+                    backends.append(S3StorageBackend(
+                        os.getenv('S3_ENDPOINT', 'https://s3.amazonaws.com'), os.getenv('S3_BUCKET'),
+                        os.getenv('S3_ACCESS_KEY', ''), os.getenv('S3_SECRET_KEY', ''),
+                        region=os.getenv('S3_REGION', 'us-east-1'),
+                        prefix=os.getenv('S3_PREFIX', ''),
+                        part_size=int(os.getenv('S3_PART_SIZE_MB', '16')) * 1024 * 1024,
+                        workers=int(os.getenv('S3_UPLOAD_WORKERS', '4')),
+                        limiter=self.upload_limiter
+                    ))
+                elif name != 'drive':
+                    logging.warning(f"⚠️ Неизвестное хранилище в BACKUP_STORAGE: {name}")
+            except Exception as e:
+                logging.error(f"Ошибка инициализации хранилища {name}: {e}")
+        return backends
+
     def _init_docker_client(self):
         """Инициализация Docker клиента"""
         try:
@@ -2010,103 +6511,1007 @@ class UniversalBackup:
         system_dbs = self.discover_system_databases()
         self.discovered_databases.extend(system_dbs)
         
-        # 3. Docker контейнеры
-        logging.info("🐳 Этап 3: Сканирование Docker контейнеров")
-        docker_dbs = self.discover_docker_databases()
-        self.discovered_databases.extend(docker_dbs)
+        # 3. Docker контейнеры
+        logging.info("🐳 Этап 3: Сканирование Docker контейнеров")
+        docker_dbs = self.discover_docker_databases()
+        self.discovered_databases.extend(docker_dbs)
+        
+        # 4. Удаление дубликатов
+        self._remove_duplicate_databases()
+        
+        logging.info("=" * 60)
+        logging.info(f"Обнаружение завершено: {len(self.discovered_databases)} уникальных БД")
+        logging.info("=" * 60)
+        
+        # Сохранение подробного отчета
+        self._save_discovery_report()
+        self._print_discovery_summary()
+        
+        return self.discovered_databases
+
+    def _remove_duplicate_databases(self):
+        """Удаление дубликатов БД"""
+        unique_dbs = []
+        seen = set()
+        
+        for db in self.discovered_databases:
+            # Создаем ключ для идентификации уникальной БД
+            key = f"{db['type']}:{db.get('host', 'localhost')}:{db.get('port', 'unknown')}"
+            
+            if key not in seen:
+                seen.add(key)
+                unique_dbs.append(db)
+            else:
+                # Объединяем информацию из разных источников
+                existing_db = next(d for d in unique_dbs if 
+                                 f"{d['type']}:{d.get('host', 'localhost')}:{d.get('port', 'unknown')}" == key)
+                
+                # Объединяем списки баз данных
+                existing_databases = set(existing_db.get('databases', []))
+                new_databases = set(db.get('databases', []))
+                existing_db['databases'] = list(existing_databases.union(new_databases))
+                
+                # Обновляем источники
+                sources = existing_db.get('sources', [existing_db.get('source', 'unknown')])
+                if db.get('source') not in sources:
+                    sources.append(db.get('source'))
+                existing_db['sources'] = sources
+        
+        self.discovered_databases = unique_dbs
+        logging.info(f"После удаления дубликатов: {len(unique_dbs)} уникальных БД")
+
+    def _print_discovery_summary(self):
+        """Вывод краткого отчета об обнаружении"""
+        logging.info("\n📊 КРАТКИЙ ОТЧЕТ ОБ ОБНАРУЖЕНИИ:")
+        
+        by_type = {}
+        by_source = {}
+        total_databases = 0
+        
+        for db in self.discovered_databases:
+            db_type = db['type']
+            sources = db.get('sources', [db.get('source', 'unknown')])
+            databases_count = len(db.get('databases', []))
+            
+            by_type[db_type] = by_type.get(db_type, 0) + 1
+            total_databases += databases_count
+            
+            for source in sources:
+                by_source[source] = by_source.get(source, 0) + 1
+        
+        logging.info(f"📈 Всего СУБД: {len(self.discovered_databases)}")
+        logging.info(f"📊 Всего баз данных: {total_databases}")
+        
+        logging.info("\n🔧 По типам СУБД:")
+        for db_type, count in sorted(by_type.items()):
+            logging.info(f"  {db_type}: {count}")
+        
+        logging.info("\n🔍 По источникам обнаружения:")
+        for source, count in sorted(by_source.items()):
+            logging.info(f"  {source}: {count}")
+        
+        logging.info("\n💾 Подробный отчет сохранен в discovery_report_*.json")
+
+    def _save_discovery_report(self):
+        """Сохранение отчета об обнаруженных БД"""
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        report_file = os.path.join(self.BACKUP_DIR, f'discovery_report_{timestamp}.json')
+        
+        try:
+            with open(report_file, 'w', encoding='utf-8') as f:
+                json.dump(self.discovered_databases, f, indent=2, ensure_ascii=False, default=str)
+            logging.info(f"Отчет об обнаружении сохранен: {report_file}")
+        except Exception as e:
+            logging.error(f"Ошибка сохранения отчета: {e}")
+
+    def _target_key(self, db_info, database):
+        """Уникальный ключ цели резервного копирования (СУБД, расположение, база)"""
+        if db_info.get('source') == 'docker':
+            return f"docker:{db_info.get('container_name')}:{db_info['type']}:{database}"
+        if db_info['type'] == 'sqlite':
+            return f"sqlite:{db_info.get('file_path')}"
+        return f"{db_info['type']}:{db_info.get('host', 'localhost')}:{db_info.get('port', 'unknown')}:{database}"
+
+    def _get_change_fingerprint(self, db_info, database, container=None):
+        """Дешевый отпечаток изменений БД (None - определить не удалось)"""
+        if not self.skip_unchanged:
+            return None
+
+        db_type = db_info['type']
+
+        try:
+            if db_type == 'sqlite':
+                # Время изменения и размер файла БД и WAL
+                parts = []
+                for path in (db_info['file_path'], db_info['file_path'] + '-wal'):
+                    if os.path.exists(path):
+                        stat = os.stat(path)
+                        parts.append(f"{stat.st_mtime_ns}:{stat.st_size}")
+                return '|'.join(parts) or None
+
+            if db_type == 'couchdb':
+                import requests
+                url = f"http://{db_info.get('host', 'localhost')}:{db_info.get('port', 5984)}/{database}"
+                response = requests.get(url, timeout=5)
+                if response.status_code == 200:
+                    return str(response.json().get('update_seq'))
+                return None
+
+            if db_type == 'postgresql':
+                # Счетчики измененных строк (включая системные каталоги) и время сброса статистики
+                query = ("SELECT tup_inserted, tup_updated, tup_deleted, stats_reset "
+                         "FROM pg_stat_database WHERE datname = current_database()")
+                output = self._run_fingerprint_query(db_info, database, container, query)
+                return output.strip() if output and output.strip() else None
+
+            if db_type == 'mysql':
+                query = ("SELECT COUNT(*), COALESCE(MAX(UPDATE_TIME), ''), COALESCE(SUM(TABLE_ROWS), 0), "
+                         "COALESCE(SUM(DATA_LENGTH + INDEX_LENGTH), 0) FROM information_schema.TABLES "
+                         f"WHERE TABLE_SCHEMA = {self._sql_literal(database)}")
+                stats = self._run_fingerprint_query(db_info, database, container, query)
+                if not stats or not stats.strip():
+                    return None
+
+                # Позиция binlog (на весь сервер) - надежный признак любых изменений
+                binlog = self._run_fingerprint_query(db_info, database, container, 'SHOW MASTER STATUS')
+                binlog = ' '.join(binlog.split()[:2]) if binlog and binlog.strip() else ''
+
+                # Без binlog и UPDATE_TIME (например, InnoDB в MariaDB) изменения не отследить
+                update_time = stats.split('\t')[1] if '\t' in stats else ''
+                if not binlog and update_time in ('', 'NULL'):
+                    return None
+                return f"{stats.strip()}|{binlog}"
+
+            if db_type == 'mongodb':
+                # Время последней записи oplog (только для replica set)
+                query = ('var o = db.getSiblingDB("local").oplog.rs.find().sort({$natural: -1}).limit(1).next(); '
+                         'print(o.ts.t + ":" + o.ts.i)')
+                output = self._run_fingerprint_query(db_info, database, container, query)
+                if output and ':' in output.strip().split('\n')[-1]:
+                    return output.strip().split('\n')[-1]
+                return None
+
+            if db_type == 'redis':
+                output = self._run_fingerprint_query(db_info, database, container, 'persistence')
+                if not output:
+                    return None
+                info = dict(line.split(':', 1) for line in output.splitlines() if ':' in line)
+                if 'rdb_last_save_time' not in info:
+                    return None
+                return f"{info['rdb_last_save_time'].strip()}:{info.get('rdb_changes_since_last_save', '').strip()}"
+
+        except Exception as e:
+            logging.debug(f"Не удалось получить отпечаток изменений {db_type} {database}: {e}")
+
+        return None
+
+    @staticmethod
+    def _sql_literal(value):
+        """Строковый литерал SQL для подстановки имени БД в запрос"""
+        return "'" + str(value).replace('\\', '\\\\').replace("'", "''") + "'"
+
+    def _run_fingerprint_query(self, db_info, database, container, query):
+        """Выполнение запроса отпечатка на хосте или в Docker контейнере"""
+        db_type = db_info['type']
+
+        if container is not None:
+            credentials = db_info.get('credentials', {})
+            env = {}
+            if db_type == 'postgresql':
+                env['PGPASSWORD'] = credentials.get('password', '')
+                cmd = ['psql', '-h', credentials.get('host', 'postgres'), '-U', credentials.get('user', 'postgres'),
+                       '-d', database, '-At', '-F', ' ', '--no-password', '-c', query]
+            elif db_type == 'mysql':
+                cmd = ['mysql', '-u', credentials.get('user', 'root'), '-N', '-B', '-e', query]
+                if credentials.get('password'):
+                    cmd.insert(-2, f"-p{credentials['password']}")
+            elif db_type == 'mongodb':
+                cmd = ['mongo', '--quiet', '--eval', query]
+                if credentials.get('password'):
+                    cmd[1:1] = ['--username', credentials.get('user', 'admin'), '--password', credentials['password'],
+                                '--authenticationDatabase', 'admin']
+            elif db_type == 'redis':
+                cmd = ['redis-cli', 'INFO', query]
+                if credentials.get('password'):
+                    cmd[1:1] = ['-a', credentials['password']]
+            else:
+                return None
+
+            exit_code, output = self._docker_exec_output(container, cmd, env, timeout=10)
+            if exit_code != 0:
+                return None
+            return output.decode('utf-8', errors='replace')
+
+        host = db_info.get('host', 'localhost')
+        port = str(db_info.get('port', ''))
+        auto_creds = self.auto_credentials.get(db_type, {})
+        env = os.environ.copy()
+
+        if db_type == 'postgresql':
+            env['PGPASSWORD'] = auto_creds.get('password', '')
+            cmd = ['psql', '-h', host, '-p', port, '-U', auto_creds.get('user', 'postgres'),
+                   '-d', database, '-At', '-F', ' ', '--no-password', '-c', query]
+        elif db_type == 'mysql':
+            cmd = ['mysql', '-h', host, '-P', port, '-u', auto_creds.get('user', 'root'), '-N', '-B', '-e', query]
+            if auto_creds.get('password'):
+                cmd.insert(-2, f"-p{auto_creds['password']}")
+        elif db_type == 'mongodb':
+            cmd = ['mongo', '--host', f"{host}:{port}", '--quiet', '--eval', query]
+            if auto_creds.get('password'):
+                cmd[3:3] = ['--username', auto_creds.get('user', 'admin'), '--password', auto_creds['password']]
+        elif db_type == 'redis':
+            cmd = ['redis-cli', '-h', host, '-p', port, 'INFO', query]
+            if auto_creds.get('password'):
+                cmd[5:5] = ['-a', auto_creds['password']]
+        else:
+            return None
+
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=10, env=env)
+        if result.returncode != 0:
+            return None
+        return result.stdout
+
+    def _db_activity(self, db_info, database, container=None):
+        """Нагрузка БД для регулятора: активные запросы PostgreSQL или Threads_running MySQL"""
+        if db_info['type'] == 'postgresql':
+            query = ("SELECT count(*) FROM pg_stat_activity WHERE state = 'active' "
+                     "AND pid <> pg_backend_pid() AND application_name <> 'pg_dump'")
+        elif db_info['type'] == 'mysql':
+            query = "SHOW GLOBAL STATUS LIKE 'Threads_running'"
+        else:
+            return None
+        
+        output = self._run_fingerprint_query(db_info, database, container, query)
+        if not output or not output.split():
+            return None
+        active = int(output.split()[-1])
+        # Threads_running учитывает и поток самого запроса
+        return max(active - 1, 0) if db_info['type'] == 'mysql' else active
+
+    def _db_size(self, db_info, database, container=None):
+        """Размер БД в байтах для расчета лимита времени дампа (None - неизвестен)"""
+        if db_info['type'] == 'postgresql':
+            query = "SELECT pg_database_size(current_database())"
+        elif db_info['type'] == 'mysql':
+            query = ("SELECT COALESCE(SUM(DATA_LENGTH + INDEX_LENGTH), 0) FROM information_schema.TABLES "
+                     f"WHERE TABLE_SCHEMA = {self._sql_literal(database)}")
+        else:
+            return None
+        try:
+            output = self._run_fingerprint_query(db_info, database, container, query)
+            return int(output.split()[-1]) if output and output.split() else None
+        except Exception as e:
+            logging.debug(f"Не удалось получить размер БД {database}: {e}")
+            return None
+
+    def _admit_dump(self, db_info, database, target, container=None):
+        """Допуск дампа регулятором нагрузки и начало отсчета лимита времени"""
+        self.governor.admit(target, lambda: self._db_activity(db_info, database, container))
+        self.deadlines.begin(target, db_info['type'], self._db_size(db_info, database, container))
+
+    def _skip_if_unchanged(self, target, fingerprint, database):
+        """Пропуск дампа, если БД не изменилась с последней резервной копии"""
+        if not self.inventory.is_unchanged(target, fingerprint, self.unchanged_max_age):
+            return False
+
+        last_backup = self.inventory.mark_current(target)
+        self.skipped_unchanged.append(target)
+        logging.info(f"⏭️ {database}: изменений нет, актуальна предыдущая копия {last_backup}")
+        return True
+
+    def _record_backup_fingerprint(self, db_info, database, target, fingerprint, backup_path, container=None):
+        """Сохранение отпечатка для созданной резервной копии"""
+        if not self.skip_unchanged:
+            return
+
+        if db_info['type'] == 'redis':
+            # BGSAVE сбрасывает счетчик изменений: берем отпечаток после дампа,
+            # но только если за время копирования не было новых записей
+            fingerprint = self._get_change_fingerprint(db_info, database, container)
+            if fingerprint and not fingerprint.endswith(':0'):
+                fingerprint = None
+
+        self.inventory.record_backup(target, fingerprint, backup_path)
+
+    def _open_backup_writer(self, backup_path, db_type, target=None):
+        """Приемник дампа: снимок в репозитории или отдельный сжатый файл"""
+        if self.repository:
+            return self.repository.open_writer(backup_path, db_type, target)
+        # Поток уходит только на Drive, поэтому при дополнительных хранилищах дамп пишется в файл
+        if self.stream_uploads and self.drive_credentials and not self.storage_backends:
+            codec, level = self.compression.select(db_type, target)
+            name = os.path.basename(self.compression.final_path(backup_path, codec))
+            try:
+                sink = DriveStreamUpload(
+                    AuthorizedSession(self.drive_credentials), name, self.DRIVE_FOLDER_ID,
+                    chunk_size=self.stream_chunk_size, memory_chunks=self.stream_memory_chunks,
+                    spill_bytes=self.stream_spill_bytes, spill_dir=self.BACKUP_DIR, limiter=self.upload_limiter
+                )
+            except Exception as e:
+                logging.warning(f"⚠️ Потоковая загрузка {name} недоступна ({e}), дамп сохраняется локально")
+                return self.compression.open(backup_path, db_type, codec=codec, level=level, target=target)
+            writer, final_path = self.compression.open_stream(sink, backup_path, db_type, codec, level, target)
+            writer.head, writer.tail = bytearray(), b''
+            self.remote_streams[final_path] = (sink, writer)
+            return writer, final_path
+        return self.compression.open(backup_path, db_type, target=target)
+
+    def _stream_command_to_file(self, cmd, backup_path, db_type, env=None, target=None, capture_head=0):
+        """Запуск команды дампа с потоковым сжатием stdout в файл резервной копии"""
+        writer, final_path = self._open_backup_writer(backup_path, db_type, target)
+        head = bytearray()
+
+        with tempfile.TemporaryFile() as stderr_file:
+            try:
+                # Своя группа процессов: по истечении лимита завершается вместе с дочерними
+                process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr_file, env=env,
+                                           start_new_session=True)
+                governor_stop = self.governor.watch(process.pid)
+                
+                def kill(sig):
+                    # Группа живет, пока жив любой ее процесс, даже если сам дамп уже завершился
+                    try:
+                        os.killpg(process.pid, sig)
+                    except ProcessLookupError:
+                        pass
+                
+                # До wait() PID не освобожден и не может достаться другому процессу
+                watchdog = self.deadlines.arm(db_type, kill, os.path.basename(final_path),
+                                              alive=lambda: process.returncode is None)
+                try:
+                    for chunk in iter(lambda: process.stdout.read(1024 * 1024), b''):
+                        if len(head) < capture_head:
+                            head.extend(chunk[:capture_head - len(head)])
+                        writer.write(chunk)
+                finally:
+                    governor_stop.set()
+                    process.stdout.close()
+                    returncode = process.wait()
+                    if watchdog:
+                        watchdog.cancel()
+            finally:
+                writer.close()
+
+            stderr_file.seek(0)
+            stderr = stderr_file.read().decode('utf-8', errors='replace')
+        
+        if watchdog and watchdog.reason:
+            returncode = returncode or -signal.SIGKILL
+            stderr = f"Дамп отменен: {watchdog.reason}\n{stderr}"
+
+        if returncode == 0 and writer.bytes_in:
+            logging.debug(f"Сжатие {writer.codec}: {writer.bytes_in} -> {writer.bytes_out} байт")
+
+        return subprocess.CompletedProcess(cmd, returncode, stdout=bytes(head), stderr=stderr), final_path
+
+    def _stream_docker_exec_to_file(self, container, cmd, backup_path, db_type, env=None, target=None,
+                                    raw_output=False, capture_head=0):
+        """Потоковое чтение вывода команды в контейнере с записью через этап сжатия"""
+        api = self.docker_client.api
+        exec_id = api.exec_create(container.id, cmd, environment=env or {}, stdout=True, stderr=True)['Id']
+
+        if raw_output:
+            # Вывод уже сжат внутри контейнера
+            writer, final_path = self.compression.open(backup_path, db_type, codec='none', level=0)
+        else:
+            writer, final_path = self._open_backup_writer(backup_path, db_type, target)
+        stderr_chunks = []
+        head = bytearray()
+        governor_stop = None
+        
+        def kill(sig):
+            # Процесс exec виден на хосте: сигнал получает все его дерево внутри контейнера
+            info = api.exec_inspect(exec_id)
+            if not info.get('Running') or not info.get('Pid'):
+                return
+            try:
+                root = psutil.Process(info['Pid'])
+                for process in root.children(recursive=True) + [root]:
+                    process.send_signal(sig)
+            except psutil.NoSuchProcess:
+                pass
+        
+        watchdog = self.deadlines.arm(db_type, kill, os.path.basename(final_path),
+                                      alive=lambda: api.exec_inspect(exec_id).get('Running'))
+
+        try:
+            for stdout_chunk, stderr_chunk in api.exec_start(exec_id, stream=True, demux=True):
+                if governor_stop is None:
+                    # Процесс exec виден на хосте: его PID известен после запуска
+                    governor_stop = self.governor.watch(api.exec_inspect(exec_id).get('Pid'))
+                if stdout_chunk:
+                    if len(head) < capture_head:
+                        head.extend(stdout_chunk[:capture_head - len(head)])
+                    writer.write(stdout_chunk)
+                if stderr_chunk:
+                    stderr_chunks.append(stderr_chunk)
+        finally:
+            if governor_stop:
+                governor_stop.set()
+            if watchdog:
+                watchdog.cancel()
+            writer.close()
+
+        exit_code = api.exec_inspect(exec_id).get('ExitCode')
+        stderr = b''.join(stderr_chunks).decode('utf-8', errors='replace')
+        if watchdog and watchdog.reason:
+            exit_code = exit_code or -signal.SIGKILL
+            stderr = f"Дамп отменен: {watchdog.reason}\n{stderr}"
+
+        return subprocess.CompletedProcess(cmd, exit_code, stdout=bytes(head), stderr=stderr), final_path
+
+    def _docker_exec_output(self, container, cmd, env=None, timeout=60):
+        """Короткая команда в контейнере: (код выхода, вывод); без ответа за timeout секунд - TimeoutExpired"""
+        from docker.utils.socket import frames_iter
+        api = self.docker_client.api
+        exec_id = api.exec_create(container.id, cmd, environment=env or {}, stdout=True, stderr=True)['Id']
+        sock = api.exec_start(exec_id, socket=True)
+        expired = threading.Event()
+        
+        def expire():
+            # frames_iter ждет данных без таймаута: закрытие сокета прерывает чтение
+            expired.set()
+            try:
+                getattr(sock, '_sock', sock).shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            # Процесс exec виден на хосте: зависшая команда не должна остаться в контейнере
+            info = api.exec_inspect(exec_id)
+            if info.get('Running') and info.get('Pid'):
+                try:
+                    psutil.Process(info['Pid']).kill()
+                except psutil.NoSuchProcess:
+                    pass
+        
+        timer = threading.Timer(timeout, expire)
+        timer.daemon = True
+        timer.start()
+        output = b''
+        try:
+            for _, data in frames_iter(sock, tty=False):
+                output += data
+        except OSError:
+            if not expired.is_set():
+                raise
+        finally:
+            timer.cancel()
+            sock.close()
+        if expired.is_set():
+            raise subprocess.TimeoutExpired(cmd, timeout, output)
+        return api.exec_inspect(exec_id).get('ExitCode'), output
+
+    def _detect_container_compressors(self, container):
+        """Определение утилит сжатия, доступных в контейнере (один раз на контейнер)"""
+        if container.id in self.container_compressors:
+            return self.container_compressors[container.id]
+
+        tools = set()
+        try:
+            result = container.exec_run(
+                ['sh', '-c', 'for t in zstd gzip lz4; do command -v $t >/dev/null 2>&1 && echo $t; done; true'])
+            if result.exit_code == 0:
+                tools = {line.strip() for line in result.output.decode('utf-8', errors='replace').split('\n')
+                         if line.strip()}
+        except Exception as e:
+            logging.debug(f"Не удалось определить утилиты сжатия в контейнере {container.name}: {e}")
+
+        logging.info(f"🐳 Утилиты сжатия в контейнере {container.name}: {', '.join(sorted(tools)) or 'нет'}")
+        self.container_compressors[container.id] = tools
+        return tools
+
+    def _dump_from_container(self, container, cmd, backup_path, db_type, env=None, target=None, capture_head=0):
+        """Дамп из контейнера со сжатием внутри контейнера или, при недоступности, на хосте"""
+        # Для чтения заголовка дампа нужен несжатый поток, поэтому сжимаем на хосте
+        # Сжатый поток не дедуплицируется, поэтому в режиме репозитория сжатие только на хосте
+        if self.container_compression and self.compression.enabled and not capture_head and not self.repository:
+            codec, level = self.compression.select(db_type, target)
+            tools = self._detect_container_compressors(container)
+
+            compressors = {
+                'zstd': f"zstd -q -c -{max(level, 1)} -T0",
+                'gzip': f"gzip -c -{min(max(level, 1), 9)}",
+                'lz4': f"lz4 -q -c -{max(level, 1)}"
+            }
+
+            if codec in compressors and codec in tools:
+                # Код возврата дампа сохраняется во временный файл, т.к. pipefail есть не во всех sh
+                script = ('rc_file=$(mktemp) || exit 1; '
+                          '{ "$@"; echo $? > "$rc_file"; } | ' + compressors[codec] +
+                          ' || { rm -f "$rc_file"; exit 1; }; '
+                          'rc=$(cat "$rc_file"); rm -f "$rc_file"; exit "${rc:-1}"')
+                return self._stream_docker_exec_to_file(
+                    container, ['sh', '-c', script, 'sh'] + cmd,
+                    self.compression.final_path(backup_path, codec), db_type, env, raw_output=True)
+
+            if db_type == 'mongodb' and codec != 'none':
+                # Собственное сжатие mongodump (архив с gzip-сжатыми коллекциями)
+                return self._stream_docker_exec_to_file(
+                    container, cmd + ['--gzip'], backup_path.replace('.archive', '.gz.archive'),
+                    db_type, env, raw_output=True)
+
+            logging.debug(f"Сжатие {codec} недоступно в контейнере {container.name}, сжимаем на хосте")
+
+        return self._stream_docker_exec_to_file(container, cmd, backup_path, db_type, env, target,
+                                                capture_head=capture_head)
+
+    def _copy_file_compressed(self, source_path, backup_path, db_type, target=None):
+        """Копирование файла (SQLite, RDB) через этап сжатия"""
+        writer, final_path = self._open_backup_writer(backup_path, db_type, target)
+        try:
+            with open(source_path, 'rb') as src:
+                shutil.copyfileobj(src, writer, 1024 * 1024)
+        finally:
+            writer.close()
+        return final_path
+
+    def _write_json_compressed(self, data, backup_path, db_type, target=None):
+        """Запись JSON экспорта (Elasticsearch, CouchDB) через этап сжатия"""
+        writer, final_path = self._open_backup_writer(backup_path, db_type, target)
+        with io.TextIOWrapper(writer, encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        return final_path
+
+    def _wal_archive_enabled(self, db_info):
+        """Включен ли инкрементальный режим WAL для кластера PostgreSQL"""
+        if db_info['type'] != 'postgresql' or not self.wal_archiver:
+            return False
+        
+        selectors = {
+            f"{db_info.get('host', 'localhost')}:{db_info.get('port')}",
+            str(db_info.get('container_name', ''))
+        }
+        return '*' in self.wal_archive_targets or bool(selectors & set(self.wal_archive_targets))
+
+    def _wal_cluster(self, db_info):
+        """Параметры подключения и имя кластера для WAL режима (None - порт контейнера не опубликован)"""
+        if db_info['source'] == 'docker':
+            # Инструменты хоста подключаются через опубликованный порт контейнера
+            if not db_info.get('ports'):
+                return None
+            credentials = db_info.get('credentials', {})
+            conn = {
+                'host': 'localhost',
+                'port': db_info['ports'][0],
+                'user': credentials.get('user', 'postgres'),
+                'password': credentials.get('password', '')
+            }
+            cluster = f"docker_{db_info['container_name']}"
+        else:
+            auto_creds = self.auto_credentials.get('postgresql', {})
+            conn = {
+                'host': db_info.get('host', 'localhost'),
+                'port': db_info.get('port', 5432),
+                'user': auto_creds.get('user', 'postgres'),
+                'password': auto_creds.get('password', '')
+            }
+            cluster = f"{conn['host']}_{conn['port']}"
+        return conn, cluster
+
+    def _retire_wal_cluster(self, db_info):
+        """Удаление слота репликации кластера, который больше не копируется в WAL режиме"""
+        cluster_info = self._wal_cluster(db_info)
+        if not cluster_info or cluster_info[1] not in self.wal_archiver.archived_clusters():
+            return
+        try:
+            self.wal_archiver.retire(*cluster_info)
+        except Exception as e:
+            logging.warning(f"⚠️ {cluster_info[1]}: {e}")
+
+    def _backup_postgres_incremental(self, db_info, timestamp):
+        """Инкрементальное копирование кластера PostgreSQL через WAL"""
+        cluster_info = self._wal_cluster(db_info)
+        if not cluster_info:
+            logging.warning(f"⚠️ Контейнер {db_info['container_name']} не публикует порт, WAL режим недоступен")
+            return []
+        conn, cluster = cluster_info
+        
+        try:
+            files = self.wal_archiver.cycle(conn, cluster, timestamp, continuous=self.daemon_mode)
+            logging.info(f"📡 WAL режим {cluster}: {len(files)} файлов к загрузке")
+            
+            # Сегменты WAL ссылаются на базовую копию, от которой их можно воспроизвести
+            target = f"pgwal:{cluster}"
+            for path in files:
+                if os.path.basename(path).startswith('pg_base_'):
+                    self._file_ready(path, target, 'postgresql', kind='base', chain=True)
+                elif path.endswith('.history'):
+                    # История таймлайнов нужна любой базовой копии после переключения ведущего сервера
+                    self._file_ready(path, target, 'postgresql', kind='history', chain=True)
+                else:
+                    base = self.catalog.latest(target, kind='base')
+                    self._file_ready(path, target, 'postgresql', kind='wal', chain=True,
+                                     parent=base['name'] if base else None)
+            if not files:
+                # Новых сегментов нет - предыдущие копии актуальны
+                self.skipped_unchanged.append(f"pgwal:{cluster}")
+            return files
+        except Exception as e:
+            logging.error(f"❌ Ошибка инкрементального копирования PostgreSQL {cluster}: {e}")
+            return []
+
+    def _binlog_server(self, db_info):
+        """Ключ и параметры подключения сервера MySQL в инкрементальном режиме (или None)"""
+        if db_info['type'] != 'mysql' or not self.binlog_streamer:
+            return None
+        
+        selectors = {
+            f"{db_info.get('host', 'localhost')}:{db_info.get('port')}",
+            str(db_info.get('container_name', ''))
+        }
+        if '*' not in self.binlog_targets and not selectors & set(self.binlog_targets):
+            return None
         
-        # 4. Удаление дубликатов
-        self._remove_duplicate_databases()
+        if db_info['source'] == 'docker':
+            if not db_info.get('ports'):
+                logging.warning(f"⚠️ Контейнер {db_info['container_name']} не публикует порт, поток binlog недоступен")
+                return None
+            credentials = db_info.get('credentials', {})
+            conn = {
+                'host': '127.0.0.1',
+                'port': db_info['ports'][0],
+                'user': credentials.get('user', 'root'),
+                'password': credentials.get('password', '')
+            }
+            return f"docker_{db_info['container_name']}", conn
+        
+        auto_creds = self.auto_credentials.get('mysql', {})
+        conn = {
+            'host': db_info.get('host', 'localhost'),
+            'port': db_info.get('port', 3306),
+            'user': auto_creds.get('user', 'root'),
+            'password': auto_creds.get('password', '')
+        }
+        return f"{conn['host']}_{conn['port']}", conn
+
+    def _backup_mysql_incremental(self, db_info):
+        """Цикл потокового копирования binlog для сервера MySQL"""
+        server, conn = self._binlog_server(db_info)
+        try:
+            files = self.binlog_streamer.cycle(conn, server, continuous=self.daemon_mode)
+            logging.info(f"📡 binlog режим {server}: {len(files)} файлов к загрузке")
+            # binlog ссылается на последний полный дамп сервера и удаляется ротацией вместе с ним
+            full_dumps = {b['file']: b['full_dump'] for b in self.binlog_streamer.load_index(server)['binlogs']}
+            for path in files:
+                self._file_ready(path, f"mysqlbin:{server}", 'mysql', kind='binlog', chain=True,
+                                 parent=full_dumps.get(os.path.basename(path)))
+            return files
+        except Exception as e:
+            logging.error(f"❌ Ошибка потокового копирования binlog {server}: {e}")
+            return []
+
+    def _table_diff_enabled(self, db_info):
+        """Включен ли дифференциальный режим по таблицам для сервера PostgreSQL"""
+        if db_info['type'] != 'postgresql' or not self.table_diff:
+            return False
         
-        logging.info("=" * 60)
-        logging.info(f"Обнаружение завершено: {len(self.discovered_databases)} уникальных БД")
-        logging.info("=" * 60)
+        selectors = {
+            f"{db_info.get('host', 'localhost')}:{db_info.get('port')}",
+            str(db_info.get('container_name', ''))
+        }
+        return '*' in self.table_diff_targets or bool(selectors & set(self.table_diff_targets))
+
+    def _backup_postgres_table_diff(self, db_info, timestamp):
+        """Дифференциальное копирование PostgreSQL: схема, измененные таблицы и манифест"""
+        backups = []
+        container = None
         
-        # Сохранение подробного отчета
-        self._save_discovery_report()
-        self._print_discovery_summary()
+        if db_info['source'] == 'docker':
+            container = self.docker_client.containers.get(db_info['container_id'])
+            credentials = db_info.get('credentials', {})
+            base_cmd = ['pg_dump', '-h', credentials.get('host', 'postgres'),
+                        '-U', credentials.get('user', 'postgres'), '--format=custom', '--no-password']
+            env = {'PGPASSWORD': credentials['password']} if credentials.get('password') else {}
+            prefix = f"docker_pgdiff_{db_info['container_name']}"
+        else:
+            auto_creds = self.auto_credentials.get('postgresql', {})
+            base_cmd = ['pg_dump', '-h', db_info.get('host', 'localhost'), '-p', str(db_info.get('port', 5432)),
+                        '-U', auto_creds.get('user', 'postgres'), '--format=custom', '--no-password']
+            env = os.environ.copy()
+            env['PGPASSWORD'] = auto_creds.get('password', '')
+            prefix = f"pgdiff_{db_info.get('host', 'localhost')}_{db_info.get('port', 5432)}"
         
-        return self.discovered_databases
-
-    def _remove_duplicate_databases(self):
-        """Удаление дубликатов БД"""
-        unique_dbs = []
-        seen = set()
+        if self.compression.enabled or self.repository:
+            base_cmd.append('--compress=0')
         
-        for db in self.discovered_databases:
-            # Создаем ключ для идентификации уникальной БД
-            key = f"{db['type']}:{db.get('host', 'localhost')}:{db.get('port', 'unknown')}"
+        def run_dump(cmd, backup_path, target):
+            if container is not None:
+                return self._dump_from_container(container, cmd, backup_path, 'postgresql', env, target)
+            return self._stream_command_to_file(cmd, backup_path, 'postgresql', env, target)
+        
+        for database in db_info.get('databases', []):
+            target = self._target_key(db_info, database)
+            fingerprint = self._get_change_fingerprint(db_info, database, container)
+            if self._skip_if_unchanged(target, fingerprint, database):
+                continue
+            self._admit_dump(db_info, database, target, container)
             
-            if key not in seen:
-                seen.add(key)
-                unique_dbs.append(db)
-            else:
-                # Объединяем информацию из разных источников
-                existing_db = next(d for d in unique_dbs if 
-                                 f"{d['type']}:{d.get('host', 'localhost')}:{d.get('port', 'unknown')}" == key)
-                
-                # Объединяем списки баз данных
-                existing_databases = set(existing_db.get('databases', []))
-                new_databases = set(db.get('databases', []))
-                existing_db['databases'] = list(existing_databases.union(new_databases))
-                
-                # Обновляем источники
-                sources = existing_db.get('sources', [existing_db.get('source', 'unknown')])
-                if db.get('source') not in sources:
-                    sources.append(db.get('source'))
-                existing_db['sources'] = sources
+            output = self._run_fingerprint_query(db_info, database, container, PostgresTableDiff.STATS_QUERY)
+            if output is None:
+                logging.error(f"❌ Не удалось получить статистику таблиц {database}")
+                continue
+            
+            stats = PostgresTableDiff.parse_stats(output)
+            state = self.table_diff.load_state(target)
+            changed = self.table_diff.changed_tables(state, stats)
+            logging.info(f"📋 {database}: изменено таблиц {len(changed)} из {len(stats)}")
+            
+            # Все дампы набора читают один экспортированный снимок: набор согласован между таблицами
+            try:
+                snapshot, release_snapshot = self._export_pg_snapshot(db_info, database, container)
+            except Exception as e:
+                logging.error(f"❌ {database}: {e}")
+                self.deadlines.finish(target, False)
+                continue
+            snapshot_cmd = base_cmd + [f'--snapshot={snapshot}']
+            
+            # Схема дампится всегда, данные - только измененных таблиц
+            jobs = {None: (snapshot_cmd + ['--schema-only', database],
+                           os.path.join(self.BACKUP_DIR, f"{prefix}_{database}_{timestamp}_schema.dump"))}
+            for number, name in enumerate(changed):
+                schema, table, _ = stats[name]
+                jobs[name] = (snapshot_cmd + ['--data-only', '--table',
+                                              PostgresTableDiff.table_pattern(schema, table), database],
+                              os.path.join(self.BACKUP_DIR, f"{prefix}_{database}_{timestamp}_t{number:04d}.dump"))
+            
+            results = {}
+            try:
+                with ThreadPoolExecutor(max_workers=self.governor.parallelism(self.table_diff.jobs)) as pool:
+                    futures = {name: pool.submit(run_dump, cmd, path, target) for name, (cmd, path) in jobs.items()}
+                    for name, future in futures.items():
+                        try:
+                            results[name] = future.result()
+                        except Exception as e:
+                            results[name] = (subprocess.CompletedProcess([], 1, stderr=str(e)), jobs[name][1])
+            finally:
+                release_snapshot()
+            
+            failed = [name for name, (result, _) in results.items() if result.returncode != 0]
+            self.deadlines.finish(target, not failed)
+            if failed:
+                for name in failed:
+                    logging.error(f"❌ Ошибка дампа {name or 'схемы'} ({database}): {results[name][0].stderr.strip()}")
+                for _, path in results.values():
+                    if os.path.isfile(path):
+                        os.remove(path)
+                continue
+            
+            schema_path = results.pop(None)[1]
+            dumped = {name: path for name, (_, path) in results.items()}
+            self.table_diff.update_state(state, stats, dumped)
+            
+            manifest_path = os.path.join(self.BACKUP_DIR, f"{prefix}_{database}_{timestamp}_manifest.json")
+            with open(manifest_path, 'w', encoding='utf-8') as f:
+                json.dump(PostgresTableDiff.build_manifest(target, database, schema_path, state, dumped),
+                          f, indent=2, ensure_ascii=False)
+            PostgresTableDiff.record_manifest(state, os.path.basename(manifest_path))
+            self.table_diff.save_state(target, state)
+            
+            backups.extend([schema_path] + list(dumped.values()) + [manifest_path])
+            
+            manifest_name = os.path.basename(manifest_path)
+            self._file_ready(schema_path, target, 'postgresql', kind='schema', parent=manifest_name, chain=True)
+            for path in dumped.values():
+                self._file_ready(path, target, 'postgresql', kind='table', parent=manifest_name, chain=True)
+            self._file_ready(manifest_path, target, 'postgresql', kind='manifest', chain=True)
+            self._record_backup_fingerprint(db_info, database, target, fingerprint, manifest_path, container)
+            logging.info(f"✅ Дифференциальная копия {database}: {manifest_path}")
         
-        self.discovered_databases = unique_dbs
-        logging.info(f"После удаления дубликатов: {len(unique_dbs)} уникальных БД")
+        return backups
 
-    def _print_discovery_summary(self):
-        """Вывод краткого отчета об обнаружении"""
-        logging.info("\n📊 КРАТКИЙ ОТЧЕТ ОБ ОБНАРУЖЕНИИ:")
-        
-        by_type = {}
-        by_source = {}
-        total_databases = 0
+    def _export_pg_snapshot(self, db_info, database, container=None, timeout=30):
+        """Открытая транзакция с экспортом снимка: ID для pg_dump --snapshot и функция ее завершения"""
+        begin = b"BEGIN ISOLATION LEVEL REPEATABLE READ READ ONLY;\nSELECT pg_export_snapshot();\n"
         
-        for db in self.discovered_databases:
-            db_type = db['type']
-            sources = db.get('sources', [db.get('source', 'unknown')])
-            databases_count = len(db.get('databases', []))
+        if container is not None:
+            from docker.utils.socket import frames_iter
+            credentials = db_info.get('credentials', {})
+            env = {'PGPASSWORD': credentials['password']} if credentials.get('password') else {}
+            cmd = ['psql', '-h', credentials.get('host', 'postgres'), '-U', credentials.get('user', 'postgres'),
+                   '-d', database, '-Atq', '--no-password', '-v', 'ON_ERROR_STOP=1']
+            api = self.docker_client.api
+            exec_id = api.exec_create(container.id, cmd, environment=env, stdin=True, stdout=True,
+                                      stderr=True)['Id']
+            sock = api.exec_start(exec_id, socket=True)
+            raw = getattr(sock, '_sock', sock)
+            raw.settimeout(timeout)
             
-            by_type[db_type] = by_type.get(db_type, 0) + 1
-            total_databases += databases_count
+            def expire():
+                # frames_iter ждет данных без таймаута: зависшее подключение прерывается закрытием сокета
+                try:
+                    raw.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
             
-            for source in sources:
-                by_source[source] = by_source.get(source, 0) + 1
+            timer = threading.Timer(timeout, expire)
+            timer.daemon = True
+            timer.start()
+            output = b''
+            try:
+                raw.sendall(begin)
+                for stream, data in frames_iter(sock, tty=False):
+                    output += data
+                    if stream == 1 and b'\n' in output:
+                        break
+            except OSError:
+                pass
+            finally:
+                timer.cancel()
+            snapshot = output.decode('utf-8', errors='replace').strip()
+            
+            def release():
+                try:
+                    raw.sendall(b"COMMIT;\n\\q\n")
+                except OSError:
+                    pass
+                finally:
+                    sock.close()
+        else:
+            auto_creds = self.auto_credentials.get('postgresql', {})
+            env = os.environ.copy()
+            env['PGPASSWORD'] = auto_creds.get('password', '')
+            cmd = ['psql', '-h', db_info.get('host', 'localhost'), '-p', str(db_info.get('port', 5432)),
+                   '-U', auto_creds.get('user', 'postgres'), '-d', database, '-Atq', '--no-password',
+                   '-v', 'ON_ERROR_STOP=1']
+            process = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                       env=env)
+            # Зависшее подключение не должно блокировать запуск
+            timer = threading.Timer(timeout, process.kill)
+            timer.start()
+            try:
+                process.stdin.write(begin)
+                process.stdin.flush()
+            except BrokenPipeError:
+                pass
+            snapshot = process.stdout.readline().decode('utf-8', errors='replace').strip()
+            timer.cancel()
+            if not snapshot:
+                process.kill()
+                stderr = process.communicate()[1].decode('utf-8', errors='replace').strip()
+                raise RuntimeError(f"не удалось экспортировать снимок: {stderr or 'нет ответа'}")
+            
+            def release():
+                try:
+                    process.communicate(b"COMMIT;\n", timeout=timeout)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+        
+        if not re.match(r'^[0-9A-F]+-[0-9A-F]+(-[0-9]+)?$', snapshot):
+            release()
+            raise RuntimeError(f"не удалось экспортировать снимок: {snapshot or 'нет ответа'}")
+        return snapshot, release
+
+    def _oplog_enabled(self, db_info):
+        """Включен ли инкрементальный режим oplog для сервера MongoDB"""
+        if db_info['type'] != 'mongodb' or not self.oplog_tailer:
+            return False
         
-        logging.info(f"📈 Всего СУБД: {len(self.discovered_databases)}")
-        logging.info(f"📊 Всего баз данных: {total_databases}")
+        selectors = {
+            f"{db_info.get('host', 'localhost')}:{db_info.get('port')}",
+            str(db_info.get('container_name', ''))
+        }
+        return '*' in self.oplog_targets or bool(selectors & set(self.oplog_targets))
+
+    def _backup_mongodb_incremental(self, db_info, timestamp):
+        """Инкрементальное копирование MongoDB через oplog (None - не replica set)"""
+        container = None
+        if db_info['source'] == 'docker':
+            container = self.docker_client.containers.get(db_info['container_id'])
+            credentials = db_info.get('credentials', {})
+            server = f"docker_{db_info['container_name']}"
+            base_cmd = ['mongodump']
+            user, password = credentials.get('user', 'admin'), credentials.get('password', '')
+        else:
+            auto_creds = self.auto_credentials.get('mongodb', {})
+            server = f"{db_info.get('host', 'localhost')}_{db_info.get('port', 27017)}"
+            base_cmd = ['mongodump', '--host', f"{db_info.get('host', 'localhost')}:{db_info.get('port', 27017)}"]
+            user, password = auto_creds.get('user', 'admin'), auto_creds.get('password', '')
+        
+        if password:
+            base_cmd.extend(['--username', user, '--password', password, '--authenticationDatabase', 'admin'])
+        
+        # Границы окна oplog (только для replica set)
+        oplog_edge = ('var o = db.getSiblingDB("local").oplog.rs.find().sort({$natural: %d}).limit(1).next(); '
+                      'print(o.ts.t + ":" + o.ts.i)')
+        latest = self._run_fingerprint_query(db_info, 'admin', container, oplog_edge % -1)
+        oldest = self._run_fingerprint_query(db_info, 'admin', container, oplog_edge % 1)
+        try:
+            latest_ts = MongoOplogTailer.parse_ts(latest.strip().split('\n')[-1]) if latest else None
+            oldest_ts = MongoOplogTailer.parse_ts(oldest.strip().split('\n')[-1]) if oldest else None
+        except ValueError:
+            latest_ts = oldest_ts = None
         
-        logging.info("\n🔧 По типам СУБД:")
-        for db_type, count in sorted(by_type.items()):
-            logging.info(f"  {db_type}: {count}")
+        if not latest_ts:
+            logging.warning(f"⚠️ MongoDB {server}: oplog недоступен (не replica set?), обычный дамп")
+            return None
         
-        logging.info("\n🔍 По источникам обнаружения:")
-        for source, count in sorted(by_source.items()):
-            logging.info(f"  {source}: {count}")
+        def run_dump(cmd, backup_path):
+            if container is not None:
+                return self._stream_docker_exec_to_file(container, cmd, backup_path, 'mongodb')
+            return self._stream_command_to_file(cmd, backup_path, 'mongodb', os.environ.copy())
         
-        logging.info("\n💾 Подробный отчет сохранен в discovery_report_*.json")
-
-    def _save_discovery_report(self):
-        """Сохранение отчета об обнаруженных БД"""
-        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        report_file = os.path.join(self.BACKUP_DIR, f'discovery_report_{timestamp}.json')
+        index = self.oplog_tailer.load_index(server)
+        files = []
         
         try:
-            with open(report_file, 'w', encoding='utf-8') as f:
-                json.dump(self.discovered_databases, f, indent=2, ensure_ascii=False, default=str)
-            logging.info(f"Отчет об обнаружении сохранен: {report_file}")
+            if self.oplog_tailer.full_archive_due(index, oldest_ts):
+                # Метка времени берется до начала дампа: повтор операций oplog идемпотентен
+                backup_path = os.path.join(self.BACKUP_DIR, f"mongo_full_{server}_{timestamp}.archive")
+                result, backup_path = run_dump(base_cmd + ['--archive', '--oplog'], backup_path)
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.strip())
+                self.oplog_tailer.record_full_archive(index, backup_path, latest_ts)
+                files.append(backup_path)
+                self._file_ready(backup_path, f"oplog:{server}", 'mongodb', kind='full', chain=True)
+                logging.info(f"🍃 Полный архив MongoDB {server}: {backup_path}")
+            
+            elif latest_ts > MongoOplogTailer.parse_ts(index['last_ts']):
+                from_ts = MongoOplogTailer.parse_ts(index['last_ts'])
+                backup_path = os.path.join(
+                    self.BACKUP_DIR, f"mongo_oplog_{server}_{from_ts[0]}-{from_ts[1]}_{latest_ts[0]}-{latest_ts[1]}.bson")
+                cmd = base_cmd + ['--db', 'local', '--collection', 'oplog.rs',
+                                  '--query', MongoOplogTailer.ts_query(from_ts, latest_ts), '--out', '-']
+                result, backup_path = run_dump(cmd, backup_path)
+                if result.returncode != 0:
+                    raise RuntimeError(result.stderr.strip())
+                self.oplog_tailer.record_chunk(index, backup_path, from_ts, latest_ts)
+                files.append(backup_path)
+                self._file_ready(backup_path, f"oplog:{server}", 'mongodb', kind='oplog', chain=True,
+                                 parent=index['chunks'][-1]['full_archive'])
+                logging.info(f"🍃 Фрагмент oplog MongoDB {server}: {backup_path}")
+            
+            else:
+                self.skipped_unchanged.append(f"oplog:{server}")
+                logging.info(f"⏭️ MongoDB {server}: новых операций в oplog нет")
+            
+            self.oplog_tailer.apply_retention(server, index)
         except Exception as e:
-            logging.error(f"Ошибка сохранения отчета: {e}")
+            logging.error(f"❌ Ошибка инкрементального копирования MongoDB {server}: {e}")
+            for path in files:
+                if os.path.isfile(path):
+                    os.remove(path)
+            return []
+        finally:
+            self.oplog_tailer.save_index(server, index)
+        
+        return files
+
+    def shutdown(self):
+        """Остановка фоновых процессов"""
+        if self.wal_archiver:
+            self.wal_archiver.stop()
+        if self.binlog_streamer:
+            self.binlog_streamer.stop()
 
     def backup_database(self, db_info):
         """Создание резервной копии отдельной БД"""
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         
+        if self._wal_archive_enabled(db_info):
+            return self._backup_postgres_incremental(db_info, timestamp)
+        if db_info['type'] == 'postgresql' and self.wal_archiver:
+            # Слот исключенного кластера иначе навсегда удерживает WAL на сервере
+            self._retire_wal_cluster(db_info)
+        
+        if self._table_diff_enabled(db_info):
+            return self._backup_postgres_table_diff(db_info, timestamp)
+        
+        if self._oplog_enabled(db_info):
+            files = self._backup_mongodb_incremental(db_info, timestamp)
+            if files is not None:
+                return files
+        
+        binlog_server = self._binlog_server(db_info)
+        if binlog_server:
+            # Между полными дампами MySQL отправляются только binlog
+            backups = []
+            if self.binlog_streamer.full_dump_due(binlog_server[0]):
+                if db_info['source'] == 'docker':
+                    backups = self._backup_docker_database(db_info, timestamp)
+                else:
+                    backups = self._backup_system_database(db_info, timestamp)
+            return backups + self._backup_mysql_incremental(db_info)
+        
         if db_info['source'] == 'system' or db_info['source'] == 'network_scan':
             return self._backup_system_database(db_info, timestamp)
         elif db_info['source'] == 'docker':
@@ -2124,6 +7529,14 @@ class UniversalBackup:
             return backups
         
         for database in db_info.get('databases', []):
+            target = self._target_key(db_info, database)
+            fingerprint = self._get_change_fingerprint(db_info, database)
+            if self._skip_if_unchanged(target, fingerprint, database):
+                continue
+            self._admit_dump(db_info, database, target)
+            
+            backups_before = len(backups)
+            dump_started = time.time()
             try:
                 if db_info['type'] == 'postgresql':
                     backup_file = f"pg_{db_info.get('host', 'localhost')}_{db_info.get('port', 5432)}_{database}_{timestamp}.sql"
@@ -2141,13 +7554,18 @@ class UniversalBackup:
                         '-U', user,
                         '--format=custom',
                         '--no-password',
-                        '--file', backup_path,
                         database
                     ]
                     
+                    # Встроенное сжатие pg_dump отключаем, если работает этап сжатия
+                    if self.compression.enabled or self.repository:
+                        cmd.insert(-1, '--compress=0')
+                    
                     env = os.environ.copy()
                     env['PGPASSWORD'] = password
                     
+                    result, backup_path = self._stream_command_to_file(cmd, backup_path, 'postgresql', env, target)
+                    
                 elif db_info['type'] == 'mysql':
                     backup_file = f"mysql_{db_info.get('host', 'localhost')}_{db_info.get('port', 3306)}_{database}_{timestamp}.sql"
                     backup_path = os.path.join(self.BACKUP_DIR, backup_file)
@@ -2170,16 +7588,24 @@ class UniversalBackup:
                     
                     if password:
                         cmd.insert(-1, f'-p{password}')
+                    
+                    # Позиция binlog записывается в сам дамп согласованно со снимком
+                    binlog_server = self._binlog_server(db_info)
+                    if binlog_server:
+                        cmd.insert(-1, self.binlog_streamer.source_data_flag('host', lambda: subprocess.run(
+                            ['mysqldump', '--help'], capture_output=True, text=True, timeout=10).stdout))
                         
                     env = os.environ.copy()
                     
-                    with open(backup_path, 'w') as f:
-                        result = subprocess.run(cmd, stdout=f, stderr=subprocess.PIPE, env=env, text=True)
+                    result, backup_path = self._stream_command_to_file(
+                        cmd, backup_path, 'mysql', env, target, capture_head=64 * 1024 if binlog_server else 0)
+                    
+                    if binlog_server and result.returncode == 0:
+                        self.binlog_streamer.record_full_dump(binlog_server[0], database, backup_path, result.stdout)
                         
                 elif db_info['type'] == 'mongodb':
-                    backup_dir = f"mongo_{db_info.get('host', 'localhost')}_{db_info.get('port', 27017)}_{database}_{timestamp}"
-                    backup_path = os.path.join(self.BACKUP_DIR, backup_dir)
-                    os.makedirs(backup_path, exist_ok=True)
+                    backup_file = f"mongo_{db_info.get('host', 'localhost')}_{db_info.get('port', 27017)}_{database}_{timestamp}.archive"
+                    backup_path = os.path.join(self.BACKUP_DIR, backup_file)
                     
                     # Используем найденные учетные данные
                     auto_creds = self.auto_credentials.get('mongodb', {})
@@ -2190,14 +7616,14 @@ class UniversalBackup:
                         'mongodump',
                         '--host', f"{db_info.get('host', 'localhost')}:{db_info.get('port', 27017)}",
                         '--db', database,
-                        '--out', backup_path
+                        '--archive'
                     ]
                     
                     if password:
                         cmd.extend(['--username', user, '--password', password])
                         
                     env = os.environ.copy()
-                    result = subprocess.run(cmd, capture_output=True, text=True, env=env)
+                    result, backup_path = self._stream_command_to_file(cmd, backup_path, 'mongodb', env, target)
                     
                 elif db_info['type'] == 'redis':
                     backup_file = f"redis_{db_info.get('host', 'localhost')}_{db_info.get('port', 6379)}_{database}_{timestamp}.rdb"
@@ -2220,7 +7646,7 @@ class UniversalBackup:
                     cmd.append('BGSAVE')
                     
                     env = os.environ.copy()
-                    result = subprocess.run(cmd, capture_output=True, text=True, env=env)
+                    result = subprocess.run(cmd, capture_output=True, text=True, env=env, timeout=60)
                     
                     if result.returncode == 0:
                         # Ждем завершения BGSAVE
@@ -2239,9 +7665,12 @@ class UniversalBackup:
                             
                             for rdb_path in rdb_locations:
                                 if os.path.exists(rdb_path):
-                                    import shutil
-                                    shutil.copy2(rdb_path, backup_path)
+                                    backup_path = self._copy_file_compressed(rdb_path, backup_path, 'redis', target)
                                     break
+                            else:
+                                # BGSAVE выполнен, но копировать нечего - это не резервная копия
+                                result = subprocess.CompletedProcess(
+                                    cmd, 1, stderr=f"RDB файл не найден: {', '.join(rdb_locations)}")
                         except Exception as e:
                             logging.error(f"Ошибка копирования RDB файла: {e}")
                             continue
@@ -2250,9 +7679,8 @@ class UniversalBackup:
                     backup_file = f"sqlite_{os.path.basename(db_info['file_path'])}_{timestamp}.db"
                     backup_path = os.path.join(self.BACKUP_DIR, backup_file)
                     
-                    # Простое копирование файла SQLite
-                    import shutil
-                    shutil.copy2(db_info['file_path'], backup_path)
+                    # Копирование файла SQLite через этап сжатия
+                    backup_path = self._copy_file_compressed(db_info['file_path'], backup_path, 'sqlite', target)
                     backups.append(backup_path)
                     continue
                 
@@ -2269,8 +7697,7 @@ class UniversalBackup:
                         response = requests.get(url, params=params, timeout=30)
                         
                         if response.status_code == 200:
-                            with open(backup_path, 'w') as f:
-                                json.dump(response.json(), f, indent=2)
+                            backup_path = self._write_json_compressed(response.json(), backup_path, 'elasticsearch', target)
                             backups.append(backup_path)
                             logging.info(f"Создана резервная копия Elasticsearch: {backup_path}")
                         continue
@@ -2291,8 +7718,7 @@ class UniversalBackup:
                         response = requests.get(url, params=params, timeout=30)
                         
                         if response.status_code == 200:
-                            with open(backup_path, 'w') as f:
-                                json.dump(response.json(), f, indent=2)
+                            backup_path = self._write_json_compressed(response.json(), backup_path, 'couchdb', target)
                             backups.append(backup_path)
                             logging.info(f"Создана резервная копия CouchDB: {backup_path}")
                         continue
@@ -2304,18 +7730,24 @@ class UniversalBackup:
                     logging.warning(f"Резервное копирование {db_info['type']} не поддерживается")
                     continue
                 
-                # Выполнение команды для PostgreSQL, MySQL, MongoDB, Redis
-                if db_info['type'] in ['postgresql', 'mongodb', 'redis'] and db_info['type'] != 'mysql':
-                    result = subprocess.run(cmd, capture_output=True, text=True, env=env)
-                
+                # Проверка результата для PostgreSQL, MySQL, MongoDB, Redis
                 if result.returncode == 0:
                     logging.info(f"Создана резервная копия: {backup_path}")
                     backups.append(backup_path)
                 else:
                     logging.error(f"Ошибка создания резервной копии {database}: {result.stderr}")
+                    if os.path.isfile(backup_path):
+                        os.remove(backup_path)
                     
             except Exception as e:
                 logging.error(f"Ошибка резервного копирования {database}: {e}")
+            finally:
+                self.deadlines.finish(target, len(backups) > backups_before)
+                if len(backups) > backups_before:
+                    self._record_backup_fingerprint(db_info, database, target, fingerprint, backups[-1])
+                    # Полный дамп в режиме binlog - корень цепочки binlog
+                    self._file_ready(backups[-1], target, db_info['type'], chain=bool(self._binlog_server(db_info)),
+                                     started_at=dump_started)
         
         return backups
 
@@ -2326,8 +7758,17 @@ class UniversalBackup:
         try:
             container = self.docker_client.containers.get(db_info['container_id'])
             credentials = db_info.get('credentials', {})
+            binlog_server = self._binlog_server(db_info)
             
             for database in db_info.get('databases', []):
+                target = self._target_key(db_info, database)
+                fingerprint = self._get_change_fingerprint(db_info, database, container)
+                if self._skip_if_unchanged(target, fingerprint, database):
+                    continue
+                self._admit_dump(db_info, database, target, container)
+                
+                backups_before = len(backups)
+                dump_started = time.time()
                 try:
                     if db_info['type'] == 'postgresql':
                         backup_file = f"docker_pg_{db_info['container_name']}_{database}_{timestamp}.sql"
@@ -2352,6 +7793,9 @@ class UniversalBackup:
                             database
                         ]
                         
+                        if self.compression.enabled or self.repository:
+                            cmd.insert(-1, '--compress=0')
+                        
                         env = {}
                         if password:
                             env['PGPASSWORD'] = password
@@ -2372,6 +7816,12 @@ class UniversalBackup:
                         env = {}
                         if credentials.get('password'):
                             cmd.insert(-1, f"-p{credentials['password']}")
+                        
+                        # Позиция binlog записывается в сам дамп согласованно со снимком
+                        if binlog_server:
+                            cmd.insert(-1, self.binlog_streamer.source_data_flag(
+                                container.id, lambda: container.exec_run(['mysqldump', '--help']).output.decode(
+                                    'utf-8', errors='replace')))
                     
                     elif db_info['type'] == 'mongodb':
                         backup_file = f"docker_mongo_{db_info['container_name']}_{database}_{timestamp}.archive"
@@ -2399,9 +7849,9 @@ class UniversalBackup:
                         cmd.append('BGSAVE')
                         
                         # Выполняем BGSAVE
-                        result = container.exec_run(cmd, environment=env)
+                        exit_code, output = self._docker_exec_output(container, cmd, env, timeout=60)
                         
-                        if result.exit_code == 0:
+                        if exit_code == 0:
                             # Ждем завершения BGSAVE
                             import time
                             time.sleep(3)
@@ -2411,18 +7861,19 @@ class UniversalBackup:
                             
                             for rdb_path in possible_paths:
                                 copy_cmd = ['cat', rdb_path]
-                                result = container.exec_run(copy_cmd)
+                                copy_result, copy_path = self._dump_from_container(
+                                    container, copy_cmd, backup_path, 'redis', target=target)
                                 
-                                if result.exit_code == 0:
-                                    with open(backup_path, 'wb') as f:
-                                        f.write(result.output)
-                                    logging.info(f"Создана резервная копия Docker Redis: {backup_path}")
-                                    backups.append(backup_path)
+                                if copy_result.returncode == 0:
+                                    logging.info(f"Создана резервная копия Docker Redis: {copy_path}")
+                                    backups.append(copy_path)
                                     break
+                                elif os.path.isfile(copy_path):
+                                    os.remove(copy_path)
                             else:
                                 logging.error(f"Не удалось найти dump.rdb в контейнере Redis")
                         else:
-                            logging.error(f"Ошибка BGSAVE в Redis: {result.output.decode()}")
+                            logging.error(f"Ошибка BGSAVE в Redis: {output.decode()}")
                         
                         continue  # Пропускаем общий exec_run ниже для Redis
                     
@@ -2432,28 +7883,182 @@ class UniversalBackup:
                     
                     # Выполнение команды в контейнере (для всех кроме Redis)
                     if db_info['type'] != 'redis':
-                        result = container.exec_run(cmd, environment=env)
+                        # Потоковая запись вывода через этап сжатия
+                        capture_head = 64 * 1024 if binlog_server else 0
+                        result, backup_path = self._dump_from_container(
+                            container, cmd, backup_path, db_info['type'], env, target, capture_head)
                         
-                        if result.exit_code == 0:
-                            # Сохранение результата в файл
-                            with open(backup_path, 'wb') as f:
-                                f.write(result.output)
-                            
+                        if result.returncode == 0:
                             logging.info(f"Создана резервная копия Docker: {backup_path}")
                             backups.append(backup_path)
+                            if binlog_server:
+                                self.binlog_streamer.record_full_dump(
+                                    binlog_server[0], database, backup_path, result.stdout)
                         else:
-                            logging.error(f"Ошибка создания резервной копии Docker {database}: {result.output.decode()}")
+                            logging.error(f"Ошибка создания резервной копии Docker {database}: {result.stderr}")
+                            if os.path.isfile(backup_path):
+                                os.remove(backup_path)
                             
                 except Exception as e:
                     logging.error(f"Ошибка резервного копирования Docker {database}: {e}")
                     import traceback
                     logging.error(traceback.format_exc())
+                finally:
+                    self.deadlines.finish(target, len(backups) > backups_before)
+                    if len(backups) > backups_before:
+                        self._record_backup_fingerprint(db_info, database, target, fingerprint,
+                                                        backups[-1], container)
+                        self._file_ready(backups[-1], target, db_info['type'], chain=bool(binlog_server),
+                                         started_at=dump_started)
                     
         except Exception as e:
             logging.error(f"Ошибка работы с контейнером {db_info.get('container_name', 'unknown')}: {e}")
         
         return backups
 
+    def _file_ready(self, file_path, target=None, engine=None, kind='full', parent=None, chain=False,
+                    started_at=None):
+        """Регистрация закрытого файла резервной копии в каталоге и передача в конвейер загрузки"""
+        if file_path in self.submitted_files:
+            return
+        self.submitted_files.add(file_path)
+        self.compression.record_success(file_path)
+        if self.repository and file_path.endswith('.snap'):
+            self.repository.commit_snapshot(file_path)
+        if file_path in self.remote_streams:
+            self._commit_stream(file_path, target, engine, kind, parent, chain, started_at)
+            return
+        self.catalog.register(file_path, target or BackupCatalog.legacy_series_key(file_path), engine, kind,
+                              self.run_id, parent=parent, chain=chain, started_at=started_at)
+        self.catalog.set_checksums(file_path, **self.compression.checksums.pop(file_path, {}))
+        if self.verifier:
+            self.verifier.submit(file_path, engine or (self.catalog.get(file_path) or {}).get('engine'), kind)
+        if self.pipeline:
+            self.pipeline.submit(file_path)
+
+    def _commit_stream(self, file_path, target, engine, kind, parent, chain, started_at):
+        """Завершение потоковой загрузки успешного дампа: проверка, сравнение MD5 и регистрация"""
+        sink, writer = self.remote_streams.pop(file_path)
+        name = os.path.basename(file_path)
+        target = target or BackupCatalog.legacy_series_key(file_path)
+        checksums = self.compression.checksums.pop(file_path, {})
+        
+        if self.verifier:
+            result = self.verifier.verify_edges(name, engine, kind, bytes(writer.head), writer.tail, writer.bytes_in)
+            if result['ok'] is False:
+                sink.abort()
+                self.inventory.forget_file(file_path)
+                return
+        
+        try:
+            previous = self.catalog.previous_upload(target, name)
+            if self.upload_dedup and previous and previous['md5'] == checksums.get('md5'):
+                sink.abort()
+                remote_id, reference = previous['remote_id'], True
+                self.deduplicated_uploads.append(name)
+                logging.info(f"♻️ {name} совпадает с загруженной копией {previous['name']} (MD5), загрузка отменена")
+            else:
+                drive_file = sink.commit()
+                remote_id, reference = drive_file.get('id'), False
+                if drive_file.get('md5Checksum') and drive_file['md5Checksum'] != checksums.get('md5'):
+                    logging.warning(f"⚠️ MD5 {name} на Google Drive не совпадает с посчитанным при записи")
+                self.streamed_uploads += 1
+                logging.info(f"☁️ {name} загружен потоком: {sink.size / (1024 * 1024):.1f} MB, "
+                             f"временный файл до {sink.spill_peak / (1024 * 1024):.1f} MB. ID: {remote_id}")
+        except Exception as e:
+            logging.error(f"❌ Ошибка потоковой загрузки {name}: {e}")
+            self.inventory.forget_file(file_path)
+            self.stream_failures.append(f"{name} (загрузка: {e})")
+            return
+        
+        self.catalog.register(file_path, target, engine, kind, self.run_id, parent=parent, chain=chain,
+                              started_at=started_at, size=sink.size)
+        self.catalog.set_checksums(file_path, **checksums)
+        self.catalog.mark_uploaded(file_path, remote_id, reference=reference)
+
+    def _thread_drive_service(self):
+        """Отдельный клиент Drive для каждого потока загрузки (httplib2 не потокобезопасен)"""
+        if threading.current_thread() is threading.main_thread():
+            return self.drive_service
+        
+        service = getattr(self.drive_local, 'service', None)
+        if service is None:
+            service = build('drive', 'v3', credentials=self.drive_credentials, cache_discovery=False)
+            self.drive_local.service = service
+        return service
+
+    def resume_pending_uploads(self):
+        """Повторная постановка в очередь файлов с незавершенной загрузкой"""
+        for file_path in self.upload_journal.pending():
+            logging.info(f"🔁 Продолжение прерванной загрузки: {os.path.basename(file_path)}")
+            self._file_ready(file_path)
+
+    def _file_md5(self, file_path, artefact=None):
+        """MD5 файла: посчитанный при записи (из каталога) или, если его нет, чтением файла"""
+        if artefact and artefact.get('md5'):
+            return artefact['md5']
+        
+        # Файл записан не через этап сжатия - заодно считаются суммы для манифеста
+        digests = HashingTee.of_file(file_path)
+        self.catalog.set_checksums(file_path, **digests)
+        return digests['md5']
+
+    def write_run_manifest(self):
+        """Подписанный манифест запуска, загружаемый рядом с артефактами"""
+        artefacts = self.catalog.run_artefacts(self.run_id)
+        if not artefacts:
+            return None
+        
+        for artefact in artefacts:
+            # Суммы файлов, не прошедших через этап сжатия и еще не загруженных
+            if not artefact['sha256'] and artefact['local_path'] and os.path.isfile(artefact['local_path']):
+                artefact.update(HashingTee.of_file(artefact['local_path']))
+                self.catalog.set_checksums(artefact['local_path'], **{
+                    name: artefact[name] for name in HashingTee.ALGORITHMS if artefact.get(name)})
+        
+        if not self.manifest_key:
+            logging.warning("⚠️ BACKUP_MANIFEST_KEY не задан, манифест запуска не подписывается "
+                            "(контрольные суммы без подписи не защищают от подмены манифеста)")
+        manifest = RunManifest.build(self.run_id, artefacts, self.manifest_key)
+        
+        manifest_path = os.path.join(self.BACKUP_DIR, f"run_manifest_{self.run_id}.json")
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, ensure_ascii=False)
+        os.replace(manifest_path + '.tmp', manifest_path)
+        self.catalog.register(manifest_path, 'run-manifest', kind='manifest', run_id=self.run_id)
+        logging.info(f"🧾 Манифест запуска: {os.path.basename(manifest_path)} ({len(artefacts)} артефактов)")
+        
+        # Локальная копия манифеста сохраняется для проверки копий через --verify-manifest
+        if self.drive_service or self.storage_backends:
+            self.upload_to_storage(manifest_path)
+        return manifest_path
+
+    def verify_manifest(self, manifest_path):
+        """Проверка подписи манифеста и локальных копий по контрольным суммам"""
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        
+        if manifest.get('signature') is None:
+            if self.manifest_key:
+                # С заданным ключом все манифесты подписываются: без подписи - подпись удалена
+                logging.error("❌ Манифест не подписан, хотя задан BACKUP_MANIFEST_KEY")
+            else:
+                logging.warning("⚠️ Манифест не подписан (BACKUP_MANIFEST_KEY не задан), проверяются только суммы")
+        elif RunManifest.signature_valid(manifest, self.manifest_key):
+            logging.info("✅ Подпись манифеста верна")
+        else:
+            logging.error("❌ Подпись манифеста не совпадает (манифест изменен или задан другой ключ)")
+        
+        results = RunManifest.check_files(manifest, self.BACKUP_DIR)
+        for name, status in results.items():
+            if status == 'ok':
+                logging.info(f"✅ {name}")
+            elif status == 'missing':
+                logging.info(f"☁️ {name}: нет локальной копии")
+            else:
+                logging.error(f"❌ {name}: размер или контрольная сумма не совпадает")
+        return results
+
     def upload_to_drive(self, file_path):
         """Загрузка файла на Google Drive"""
         if not self.drive_service:
@@ -2463,39 +8068,295 @@ class UniversalBackup:
         try:
             filename = os.path.basename(file_path)
             
-            file_metadata = {
-                'name': filename,
-                'parents': [self.DRIVE_FOLDER_ID] if self.DRIVE_FOLDER_ID else []
-            }
+            # Поврежденная копия не загружается и остается локально для разбора
+            verification = self.verifier.result(file_path) if self.verifier else None
+            if verification and verification['ok'] is not None:
+                self.catalog.mark_verified(file_path, verification['ok'])
+                if not verification['ok']:
+                    logging.error(f"❌ {filename} не загружается: проверка не пройдена")
+                    return False
             
-            media = MediaFileUpload(file_path, resumable=True)
+            artefact = self.catalog.get(file_path)
+            checksum = self._file_md5(file_path, artefact)
+            previous = self.catalog.previous_upload(artefact['target'], filename) if artefact else None
+            if self.upload_dedup and previous and previous['md5'] == checksum:
+                self.catalog.mark_uploaded(file_path, previous['remote_id'], reference=True)
+                self.deduplicated_uploads.append(filename)
+                logging.info(f"♻️ {filename} совпадает с загруженной копией {previous['name']} (MD5), "
+                             f"загрузка пропущена")
+                return True
             
-            file = self.drive_service.files().create(
-                body=file_metadata,
-                media_body=media,
-                fields='id'
-            ).execute()
+            with open(file_path, 'rb') as source:
+                file = self.drive_backend.put(source, filename, size=os.path.getsize(file_path),
+                                              journal_key=file_path)
             
-            logging.info(f"Файл {filename} загружен на Google Drive. ID: {file.get('id')}")
+            if file['md5'] and file['md5'] != checksum:
+                logging.warning(f"⚠️ MD5 {filename} на Google Drive не совпадает с локальным")
+            self.catalog.mark_uploaded(file_path, file['id'])
+            
+            logging.info(f"Файл {filename} загружен на Google Drive. ID: {file['id']}")
             return True
             
         except Exception as e:
             logging.error(f"Ошибка загрузки на Google Drive: {e}")
             return False
 
+    def storage_backend(self, name):
+        """Хранилище по имени: drive - при подключенном Google Drive, остальные - из BACKUP_STORAGE"""
+        if name == 'drive':
+            return self.drive_backend if self.drive_service else None
+        return next((b for b in self.storage_backends if b.name == name), None)
+
+    def upload_to_storage(self, file_path):
+        """Загрузка файла во все хранилища: на Google Drive и параллельно в дополнительные"""
+        if self.drive_service and not self.upload_to_drive(file_path):
+            return False
+        if not self.storage_backends:
+            return True
+        
+        verification = self.verifier.result(file_path) if self.verifier else None
+        if verification and verification['ok'] is False:
+            logging.error(f"❌ {os.path.basename(file_path)} не загружается: проверка не пройдена")
+            return False
+        
+        with ThreadPoolExecutor(max_workers=len(self.storage_backends)) as pool:
+            return all(list(pool.map(lambda backend: self._copy_to_backend(file_path, backend),
+                                     self.storage_backends)))
+
+    def _copy_to_backend(self, file_path, backend):
+        filename = os.path.basename(file_path)
+        if any(c['backend'] == backend.name for c in self.catalog.copies(filename)):
+            return True
+        
+        artefact = self.catalog.get(file_path) or {}
+        size = os.path.getsize(file_path)
+        started = time.monotonic()
+        try:
+            with open(file_path, 'rb') as source:
+                result = backend.put(source, filename, size=size, md5=artefact.get('md5'))
+        except Exception as e:
+            logging.error(f"❌ Ошибка загрузки {filename} в хранилище {backend.name}: {e}")
+            return False
+        
+        if artefact.get('md5') and result['md5'] != artefact['md5']:
+            logging.error(f"❌ MD5 {filename} в хранилище {backend.name} не совпадает с локальным")
+            return False
+        self.catalog.add_copy(filename, backend.name, result['id'], result['size'], result['md5'])
+        
+        elapsed = max(time.monotonic() - started, 0.001)
+        logging.info(f"🪣 {filename} загружен в хранилище {backend.name}: {size / (1024 * 1024):.1f} MB, "
+                     f"{size / (1024 * 1024) / elapsed:.1f} MB/s")
+        return True
+
+    def _delete_backend_copies(self, names):
+        """Удаление копий артефактов, удаленных ротацией, из дополнительных хранилищ"""
+        deleted = 0
+        for name in names:
+            for copy in self.catalog.copies(name):
+                backend = self.storage_backend(copy['backend'])
+                if not backend or backend.name == 'drive':
+                    continue
+                try:
+                    backend.delete(copy['remote_id'])
+                    self.catalog.forget_copies(name, backend.name)
+                    deleted += 1
+                except Exception as e:
+                    logging.error(f"Ошибка удаления {name} из хранилища {backend.name}: {e}")
+        if deleted:
+            logging.info(f"🪣 Удалено копий из дополнительных хранилищ: {deleted}")
+
+    def cleanup_remote_backups(self):
+        """Удаление устаревших резервных копий с Google Drive"""
+        if not self.drive_service or not self.remote_retention_days:
+            return
+        if not self.DRIVE_FOLDER_ID:
+            logging.warning("⚠️ DRIVE_FOLDER_ID не задан, хранение на Google Drive не применяется")
+            return
+        
+        try:
+            # Файлы, на которые ссылаются пропущенные по MD5 загрузки, не удаляются
+            retention = DriveRetention(
+                self.drive_service, self.DRIVE_FOLDER_ID, self.remote_retention_days,
+                protected_ids=self.catalog.shared_remote_ids() | self.catalog.live_remote_ids('pack'),
+                series_of=lambda f: self.catalog.target_for_remote(f['id']) or BackupCatalog.legacy_series_key(f['name'])
+            )
+            deleted, _ = retention.apply()
+            self.catalog.mark_deleted([f['name'] for f in deleted])
+            self.remote_deleted = len(deleted)
+        except Exception as e:
+            logging.error(f"Ошибка очистки Google Drive: {e}")
+
+    def scrub_remote_backups(self, force=False):
+        """Проверка целостности копий на Google Drive без скачивания (порциями, с продолжением)"""
+        if not self.drive_service or not self.DRIVE_FOLDER_ID:
+            return None
+        if not force and not self.scrub_interval_hours:
+            return None
+        
+        scrub = RemoteScrub(
+            self.drive_service, self.DRIVE_FOLDER_ID, self.catalog,
+            os.path.join(self.BACKUP_DIR, 'scrub_state.json'),
+            files_per_run=self.scrub_files_per_run, files_per_minute=self.scrub_files_per_minute
+        )
+        if not force and not scrub.due(self.scrub_interval_hours):
+            return None
+        try:
+            return scrub.run()
+        except Exception as e:
+            logging.error(f"Ошибка проверки копий на Google Drive: {e}")
+            return None
+
+    def apply_retention(self):
+        """Ротация дед-отец-сын по каталогу: одно решение для локальных копий и копий на Google Drive"""
+        expired = []
+        kept_drive_ids = set()
+        
+        for target, backups in self.catalog.live_by_target().items():
+            keep, expire = self.gfs.select(backups)
+            kept_drive_ids.update(b['remote_id'] for b in keep if b.get('remote_id'))
+            expired.extend(expire)
+        
+        chain_keep, chain_expire = self._select_expired_chains()
+        kept_drive_ids.update(b['remote_id'] for b in chain_keep if b.get('remote_id'))
+        expired.extend(chain_expire)
+        
+        if not expired:
+            return
+        
+        removed = []
+        remote = {}
+        for backup in expired:
+            local_path = backup.get('local_path')
+            if local_path and os.path.isfile(local_path):
+                os.remove(local_path)
+            
+            # Файл на Drive может разделяться копиями, пропущенными по MD5
+            if backup.get('remote_id') and backup['remote_id'] not in kept_drive_ids:
+                remote.setdefault(backup['remote_id'], []).append(backup['name'])
+            else:
+                removed.append(backup['name'])
+        
+        if remote:
+            if self.drive_service:
+                retention = DriveRetention(self.drive_service, self.DRIVE_FOLDER_ID, 0)
+                deleted, _ = retention.delete([{'id': drive_id, 'name': names[0]} for drive_id, names in remote.items()])
+                for drive_file in deleted:
+                    removed.extend(remote[drive_file['id']])
+            else:
+                logging.warning(f"⚠️ Google Drive API недоступен, {len(remote)} устаревших копий на Drive не удалены")
+        
+        self.catalog.mark_deleted(removed)
+        self.retention_deleted = len(removed)
+        self._delete_backend_copies(removed)
+        if self.repository:
+            self._prune_repository(removed)
+        logging.info(f"🗑️ Ротация: удалено {len(removed)} устаревших копий "
+                     f"(часовые {self.gfs.limits['hourly']}, дневные {self.gfs.limits['daily']}, "
+                     f"недельные {self.gfs.limits['weekly']}, месячные {self.gfs.limits['monthly']})")
+
+    def _select_expired_chains(self):
+        """Ротация цепочек целиком: ГОС выбирает корни, звенья удаляются вместе со своим корнем"""
+        keep, expired = [], []
+        kept_roots = {}
+        protected = {}
+        roots_by_target = self.catalog.chain_roots()
+        
+        for target, roots in roots_by_target.items():
+            keep_roots, expire_roots = self.gfs.select(roots)
+            
+            # Неизменные таблицы дифференциальных копий входят и в более новые манифесты
+            protected[target] = set()
+            if roots[0]['kind'] == 'manifest':
+                table_diff = self.table_diff or PostgresTableDiff(self.BACKUP_DIR)
+                protected[target] = table_diff.referenced_files(target, [r['name'] for r in keep_roots],
+                                                                self._load_manifest)
+                if protected[target] is None:
+                    logging.warning(f"⚠️ {target}: ссылки манифестов неизвестны, устаревшие копии сохраняются")
+                    keep_roots, expire_roots = roots, []
+                else:
+                    table_diff.forget_manifests(target, [r['name'] for r in expire_roots])
+            
+            kept_roots.update((root['name'], root['finished_at']) for root in keep_roots)
+            for root in keep_roots:
+                keep.append(root)
+                keep.extend(self.catalog.children(root['name']))
+            for root in expire_roots:
+                expired.append(root)
+                for child in self.catalog.children(root['name']):
+                    (keep if child['name'] in protected[target] else expired).append(child)
+        
+        # Звенья без живого корня нужны только после самого старого сохраняемого корня своей цепочки
+        for link in self.catalog.chain_orphans():
+            target = link['target']
+            references = protected.get(target, set())
+            if references is None or link['name'] in references:
+                keep.append(link)
+                continue
+            roots = set(kept_roots) & (self.catalog.parents_of(target)
+                                       | {r['name'] for r in roots_by_target.get(target, [])})
+            if roots and link['finished_at'] < min(kept_roots[name] for name in roots):
+                expired.append(link)
+            else:
+                keep.append(link)
+        
+        return keep, expired
+
+    def _load_manifest(self, name):
+        """Манифест дифференциальной копии из локального файла или из хранилища (None - недоступен)"""
+        artefact = self.catalog.get(name)
+        if not artefact:
+            return None
+        try:
+            if artefact.get('local_path') and os.path.isfile(artefact['local_path']):
+                with open(artefact['local_path'], 'r', encoding='utf-8') as f:
+                    return json.load(f)
+            with tempfile.TemporaryDirectory(dir=self.BACKUP_DIR) as directory:
+                _, path = RestoreManager(self)._download(artefact, directory)
+                with open(path, 'r', encoding='utf-8') as f:
+                    return json.load(f)
+        except Exception as e:
+            logging.warning(f"⚠️ Не удалось прочитать манифест {name}: {e}")
+            return None
+
+    def _prune_repository(self, removed):
+        """Удаление pack-файлов, на которые не ссылается ни один из оставшихся снимков"""
+        for name in removed:
+            if name.endswith('.snap'):
+                self.repository.forget_snapshot(name)
+        packs = self.repository.prune()
+        if not packs:
+            return
+        
+        records = [r for r in (self.catalog.get(name) for name in packs) if r]
+        deleted = [r['name'] for r in records if not r.get('remote_id')]
+        remote = [{'id': r['remote_id'], 'name': r['name']} for r in records if r.get('remote_id')]
+        if remote and self.drive_service:
+            removed_remote, _ = DriveRetention(self.drive_service, self.DRIVE_FOLDER_ID, 0).delete(remote)
+            deleted.extend(f['name'] for f in removed_remote)
+        self.catalog.mark_deleted(deleted)
+        self._delete_backend_copies(packs)
+        logging.info(f"🧩 Репозиторий: удалено {len(packs)} pack-файлов без ссылок")
+
+    def _keep_local_after_upload(self, path):
+        """pack-файлы репозитория нужны локально всегда, остальные - пока помещаются в кэш"""
+        if os.path.basename(path).startswith('pack_') and path.endswith('.pack'):
+            return True
+        return self.local_cache.admit(path)
+
     def cleanup_old_backups(self, keep_days=7):
         """Очистка старых резервных копий"""
         try:
             current_time = time.time()
             cutoff_time = current_time - (keep_days * 24 * 60 * 60)
             
-            for filename in os.listdir(self.BACKUP_DIR):
-                file_path = os.path.join(self.BACKUP_DIR, filename)
+            # Локальные копии ищутся по каталогу, служебные файлы в BACKUP_DIR не затрагиваются
+            removed = []
+            for name, file_path in self.catalog.local_before(cutoff_time):
                 if os.path.isfile(file_path):
-                    file_time = os.path.getctime(file_path)
-                    if file_time < cutoff_time:
-                        os.remove(file_path)
-                        logging.info(f"Удален старый файл: {filename}")
+                    os.remove(file_path)
+                    logging.info(f"Удален старый файл: {name}")
+                removed.append(name)
+            self.catalog.clear_local(removed)
                         
         except Exception as e:
             logging.error(f"Ошибка очистки старых файлов: {e}")
@@ -2507,6 +8368,7 @@ class UniversalBackup:
         logging.info("=" * 80)
         
         start_time = datetime.now()
+        self.run_id = start_time.strftime('%Y%m%d_%H%M%S')
         
         # Этап 1: Обнаружение всех БД
         databases = self.discover_all_databases()
@@ -2521,6 +8383,36 @@ class UniversalBackup:
         successful_backups = 0
         successful_uploads = 0
         failed_backups = []
+        self.skipped_unchanged = []
+        self.deduplicated_uploads = []
+        self.remote_deleted = 0
+        self.retention_deleted = 0
+        if self.repository:
+            self.repository.stats = dict.fromkeys(self.repository.stats, 0)
+        self.streamed_uploads = 0
+        self.stream_failures = []
+        self.local_cache.evicted = 0
+        self.governor.decisions = []
+        self.governor.waited = 0.0
+        self.deadlines.cancelled = []
+        self.compression.pending_tuning.clear()
+        
+        # Загрузка и проверка копий идут параллельно с дампами следующих БД
+        self.submitted_files = set()
+        self.verifier = BackupVerifier(self.verify_workers, self.BACKUP_DIR) if self.verify_backups else None
+        self.pipeline = UploadPipeline(
+            self.upload_to_storage, self.inventory.forget_file, self.BACKUP_DIR,
+            workers=self.upload_workers, queue_size=self.upload_queue_size,
+            max_pending_bytes=self.max_pending_bytes, min_free_bytes=self.min_free_bytes,
+            keep_local=self._keep_local_after_upload
+        ) if self.drive_service or self.storage_backends else None
+        if self.pipeline:
+            self.pipeline.start()
+            self.resume_pending_uploads()
+            if self.repository:
+                for path in self.repository.recovered:
+                    self._file_ready(path, 'repository', kind='pack', chain=True)
+                self.repository.recovered = []
         
         # Этап 2: Создание резервных копий для каждой БД
         for i, db_info in enumerate(databases, 1):
@@ -2538,7 +8430,18 @@ class UniversalBackup:
                 logging.info(f"   - {db_name_item}")
             
             try:
-                backup_files = self.backup_database(db_info)
+                if self.pipeline:
+                    self.pipeline.wait_for_capacity()
+                
+                skipped_before = len(self.skipped_unchanged)
+                try:
+                    backup_files = self.backup_database(db_info)
+                finally:
+                    self.deadlines.current = None
+                skipped = len(self.skipped_unchanged) - skipped_before
+                
+                if skipped:
+                    logging.info(f"⏭️ Пропущено без изменений: {skipped}")
                 
                 if backup_files:
                     total_backups += len(backup_files)
@@ -2546,30 +8449,13 @@ class UniversalBackup:
                     
                     logging.info(f"✅ Создано {len(backup_files)} резервных копий")
                     
-                    # Загрузка на Google Drive
-                    if self.drive_service:
-                        for backup_file in backup_files:
-                            try:
-                                if self.upload_to_drive(backup_file):
-                                    successful_uploads += 1
-                                    logging.info(f"☁️ Загружено на Google Drive: {os.path.basename(backup_file)}")
-                                    
-                                    # Удаление локального файла после успешной загрузки
-                                    try:
-                                        if os.path.isfile(backup_file):
-                                            os.remove(backup_file)
-                                        elif os.path.isdir(backup_file):
-                                            import shutil
-                                            shutil.rmtree(backup_file)
-                                        logging.debug(f"🗑️ Локальный файл удален: {backup_file}")
-                                    except Exception as e:
-                                        logging.error(f"Ошибка удаления локального файла: {e}")
-                                else:
-                                    logging.error(f"❌ Ошибка загрузки на Google Drive: {os.path.basename(backup_file)}")
-                            except Exception as e:
-                                logging.error(f"❌ Ошибка обработки файла {backup_file}: {e}")
-                    else:
-                        logging.warning("⚠️ Google Drive API недоступен, файлы сохранены локально")
+                    # Загрузка в хранилища (файлы, еще не переданные в конвейер по мере создания)
+                    for backup_file in backup_files:
+                        self._file_ready(backup_file, engine=db_info['type'])
+                    if not self.pipeline:
+                        logging.warning("⚠️ Хранилища копий недоступны, файлы сохранены локально")
+                elif skipped:
+                    logging.info("✅ Все базы данных без изменений, резервные копии актуальны")
                 else:
                     logging.error(f"❌ Не удалось создать резервные копии для {db_name}")
                     failed_backups.append(db_name)
@@ -2578,9 +8464,50 @@ class UniversalBackup:
                 logging.error(f"❌ Критическая ошибка при резервном копировании {db_name}: {e}")
                 failed_backups.append(db_name)
         
+        if self.repository:
+            self.repository.seal()
+        
+        # Сессии неудавшихся дампов отменяются, чтобы на Drive не осталось незавершенных загрузок
+        for sink, _ in self.remote_streams.values():
+            sink.abort()
+        self.remote_streams = {}
+        
+        if self.pipeline:
+            logging.info("\n☁️ Ожидание завершения загрузок...")
+            self.pipeline.close()
+            successful_uploads = self.pipeline.uploaded
+            self.pipeline = None
+        successful_uploads += self.streamed_uploads
+        for failure in self.stream_failures:
+            successful_backups = max(successful_backups - 1, 0)
+            failed_backups.append(failure)
+        
+        verification = None
+        if self.verifier:
+            verification = self.verifier.close()
+            self.verifier = None
+            for result in verification['results']:
+                if result['ok'] is not None:
+                    self.catalog.mark_verified(result['file'], result['ok'])
+            # Копия, не прошедшая проверку, не считается созданной
+            for result in verification['failed']:
+                successful_backups = max(successful_backups - 1, 0)
+                failed_backups.append(f"{result['file']} (проверка {result['check']}: {result['detail']})")
+        
+        manifest_path = self.write_run_manifest()
+        
         # Этап 3: Очистка старых файлов
         logging.info("\n🧹 Очистка старых резервных копий...")
-        self.cleanup_old_backups()
+        if self.retention_policy == 'gfs':
+            self.apply_retention()
+        else:
+            self.cleanup_old_backups(self.retention_days)
+        self.cleanup_remote_backups()
+        scrub_report = self.scrub_remote_backups()
+        cache_usage = None
+        if self.local_cache.enabled:
+            self.local_cache.evict()
+            cache_usage = self.local_cache.usage()
         
         # Этап 4: Итоговая статистика
         end_time = datetime.now()
@@ -2593,6 +8520,28 @@ class UniversalBackup:
         logging.info(f"🔍 СУБД обнаружено: {len(databases)}")
         logging.info(f"💾 Резервных копий создано: {successful_backups}/{total_backups}")
         logging.info(f"☁️ Файлов загружено на Drive: {successful_uploads}")
+        logging.info(f"⏭️ Пропущено без изменений: {len(self.skipped_unchanged)}")
+        logging.info(f"♻️ Загрузок пропущено (MD5 совпал): {len(self.deduplicated_uploads)}")
+        throttling = self.governor.summary()
+        if throttling['counts']:
+            logging.info("🐢 Регулятор нагрузки: " + ', '.join(f"{action} {count}"
+                                                             for action, count in throttling['counts'].items()))
+        if cache_usage:
+            logging.info(f"📦 Локальный кэш: {cache_usage['files']} файлов, "
+                         f"{cache_usage['bytes'] / (1024 * 1024):.1f} MB из "
+                         f"{cache_usage['budget_bytes'] / (1024 * 1024):.0f} MB")
+        if verification:
+            logging.info(f"🔎 Проверено копий: {verification['passed']}/{verification['checked']}, "
+                         f"с ошибками: {len(verification['failed'])}")
+        
+        catalog_summary = self.catalog.run_summary(self.run_id)
+        logging.info(f"🗂️ Каталог: {catalog_summary['artefacts']} артефактов, "
+                     f"{catalog_summary['bytes'] / (1024 * 1024):.1f} MB, на Drive: {catalog_summary['uploaded']}")
+        
+        if self.deadlines.cancelled:
+            logging.warning(f"⏹️ Дампы, отмененные по лимиту времени ({len(self.deadlines.cancelled)}):")
+            for job in self.deadlines.cancelled:
+                logging.warning(f"   - {job['job']}: {job['reason']}")
         
         if failed_backups:
             logging.warning(f"❌ Ошибки резервного копирования ({len(failed_backups)}):")
@@ -2608,6 +8557,19 @@ class UniversalBackup:
             'databases_discovered': len(databases),
             'backups_created': successful_backups,
             'backups_uploaded': successful_uploads,
+            'streamed_uploads': self.streamed_uploads,
+            'skipped_unchanged': self.skipped_unchanged,
+            'deduplicated_uploads': self.deduplicated_uploads,
+            'remote_deleted': self.remote_deleted,
+            'retention_deleted': self.retention_deleted,
+            'catalog': catalog_summary,
+            'verification': verification,
+            'manifest': os.path.basename(manifest_path) if manifest_path else None,
+            'remote_scrub': scrub_report,
+            'repository': self.repository.run_summary() if self.repository else None,
+            'local_cache': cache_usage,
+            'throttling': throttling,
+            'cancelled_jobs': self.deadlines.cancelled,
             'failed_backups': failed_backups,
             'success_rate': (successful_backups / total_backups * 100) if total_backups > 0 else 0
         })
@@ -2848,6 +8810,18 @@ def main():
                        help='Интервал резервного копирования в минутах (по умолчанию: 30)')
     parser.add_argument('--config', type=str, default='.env',
                        help='Путь к файлу конфигурации (по умолчанию: .env)')
+    parser.add_argument('--restore', type=str, metavar='TARGET',
+                       help='Восстановление цели из каталога (ключ цели или его часть)')
+    parser.add_argument('--restore-time', type=str, metavar='"YYYY-MM-DD HH:MM[:SS]"',
+                       help='Момент времени для восстановления (по умолчанию: последняя копия)')
+    parser.add_argument('--restore-to', type=str,
+                       help='Место восстановления: имя БД, путь к файлу или каталог данных PostgreSQL')
+    parser.add_argument('--jobs', type=int, default=4,
+                       help='Параллельность загрузки и восстановления (по умолчанию: 4)')
+    parser.add_argument('--verify-manifest', type=str, metavar='FILE',
+                       help='Проверка подписи манифеста запуска и локальных копий по контрольным суммам')
+    parser.add_argument('--scrub', action='store_true',
+                       help='Проверка копий на Google Drive по размеру и MD5 без скачивания')
     parser.add_argument('--log-level', choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], 
                        default='INFO', help='Уровень логирования')
     
@@ -2871,7 +8845,35 @@ def main():
     
     backup_manager = UniversalBackup()
     
-    if args.scan_only:
+    if args.restore:
+        # Восстановление из резервной копии
+        logging.info("♻️ Режим: восстановление")
+        until = None
+        if args.restore_time:
+            until = datetime.fromisoformat(args.restore_time).timestamp()
+        backup_manager.auto_credentials = backup_manager.auto_discover_credentials()
+        restorer = RestoreManager(backup_manager, jobs=args.jobs)
+        report = restorer.restore(args.restore, until=until, destination=args.restore_to)
+        
+        report_file = os.path.join(backup_manager.BACKUP_DIR, 'restore_statistics.json')
+        history = []
+        if os.path.exists(report_file):
+            with open(report_file, 'r', encoding='utf-8') as f:
+                history = json.load(f)
+        with open(report_file, 'w', encoding='utf-8') as f:
+            json.dump((history + [report])[-100:], f, indent=2, ensure_ascii=False)
+        
+    elif args.verify_manifest:
+        # Проверка копий по манифесту запуска
+        logging.info("🧾 Режим: проверка манифеста")
+        backup_manager.verify_manifest(args.verify_manifest)
+        
+    elif args.scrub:
+        # Проверка копий на Google Drive (очередная порция, независимо от интервала)
+        logging.info("🔬 Режим: проверка копий на Google Drive")
+        backup_manager.scrub_remote_backups(force=True)
+        
+    elif args.scan_only:
         # Только сканирование
         logging.info("🔍 Режим: только сканирование БД")
         backup_manager.discover_all_databases()
@@ -2899,6 +8901,7 @@ def main():
         logging.info(f"Резервное копирование каждые {args.interval} минут")
         
         # Выполнение первого обнаружения и бэкапа
+        backup_manager.daemon_mode = True
         backup_manager.run_full_backup()
         
         # Основной цикл
@@ -2908,6 +8911,8 @@ def main():
                 time.sleep(60)  # Проверка каждую минуту
         except KeyboardInterrupt:
             logging.info("Демон остановлен пользователем")
+        finally:
+            backup_manager.shutdown()
 
 if __name__ == "__main__":
     try:
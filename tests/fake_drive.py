@@ -0,0 +1,97 @@
+"""Поддельный сервис Google Drive API для тестов хранения и проверки копий"""
+
+from datetime import datetime, timedelta, timezone
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+FOLDER = 'folder-1'
+
+
+def http_error(status):
+    return HttpError(httplib2.Response({'status': status}), b'{}')
+
+
+class FakeRequest:
+
+    def __init__(self, action):
+        self.action = action
+
+    def execute(self):
+        return self.action()
+
+
+class FakeBatch:
+
+    def __init__(self, drive, callback):
+        self.drive = drive
+        self.callback = callback
+        self.requests = []
+
+    def add(self, request, request_id):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        assert len(self.requests) <= 100, 'в пакете Drive API не больше 100 запросов'
+        self.drive.batches.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, request.execute(), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+class FakeDrive:
+    """files().list/get/delete и пакетные запросы поверх словаря stored; failures - ошибки удаления по id"""
+
+    def __init__(self, files):
+        self.stored = {f['id']: dict(f) for f in files}
+        self.failures = {}
+        self.batches = []
+        self.list_calls = []
+        self.expired_tokens = set()
+
+    def files(self):
+        return self
+
+    def list(self, q, fields, pageSize, pageToken=None, orderBy=None):
+        assert q == f"'{FOLDER}' in parents and trashed = false"
+
+        def action():
+            self.list_calls.append(pageToken)
+            if pageToken in self.expired_tokens:
+                raise http_error(400)
+            ordered = sorted(self.stored.values(), key=lambda f: f['name'] if orderBy == 'name' else f['id'])
+            start = int(pageToken or 0)
+            response = {'files': [dict(f) for f in ordered[start:start + pageSize]]}
+            if start + pageSize < len(ordered):
+                response['nextPageToken'] = str(start + pageSize)
+            return response
+        return FakeRequest(action)
+
+    def get(self, fileId, fields):
+        def action():
+            if fileId not in self.stored:
+                raise http_error(404)
+            return dict(self.stored[fileId])
+        return FakeRequest(action)
+
+    def delete(self, fileId):
+        def action():
+            statuses = self.failures.get(fileId)
+            if statuses:
+                raise http_error(statuses.pop(0))
+            if fileId not in self.stored:
+                raise http_error(404)
+            del self.stored[fileId]
+            return ''
+        return FakeRequest(action)
+
+    def new_batch_http_request(self, callback):
+        return FakeBatch(self, callback)
+
+
+def drive_file(file_id, name, age_days, size=100, md5=None):
+    created = datetime.now(timezone.utc) - timedelta(days=age_days)
+    return {'id': file_id, 'name': name, 'createdTime': created.strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            'size': str(size), 'md5Checksum': md5 or f"md5-{file_id}"}
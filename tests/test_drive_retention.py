@@ -0,0 +1,92 @@
+"""Хранение копий на Google Drive: постраничный список, пакетное удаление и повторы"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backup_script import DriveRetention  # noqa: E402
+from fake_drive import FOLDER, FakeDrive, drive_file  # noqa: E402
+
+
+class DriveRetentionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sleeps = []
+
+    def retention(self, drive, **kwargs):
+        return DriveRetention(drive, FOLDER, keep_days=7, sleep=self.sleeps.append, **kwargs)
+
+    def test_list_files_follows_pages(self):
+        drive = FakeDrive([drive_file(f"f{i:04d}", f"db_{i:04d}_20260101_000000.sql.gz", 1) for i in range(2500)])
+
+        files = self.retention(drive).list_files()
+
+        self.assertEqual(len(files), 2500)
+        self.assertEqual(drive.list_calls, [None, '1000', '2000'])
+
+    def test_select_expired_keeps_protected_and_latest_per_series(self):
+        files = [
+            drive_file('a-old', 'pg_a_20260101_000000.sql.gz', 30),
+            drive_file('a-older', 'pg_a_20251201_000000.sql.gz', 60),
+            drive_file('a-new', 'pg_a_20260301_000000.sql.gz', 1),
+            drive_file('b-only', 'pg_b_20251101_000000.sql.gz', 90),
+            drive_file('c-protected', 'pg_c_20251101_000000.sql.gz', 90),
+            drive_file('c-new', 'pg_c_20260301_000000.sql.gz', 2),
+        ]
+
+        expired = self.retention(FakeDrive(files), protected_ids=['c-protected']).select_expired(files)
+
+        self.assertEqual(sorted(f['id'] for f in expired), ['a-old', 'a-older'])
+
+    def test_delete_in_batches_of_100(self):
+        files = [drive_file(f"f{i:03d}", f"db_{i:03d}.sql.gz", 30) for i in range(250)]
+        drive = FakeDrive(files)
+
+        deleted, failed = self.retention(drive).delete(files)
+
+        self.assertEqual(drive.batches, [100, 100, 50])
+        self.assertEqual(len(deleted), 250)
+        self.assertEqual(failed, [])
+        self.assertEqual(drive.stored, {})
+        self.assertEqual(self.sleeps, [])
+
+    def test_delete_backs_off_on_rate_limits_and_server_errors(self):
+        files = [drive_file(f"f{i}", f"db_{i}.sql.gz", 30) for i in range(6)]
+        drive = FakeDrive(files)
+        drive.failures = {'f0': [429], 'f1': [403, 503], 'f2': [500], 'f3': [400]}
+        del drive.stored['f4']
+
+        deleted, failed = self.retention(drive).delete(files)
+
+        self.assertEqual(sorted(f['id'] for f in deleted), ['f0', 'f1', 'f2', 'f4', 'f5'])
+        self.assertEqual([f['id'] for f in failed], ['f3'])
+        self.assertEqual(self.sleeps, [1, 2])
+        self.assertEqual(drive.batches, [6, 3, 1])
+
+    def test_delete_gives_up_after_max_retries(self):
+        files = [drive_file('f0', 'db_0.sql.gz', 30)]
+        drive = FakeDrive(files)
+        drive.failures = {'f0': [503] * 10}
+
+        deleted, failed = self.retention(drive, max_retries=3).delete(files)
+
+        self.assertEqual(deleted, [])
+        self.assertEqual([f['id'] for f in failed], ['f0'])
+        self.assertEqual(self.sleeps, [1, 2, 4])
+
+    def test_apply_deletes_only_expired(self):
+        files = [drive_file('old', 'pg_a_20250101_000000.sql.gz', 40),
+                 drive_file('new', 'pg_a_20260101_000000.sql.gz', 1)]
+        drive = FakeDrive(files)
+
+        deleted, failed = self.retention(drive).apply()
+
+        self.assertEqual([f['id'] for f in deleted], ['old'])
+        self.assertEqual(list(drive.stored), ['new'])
+
+
+if __name__ == '__main__':
+    unittest.main()
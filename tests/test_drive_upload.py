@@ -0,0 +1,218 @@
+"""Продолжение resumable-загрузки на Google Drive после перезапуска на заглушке endpoint загрузки"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+import tempfile
+import threading
+import types
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+import googleapiclient
+from google.auth.credentials import AnonymousCredentials
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import build_http
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_script import BandwidthLimiter, DriveStorageBackend, UploadJournal  # noqa: E402
+
+CHUNK = 256 * 1024
+
+
+class DriveUploadStub(BaseHTTPRequestHandler):
+    """Resumable-загрузка Drive API v3: создание сессии, фрагменты с Content-Range, запрос статуса, files.list"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if body is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _finish(self, session):
+        file_id = f"file-{len(self.state['files']) + 1}"
+        data = bytes(session['data'])
+        self.state['files'][file_id] = {'id': file_id, 'name': session['name'], 'data': data,
+                                        'md5Checksum': hashlib.md5(data).hexdigest()}
+        session['file'] = file_id
+        return {'id': file_id, 'md5Checksum': hashlib.md5(data).hexdigest()}
+
+    def _received(self, session):
+        return {'Range': f"bytes=0-{len(session['data']) - 1}"} if session['data'] else {}
+
+    def do_POST(self):
+        split = urlsplit(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if split.path != '/upload/drive/v3/files' or dict(parse_qsl(split.query)).get('uploadType') != 'resumable':
+            return self._reply(404, {'error': 'not found'})
+        session_id = f"session-{len(self.state['sessions']) + 1}"
+        self.state['sessions'][session_id] = {'name': json.loads(body)['name'], 'data': bytearray(),
+                                              'status': None, 'file': None}
+        location = f"http://127.0.0.1:{self.server.server_port}/upload/session/{session_id}"
+        return self._reply(200, {}, {'Location': location})
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        session = self.state['sessions'].get(urlsplit(self.path).path.rsplit('/', 1)[-1])
+        if session is None:
+            return self._reply(404, {'error': 'no such session'})
+        if session['status']:
+            return self._reply(session['status'], {'error': 'session expired'})
+
+        content_range = self.headers['Content-Range']
+        self.state['ranges'].append(content_range)
+        if content_range.startswith('bytes */'):
+            # Запрос статуса сессии
+            if session['file']:
+                file = self.state['files'][session['file']]
+                resource = {'id': file['id'], 'md5Checksum': file['md5Checksum']}
+                return self._reply(200, resource if self.state['completed_body'] else {})
+            return self._reply(308, headers=self._received(session))
+
+        start, end, total = map(int, re.match(r'bytes (\d+)-(\d+)/(\d+)', content_range).groups())
+        if start != len(session['data']) or end - start + 1 != len(body):
+            return self._reply(400, {'error': 'bad range'})
+        session['data'] += body
+        if len(session['data']) == total:
+            return self._reply(200, self._finish(session))
+        return self._reply(308, headers=self._received(session))
+
+    def do_GET(self):
+        split = urlsplit(self.path)
+        if split.path != '/drive/v3/files':
+            return self._reply(404, {'error': 'not found'})
+        name = re.search(r"name = '((?:[^'\\]|\\.)*)'", dict(parse_qsl(split.query))['q']).group(1)
+        files = [{k: f[k] for k in ('id', 'name', 'md5Checksum')} for f in self.state['files'].values()
+                 if f['name'] == name.replace("\\'", "'")]
+        return self._reply(200, {'files': list(reversed(files))})
+
+
+class DriveResumableUploadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), DriveUploadStub)
+        self.server.state = {'sessions': {}, 'files': {}, 'ranges': [], 'completed_body': True}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+        document_path = os.path.join(os.path.dirname(googleapiclient.__file__), 'discovery_cache',
+                                     'documents', 'drive.v3.json')
+        with open(document_path, 'r', encoding='utf-8') as f:
+            document = json.load(f)
+        document['rootUrl'] = f"http://127.0.0.1:{self.server.server_port}/"
+        document['baseUrl'] = document['rootUrl'] + document['servicePath']
+        service = build_from_document(document, http=build_http())
+
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.temp_dir.name, 'dump.sql.gz')
+        self.data = os.urandom(4 * CHUNK + 1000)
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+
+        self.backup = types.SimpleNamespace(
+            upload_chunk_size=CHUNK, DRIVE_FOLDER_ID=None, drive_local=threading.local(),
+            drive_credentials=AnonymousCredentials(), upload_limiter=BandwidthLimiter(0),
+            upload_journal=UploadJournal(os.path.join(self.temp_dir.name, 'upload_journal.json')),
+            compression=types.SimpleNamespace(tuner=None), _thread_drive_service=lambda: service)
+        self.backend = DriveStorageBackend(self.backup)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.temp_dir.cleanup()
+
+    def _interrupted_session(self, received):
+        """Сессия, прерванная перезапуском после received байт, и запись о ней в журнале"""
+        session_id = f"session-{len(self.server.state['sessions']) + 1}"
+        self.server.state['sessions'][session_id] = {'name': 'dump.sql.gz', 'data': bytearray(self.data[:received]),
+                                                     'status': None, 'file': None}
+        uri = f"http://127.0.0.1:{self.server.server_port}/upload/session/{session_id}"
+        self.backup.upload_journal.update(self.path, uri, received)
+        return self.server.state['sessions'][session_id]
+
+    def _put(self):
+        with open(self.path, 'rb') as source:
+            return self.backend.put(source, 'dump.sql.gz', size=len(self.data), journal_key=self.path)
+
+    def test_fresh_upload_in_chunks(self):
+        result = self._put()
+
+        self.assertEqual(result, {'id': 'file-1', 'size': len(self.data), 'md5': hashlib.md5(self.data).hexdigest()})
+        self.assertEqual(len(self.server.state['ranges']), 5)
+        self.assertIsNone(self.backup.upload_journal.get(self.path))
+
+    def test_resume_from_confirmed_offset(self):
+        session = self._interrupted_session(2 * CHUNK)
+
+        result = self._put()
+
+        self.assertEqual(self.server.state['ranges'][0], f"bytes */{len(self.data)}")
+        self.assertTrue(self.server.state['ranges'][1].startswith(f"bytes {2 * CHUNK}-"))
+        self.assertEqual(len(self.server.state['sessions']), 1)
+        self.assertEqual(bytes(session['data']), self.data)
+        self.assertEqual(result['id'], session['file'])
+        self.assertEqual(result['md5'], hashlib.md5(self.data).hexdigest())
+        self.assertIsNone(self.backup.upload_journal.get(self.path))
+
+    def test_expired_session_restarts_upload(self):
+        for status in (404, 410):
+            with self.subTest(status=status):
+                self.server.state['sessions'].clear()
+                self.server.state['files'].clear()
+                self._interrupted_session(CHUNK)['status'] = status
+
+                result = self._put()
+
+                self.assertEqual(len(self.server.state['sessions']), 2)
+                self.assertEqual(self.server.state['files'][result['id']]['data'], self.data)
+                self.assertIsNone(self.backup.upload_journal.get(self.path))
+
+    def test_completed_session_returns_uploaded_file(self):
+        session = self._interrupted_session(len(self.data))
+        uploaded = self._finish_session(session)
+
+        result = self._put()
+
+        self.assertEqual(result, {'id': uploaded, 'size': len(self.data), 'md5': hashlib.md5(self.data).hexdigest()})
+        self.assertEqual(len(self.server.state['sessions']), 1)
+        self.assertEqual(len(self.server.state['files']), 1)
+        self.assertIsNone(self.backup.upload_journal.get(self.path))
+
+    def test_completed_session_without_resource_found_by_name(self):
+        session = self._interrupted_session(len(self.data))
+        self.server.state['completed_body'] = False
+        uploaded = self._finish_session(session)
+
+        result = self._put()
+
+        self.assertEqual(result['id'], uploaded)
+        self.assertEqual(result['md5'], hashlib.md5(self.data).hexdigest())
+        self.assertEqual(len(self.server.state['files']), 1)
+
+    def _finish_session(self, session):
+        file_id = f"file-{len(self.server.state['files']) + 1}"
+        self.server.state['files'][file_id] = {'id': file_id, 'name': session['name'], 'data': self.data,
+                                               'md5Checksum': hashlib.md5(self.data).hexdigest()}
+        session['file'] = file_id
+        return file_id
+
+
+if __name__ == '__main__':
+    unittest.main()
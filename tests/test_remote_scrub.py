@@ -0,0 +1,99 @@
+"""Проверка копий на Google Drive по метаданным с продолжением цикла между запусками"""
+
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from backup_script import BackupCatalog, RemoteScrub  # noqa: E402
+from fake_drive import FOLDER, FakeDrive, drive_file  # noqa: E402
+
+
+class RemoteScrubTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.catalog = BackupCatalog(os.path.join(self.temp_dir.name, 'catalog.db'))
+        self.state_file = os.path.join(self.temp_dir.name, 'scrub_state.json')
+        self.sleeps = []
+
+        # Записи каталога: размер и MD5 на момент загрузки
+        self.files = []
+        for file_id, size, md5 in [('ok-1', 100, 'aaa'), ('ok-2', 200, 'bbb'), ('short', 300, 'ccc'),
+                                   ('changed', 400, 'ddd'), ('gone', 500, 'eee'), ('ok-3', 600, 'fff')]:
+            name = f"pg_{file_id}_20260101_000000.sql.gz"
+            self.catalog.register(os.path.join(self.temp_dir.name, name), 'postgresql:db', size=size, md5=md5)
+            self.catalog.mark_uploaded(name, file_id)
+            self.files.append(drive_file(file_id, name, 1, size, md5))
+        time.sleep(0.01)
+
+        remote = {f['id']: f for f in self.files}
+        remote['short']['size'] = '120'
+        remote['changed']['md5Checksum'] = 'zzz'
+        del remote['gone']
+        remote['stray'] = drive_file('stray', 'manual_upload.tar', 1)
+        self.drive = FakeDrive(remote.values())
+
+    def tearDown(self):
+        self.catalog.conn.close()
+        self.temp_dir.cleanup()
+
+    def scrub(self, files_per_run=1000):
+        return RemoteScrub(self.drive, FOLDER, self.catalog, self.state_file, files_per_run=files_per_run,
+                           files_per_minute=600, sleep=self.sleeps.append)
+
+    def test_full_cycle_flags_missing_truncated_and_mismatched(self):
+        report = self.scrub().run()
+
+        self.assertTrue(report['cycle_complete'])
+        self.assertEqual(report['counts'], {'ok': 3, 'truncated': 1, 'mismatch': 1, 'missing': 1, 'untracked': 1})
+        self.assertEqual(sorted((f['id'], f['status']) for f in report['findings']),
+                         [('changed', 'mismatch'), ('gone', 'missing'), ('short', 'truncated')])
+        self.assertEqual(self.catalog.uploaded_record('gone')['scrub_status'], 'missing')
+        self.assertEqual(self.catalog.uploaded_record('ok-1')['scrub_status'], 'ok')
+        self.assertFalse(self.scrub().due(24))
+
+    def test_resume_across_runs(self):
+        first = self.scrub(files_per_run=2).run()
+        self.assertFalse(first['cycle_complete'])
+        self.assertEqual(first['checked'], 2)
+        self.assertEqual(self.sleeps, [0.2])
+        self.assertTrue(self.scrub().due(24))
+
+        reports = [first]
+        while not reports[-1]['cycle_complete']:
+            reports.append(self.scrub(files_per_run=2).run())
+
+        self.assertEqual(len(reports), 3)
+        self.assertEqual(self.drive.list_calls, [None, '2', '4'])
+        self.assertEqual(sum(r['checked'] for r in reports), 6)
+        self.assertEqual(sorted(f['status'] for f in reports[-1]['findings']), ['mismatch', 'missing', 'truncated'])
+
+    def test_expired_page_token_restarts_cycle(self):
+        self.scrub(files_per_run=2).run()
+        self.drive.expired_tokens.add('2')
+
+        report = self.scrub(files_per_run=10).run()
+
+        self.assertTrue(report['cycle_complete'])
+        self.assertEqual(self.drive.list_calls, [None, '2', None])
+        self.assertEqual(len(report['findings']), 3)
+
+    def test_unlisted_file_is_checked_by_id(self):
+        record = self.catalog.uploaded_record('gone')
+        scrub = self.scrub()
+        self.assertEqual(scrub._confirm_missing(record), ('missing', None))
+
+        # Файл мог появиться после прохода списка или оказаться в корзине
+        self.drive.stored['gone'] = drive_file('gone', record['name'], 1, 500, 'eee')
+        self.assertEqual(scrub._confirm_missing(record), ('ok', None))
+        self.drive.stored['gone']['trashed'] = True
+        self.assertEqual(scrub._confirm_missing(record), ('missing', 'в корзине'))
+
+
+if __name__ == '__main__':
+    unittest.main()
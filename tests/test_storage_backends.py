@@ -0,0 +1,278 @@
+"""Хранилища копий: локальный каталог и S3-совместимое хранилище на заглушке в духе MinIO"""
+
+import base64
+import hashlib
+import hmac
+import io
+import os
+import re
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, quote, unquote, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backup_script import LocalStorageBackend, S3StorageBackend  # noqa: E402
+
+ACCESS_KEY = 'minio'
+SECRET_KEY = 'minio-secret'
+REGION = 'us-east-1'
+BUCKET = 'backups'
+MB = 1024 * 1024
+
+
+class S3Stub(BaseHTTPRequestHandler):
+    """Минимальный S3 API: PUT/HEAD/GET/DELETE, multipart, ListObjectsV2 с постраничной выдачей
+
+    Как MinIO, заглушка проверяет подпись Signature V4 и Content-MD5 каждой части.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    server_version = 'MinIO-stub'
+
+    def log_message(self, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def _reply(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if 'Content-Length' not in (headers or {}):
+            self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _signature_valid(self):
+        match = re.match(r'AWS4-HMAC-SHA256 Credential=([^/]+)/(\d{8})/([^/]+)/s3/aws4_request, '
+                         r'SignedHeaders=([^,]+), Signature=(\w+)$', self.headers.get('authorization', ''))
+        if not match or match.group(1) != ACCESS_KEY:
+            return False
+        day, region, signed, signature = match.group(2, 3, 4, 5)
+        split = urlsplit(self.path)
+        query = '&'.join(f"{quote(k, safe='-_.~')}={quote(v, safe='-_.~')}"
+                         for k, v in sorted(parse_qsl(split.query, keep_blank_values=True)))
+        canonical = '\n'.join([
+            self.command, split.path, query,
+            ''.join(f"{name}:{self.headers[name].strip()}\n" for name in signed.split(';')),
+            signed, self.headers['x-amz-content-sha256']
+        ])
+        amz_date = self.headers['x-amz-date']
+        scope = f"{day}/{region}/s3/aws4_request"
+        string_to_sign = '\n'.join(['AWS4-HMAC-SHA256', amz_date, scope,
+                                    hashlib.sha256(canonical.encode()).hexdigest()])
+        key = ('AWS4' + SECRET_KEY).encode()
+        for part in (day, region, 's3', 'aws4_request'):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        return hmac.compare_digest(hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest(), signature)
+
+    def _handle(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        if not self._signature_valid():
+            return self._reply(403, b'<Error><Code>SignatureDoesNotMatch</Code></Error>')
+
+        split = urlsplit(self.path)
+        params = dict(parse_qsl(split.query, keep_blank_values=True))
+        bucket, _, key = unquote(split.path).lstrip('/').partition('/')
+        if bucket != BUCKET:
+            return self._reply(404, b'<Error><Code>NoSuchBucket</Code></Error>')
+        objects, uploads = self.state['objects'], self.state['uploads']
+
+        if 'content-md5' in self.headers:
+            if base64.b64encode(hashlib.md5(body).digest()).decode() != self.headers['content-md5']:
+                return self._reply(400, b'<Error><Code>BadDigest</Code></Error>')
+
+        if self.command == 'PUT' and 'partNumber' in params:
+            with self.server.lock:
+                self.state['active'] += 1
+                self.state['max_active'] = max(self.state['max_active'], self.state['active'])
+            time.sleep(0.05)
+            with self.server.lock:
+                self.state['active'] -= 1
+                fail = self.state['fail_parts'] > 0
+                if fail:
+                    self.state['fail_parts'] -= 1
+            if fail:
+                return self._reply(503, b'<Error><Code>SlowDown</Code></Error>')
+            uploads[params['uploadId']]['parts'][int(params['partNumber'])] = body
+            return self._reply(200, headers={'ETag': f'"{hashlib.md5(body).hexdigest()}"'})
+
+        if self.command == 'PUT':
+            etag = hashlib.md5(body).hexdigest()
+            objects[key] = {'data': body, 'etag': etag, 'md5': self.headers.get('x-amz-meta-md5')}
+            return self._reply(200, headers={'ETag': f'"{etag}"'})
+
+        if self.command == 'POST' and 'uploads' in params:
+            upload_id = f"upload-{len(uploads) + 1}"
+            uploads[upload_id] = {'key': key, 'parts': {}, 'md5': self.headers.get('x-amz-meta-md5')}
+            return self._reply(200, (f'<InitiateMultipartUploadResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                                     f'<UploadId>{upload_id}</UploadId></InitiateMultipartUploadResult>').encode())
+
+        if self.command == 'POST' and 'uploadId' in params:
+            upload = uploads.pop(params['uploadId'])
+            numbers = [int(n) for n in re.findall(rb'<PartNumber>(\d+)</PartNumber>', body)]
+            etags = re.findall(rb'<ETag>"?(\w+)"?</ETag>', body)
+            parts = [upload['parts'][n] for n in numbers]
+            if [hashlib.md5(p).hexdigest().encode() for p in parts] != etags:
+                return self._reply(200, b'<Error><Code>InvalidPart</Code></Error>')
+            objects[key] = {'data': b''.join(parts), 'etag': f"multipart-{len(parts)}", 'md5': upload['md5']}
+            return self._reply(200, b'<CompleteMultipartUploadResult/>')
+
+        if self.command == 'DELETE' and 'uploadId' in params:
+            self.state['aborted'].append(uploads.pop(params['uploadId'])['key'])
+            return self._reply(204)
+
+        if self.command == 'DELETE':
+            objects.pop(key, None)
+            return self._reply(204)
+
+        if self.command == 'HEAD':
+            if key not in objects:
+                return self._reply(404)
+            item = objects[key]
+            headers = {'ETag': f'"{item["etag"]}"', 'Content-Length': str(len(item['data']))}
+            if item['md5']:
+                headers['x-amz-meta-md5'] = item['md5']
+            return self._reply(200, headers=headers)
+
+        if self.command == 'GET' and not key:
+            keys = sorted(k for k in objects if k.startswith(params.get('prefix', '')))
+            start = int(params.get('continuation-token', 0))
+            page = keys[start:start + 2]
+            truncated = start + 2 < len(keys)
+            contents = ''.join(f'<Contents><Key>{k}</Key><Size>{len(objects[k]["data"])}</Size>'
+                               f'<ETag>"{objects[k]["etag"]}"</ETag></Contents>' for k in page)
+            token = f'<NextContinuationToken>{start + 2}</NextContinuationToken>' if truncated else ''
+            return self._reply(200, (f'<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">{contents}'
+                                     f'<IsTruncated>{str(truncated).lower()}</IsTruncated>{token}'
+                                     f'</ListBucketResult>').encode())
+
+        if self.command == 'GET':
+            if key not in objects:
+                return self._reply(404, b'<Error><Code>NoSuchKey</Code></Error>')
+            return self._reply(200, objects[key]['data'])
+
+        return self._reply(400)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _handle
+
+
+class S3StorageBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), S3Stub)
+        self.server.lock = threading.Lock()
+        self.server.state = {'objects': {}, 'uploads': {}, 'aborted': [], 'active': 0, 'max_active': 0,
+                             'fail_parts': 0}
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.backend = S3StorageBackend(f"http://127.0.0.1:{self.server.server_port}", BUCKET, ACCESS_KEY,
+                                        SECRET_KEY, region=REGION, prefix='db', part_size=5 * MB, workers=4,
+                                        sleep=lambda seconds: None)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_small_file_single_put(self):
+        data = b'small dump\n' * 100
+        md5 = hashlib.md5(data).hexdigest()
+
+        result = self.backend.put(io.BytesIO(data), 'small.sql.gz', len(data), md5)
+
+        self.assertEqual(result, {'id': 'db/small.sql.gz', 'size': len(data), 'md5': md5})
+        self.assertEqual(self.server.state['objects']['db/small.sql.gz']['data'], data)
+        self.assertEqual(self.backend.head('db/small.sql.gz')['md5'], md5)
+
+    def test_multipart_round_trip(self):
+        data = os.urandom(23 * MB)
+        md5 = hashlib.md5(data).hexdigest()
+
+        result = self.backend.put(io.BytesIO(data), 'large.sql.gz', len(data), md5)
+
+        self.assertEqual(result, {'id': 'db/large.sql.gz', 'size': len(data), 'md5': md5})
+        self.assertGreater(self.server.state['max_active'], 1)
+        self.assertEqual(self.server.state['objects']['db/large.sql.gz']['etag'], 'multipart-5')
+        self.assertEqual(self.backend.head('db/large.sql.gz'),
+                         {'id': 'db/large.sql.gz', 'name': 'large.sql.gz', 'size': len(data), 'md5': md5})
+
+        downloaded = io.BytesIO()
+        self.backend.get('db/large.sql.gz', downloaded)
+        self.assertEqual(hashlib.md5(downloaded.getvalue()).hexdigest(), md5)
+
+    def test_multipart_retries_failed_parts(self):
+        self.server.state['fail_parts'] = 2
+        data = os.urandom(12 * MB)
+
+        result = self.backend.put(io.BytesIO(data), 'retry.sql.gz')
+
+        self.assertEqual(result['md5'], hashlib.md5(data).hexdigest())
+        self.assertEqual(self.server.state['objects']['db/retry.sql.gz']['data'], data)
+
+    def test_multipart_aborted_on_failure(self):
+        self.server.state['fail_parts'] = 100
+        self.backend.max_retries = 1
+
+        with self.assertRaises(RuntimeError):
+            self.backend.put(io.BytesIO(os.urandom(11 * MB)), 'broken.sql.gz')
+
+        self.assertEqual(self.server.state['aborted'], ['db/broken.sql.gz'])
+        self.assertNotIn('db/broken.sql.gz', self.server.state['objects'])
+        self.assertIsNone(self.backend.head('db/broken.sql.gz'))
+
+    def test_list_pages_and_delete(self):
+        for name in ('a.gz', 'b.gz', 'c.gz'):
+            self.backend.put(io.BytesIO(name.encode()), name)
+        self.server.state['objects']['other/d.gz'] = {'data': b'd', 'etag': 'x', 'md5': None}
+
+        listed = self.backend.list()
+        self.assertEqual([item['name'] for item in listed], ['a.gz', 'b.gz', 'c.gz'])
+        self.assertEqual(listed[0]['md5'], hashlib.md5(b'a.gz').hexdigest())
+
+        self.backend.delete('db/b.gz')
+        self.backend.delete('db/missing.gz')
+        self.assertEqual([item['name'] for item in self.backend.list()], ['a.gz', 'c.gz'])
+
+    def test_bad_credentials_rejected(self):
+        self.backend.secret_key = 'wrong'
+
+        with self.assertRaises(RuntimeError):
+            self.backend.put(io.BytesIO(b'data'), 'denied.gz')
+
+
+class LocalStorageBackendTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.backend = LocalStorageBackend(os.path.join(self.temp_dir.name, 'storage'))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_round_trip(self):
+        data = os.urandom(3 * MB)
+
+        result = self.backend.put(io.BytesIO(data), 'dump.sql.gz')
+
+        self.assertEqual(result, {'id': 'dump.sql.gz', 'size': len(data), 'md5': hashlib.md5(data).hexdigest()})
+        self.assertEqual(self.backend.head('dump.sql.gz')['size'], len(data))
+        self.assertEqual([item['name'] for item in self.backend.list()], ['dump.sql.gz'])
+
+        downloaded = io.BytesIO()
+        self.backend.get('dump.sql.gz', downloaded)
+        self.assertEqual(downloaded.getvalue(), data)
+
+        self.backend.delete('dump.sql.gz')
+        self.assertIsNone(self.backend.head('dump.sql.gz'))
+
+
+if __name__ == '__main__':
+    unittest.main()